@@ -0,0 +1,21 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Benchmarks for prsannots, run against a fake reader.
+
+Run from the top of the source tree:
+
+  python -m benchmarks.run -o results.json
+
+Time the startup of each prsam subcommand with
+  
+  python -m benchmarks.startup -o startup.json
+
+and compare two sets of results (from either) with
+
+  python -m benchmarks.compare old.json new.json
+
+See the --help of each for more options.
+"""
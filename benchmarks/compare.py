@@ -0,0 +1,39 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Compare two sets of results from benchmarks.run.
+
+Usage: python -m benchmarks.compare old.json new.json
+"""
+
+import sys
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+def load(filename):
+    """Load results, as a dictionary keyed by (books, stage)."""
+    fd = open(filename)
+    data = json.load(fd)
+    fd.close()
+    return data, dict(((r['books'], r['stage']), r['seconds']) for r in data['results'])
+
+def main(args):
+    if len(args) != 2:
+        print __doc__.strip()
+        sys.exit(1)
+    olddata, old = load(args[0])
+    newdata, new = load(args[1])
+    print "old: %s (%s)" % (olddata.get('commit') or args[0], olddata.get('date'))
+    print "new: %s (%s)" % (newdata.get('commit') or args[1], newdata.get('date'))
+    print
+    print "%5s  %-20s %9s %9s %7s" % ('books', 'stage', 'old (s)', 'new (s)', 'ratio')
+    for key in sorted(set(old) & set(new)):
+        ratio = old[key] and new[key] / old[key] or float('nan')
+        print "%5i  %-20s %9.3f %9.3f %7.2f" % (key + (old[key], new[key], ratio))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,217 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Build a fake Sony Reader mount point for benchmarking.
+
+The fake reader has the same layout as a PRS-T1: a books.db database
+with books, markups, freehand, and annotation tables, notepad SVG
+files for the freehand annotations, note XML files for the text notes,
+and PDF files made up of pages of simple text.
+
+"""
+
+import os
+import random
+import sqlite3
+
+WORDS = ('the reader displays intersection annotation highlight page book '
+         'sony column figure table result method section theorem proof '
+         'equation value function energy model system analysis data '
+         'effect density field surface boundary condition solution').split()
+
+PAGE_SIZE = (612, 792)
+LINES_PER_PAGE = 40
+FONT_SIZE = 11
+LEADING = 16
+
+SCHEMA = '''
+create table books (_id integer primary key, title text, author text,
+                    file_path text, thumbnail text, mime_type text,
+                    added_date integer, modified_date integer);
+create table markups (_id integer primary key, content_id integer,
+                      markup_type integer, added_date integer,
+                      modified_date integer);
+create table freehand (_id integer primary key, content_id integer,
+                       markup_type integer, added_date integer,
+                       modified_date integer, page integer, total_page integer,
+                       svg_file text, crop_left real, crop_top real,
+                       crop_right real, crop_bottom real, orientation integer);
+create table annotation (_id integer primary key, content_id integer,
+                         markup_type integer, added_date integer,
+                         modified_date integer, page integer, total_page integer,
+                         marked_text text, file_path text);
+'''
+
+SVG_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<notepad xmlns="http://www.sony.com/notepad" version="1.0">
+<drawing width="%(width)i" height="%(height)i">
+<svg xmlns="http://www.w3.org/2000/svg" version="1.1" width="%(width)i" height="%(height)i">
+%(lines)s
+</svg>
+</drawing>
+</notepad>
+'''
+
+POLYLINE_TEMPLATE = ('<polyline points="%s" fill="none" stroke="#000000" stroke-width="3" '
+                     'stroke-linecap="round" stroke-linejoin="round"/>')
+
+NOTE_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<note><text>%s</text></note>
+'''
+
+
+def page_lines(rand, npages):
+    """Return a list, for each page, of the lines of text on that page."""
+    return [[' '.join(rand.choice(WORDS) for _ in range(rand.randint(6, 10)))
+             for _ in range(LINES_PER_PAGE)]
+            for _ in range(npages)]
+
+def write_text_pdf(filename, pages):
+    """Write a PDF file where each page is the list of lines in pages."""
+    objects = []
+    
+    def add(obj):
+        objects.append(obj)
+        return len(objects)
+    
+    catalog = add(None)
+    pages_num = add(None)
+    info = add('<< /Title (%s) /Producer (prsannots benchmark) >>'
+               % os.path.splitext(os.path.basename(filename))[0])
+    font = add('<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+    kids = []
+    for lines in pages:
+        ops = ['BT', '/F1 %i Tf' % FONT_SIZE, '%i TL' % LEADING,
+               '72 %i Td' % (PAGE_SIZE[1] - 72)]
+        for line in lines:
+            # Space words with kerning instead of space glyphs, as TeX does.
+            ops.append('[%s] TJ T*' % ' -300 '.join('(%s)' % w for w in line.split()))
+        ops.append('ET')
+        content = '\n'.join(ops)
+        stream = add('<< /Length %i >>\nstream\n%s\nendstream' % (len(content), content))
+        kids.append(add('<< /Type /Page /Parent %i 0 R /MediaBox [0 0 %i %i] '
+                        '/Resources << /Font << /F1 %i 0 R >> >> /Contents %i 0 R >>'
+                        % (pages_num, PAGE_SIZE[0], PAGE_SIZE[1], font, stream)))
+    objects[catalog-1] = '<< /Type /Catalog /Pages %i 0 R >>' % pages_num
+    objects[pages_num-1] = '<< /Type /Pages /Kids [%s] /Count %i >>' % (
+        ' '.join('%i 0 R' % k for k in kids), len(kids))
+    
+    fd = open(filename, 'wb')
+    fd.write('%PDF-1.4\n')
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(fd.tell())
+        fd.write('%i 0 obj\n%s\nendobj\n' % (i+1, obj))
+    xref = fd.tell()
+    fd.write('xref\n0 %i\n0000000000 65535 f \n' % (len(objects) + 1))
+    for off in offsets:
+        fd.write('%010i 00000 n \n' % off)
+    fd.write('trailer\n<< /Size %i /Root %i 0 R /Info %i 0 R >>\nstartxref\n%i\n%%%%EOF\n'
+             % (len(objects) + 1, catalog, info, xref))
+    fd.close()
+
+def write_svg(filename, rand, width=584, height=754, nstrokes=5, npoints=40):
+    """Write a notepad SVG file with some random strokes."""
+    lines = []
+    for _ in range(nstrokes):
+        x, y = rand.uniform(0, width), rand.uniform(0, height)
+        pts = []
+        for _ in range(npoints):
+            x = min(max(x + rand.uniform(-5, 5), 0), width)
+            y = min(max(y + rand.uniform(-5, 5), 0), height)
+            pts.append('%.1f,%.1f' % (x, y))
+        lines.append(POLYLINE_TEMPLATE % ' '.join(pts))
+    fd = open(filename, 'w')
+    fd.write(SVG_TEMPLATE % {'width': width, 'height': height, 'lines': '\n'.join(lines)})
+    fd.close()
+
+DIRS = {'db': 'Sony_Reader/database',
+        'books': 'Sony_Reader/media/books',
+        'drawings': 'Sony_Reader/media/drawings',
+        'notes': 'Sony_Reader/media/notes'}
+
+def make_reader(path, nbooks=1, npages=20, nhighlights=10, nnotes=5, nfreehand=5, seed=0):
+    """Create a fake reader at path, which must not already contain one.
+    
+    Inputs: path        The directory to act as the mount point.
+            
+            nbooks      The number of annotated PDF files on the reader.
+            
+            npages      The number of pages in each PDF file.
+            
+            nhighlights The number of plain highlights, text notes, and
+            nnotes      freehand drawings in each book.
+            nfreehand
+            
+            seed        The seed for the random number generator.
+    
+    Output: The path of the books.db database.
+    
+    """
+    rand = random.Random(seed)
+    for relpath in DIRS.values():
+        fullpath = os.path.join(path, *relpath.split('/'))
+        if not os.path.isdir(fullpath):
+            os.makedirs(fullpath)
+    
+    dbfn = os.path.join(path, *(DIRS['db'] + '/books.db').split('/'))
+    db = sqlite3.connect(dbfn)
+    db.executescript(SCHEMA)
+    for b in range(nbooks):
+        bookfn = '%s/book%03i.pdf' % (DIRS['books'], b)
+        pages = page_lines(rand, npages)
+        write_text_pdf(os.path.join(path, bookfn), pages)
+        add_book(db, path, bookfn, pages, nhighlights, nnotes, nfreehand, rand)
+    db.commit()
+    db.close()
+    return dbfn
+
+def add_book(db, path, bookfn, pages, nhighlights, nnotes, nfreehand, rand, date=1350000000000):
+    """Add the PDF file bookfn (relative to the mount point path) to the
+    database db, with random annotations.  pages are the lines of text
+    on each page, as from page_lines(), from which the highlighted text
+    is chosen.  Returns the id of the book.
+    
+    """
+    npages = len(pages)
+    c = db.execute('insert into books (title, author, file_path, thumbnail, mime_type, '
+                   'added_date, modified_date) values (?, ?, ?, ?, ?, ?, ?)',
+                   (os.path.basename(bookfn), 'Benchmark', bookfn, None, 'application/pdf',
+                    date, date))
+    book_id = c.lastrowid
+    name = os.path.splitext(os.path.basename(bookfn))[0]
+    
+    def markup(table, markup_type, **values):
+        values['content_id'] = book_id
+        values['markup_type'] = markup_type
+        values['added_date'] = values['modified_date'] = date
+        db.execute('insert into markups (content_id, markup_type, added_date, modified_date) '
+                   'values (?, ?, ?, ?)', (book_id, markup_type, date, date))
+        keys = sorted(values.keys())
+        db.execute('insert into %s (%s) values (%s)' % (table, ', '.join(keys),
+                                                       ', '.join('?' * len(keys))),
+                   [values[k] for k in keys])
+    
+    for i in range(nhighlights + nnotes):
+        page = rand.randrange(npages)
+        line = rand.choice(pages[page]).split()
+        start = rand.randrange(len(line) - 2)
+        text = ' '.join(line[start:start + rand.randint(2, len(line) - start)])
+        if i < nhighlights:
+            markup('annotation', 10, page=page, total_page=npages, marked_text=text)
+        else:
+            notefn = '%s/%s_%03i.xml' % (DIRS['notes'], name, i)
+            fd = open(os.path.join(path, notefn), 'w')
+            fd.write(NOTE_TEMPLATE % ' '.join(rand.choice(WORDS) for _ in range(12)))
+            fd.close()
+            markup('annotation', 11, page=page, total_page=npages, marked_text=text,
+                   file_path=notefn)
+    for i in range(nfreehand):
+        svgfn = '%s/%s_%03i.svg' % (DIRS['drawings'], name, i)
+        write_svg(os.path.join(path, svgfn), rand)
+        markup('freehand', 20, page=rand.randrange(npages), total_page=npages,
+               svg_file=svgfn, crop_left=0, crop_top=0, crop_right=584,
+               crop_bottom=754, orientation=0)
+    return book_id
@@ -0,0 +1,206 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Time each stage of the annotation pipeline on fake readers of
+several sizes, and output the results as JSON.
+
+Usage: python -m benchmarks.run [options]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from optparse import OptionParser
+from StringIO import StringIO
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from prsannots import __version__
+from prsannots.prst1 import Reader
+from prsannots.generic import Highlight
+from prsannots.documents import Document
+from prsannots.pdfdice import dice
+from prsannots.manager import Manager
+from prsannots.search import SearchIndex
+from prsannots.drawcache import DrawingCache
+from prsannots.pdfbackend import get_backend
+from benchmarks import fixture
+
+STAGES = ('reader', 'hash', 'layout', 'match', 'write', 'dice', 'optimize', 'sync')
+
+class Timer(object):
+    """Accumulates the time spent in each stage."""
+    
+    def __init__(self):
+        self.times = {}
+    
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0) + time.time() - start
+
+def fake_manager(mount, workdir):
+    """A Manager for the reader at mount, with every annotated book in
+    its library, set to sync to workdir.
+    
+    """
+    m = Manager()
+    m.settings = {'mount': mount, 'id': 'benchmark'}
+    m._ensure_base_settings()
+    m.reader = Reader(mount)
+    # Keep the search index and drawings out of the user's configuration
+    # directory.
+    m._search_index = SearchIndex(os.path.join(workdir, 'benchmark.idx'))
+    m._drawing_cache = DrawingCache(os.path.join(workdir, 'drawings'))
+    for book in m.reader.books:
+        m.library[book.file] = {'filename': os.path.join(workdir, os.path.basename(book.file)),
+                                'infix': 'annot', 'annhash': 0, 'dice_map': None}
+    return m
+
+def time_stages(mount, workdir, dice_args=(2, 2)):
+    """Time the stages of the pipeline once for the reader at mount.
+    Returns a dictionary mapping stage names to times in seconds.
+    
+    """
+    timer = Timer()
+    pdf_backend = get_backend()
+    reader = Reader(mount)
+    with timer.stage('reader'):
+        books = reader.books
+        for book in books:
+            book.annotations
+    with timer.stage('hash'):
+        for book in books:
+            book.hash
+    with timer.stage('layout'):
+        for book in books:
+            book.pdf_layout(0)
+    with timer.stage('match'):
+        for book in books:
+            for ann in book.annotations:
+                if isinstance(ann, Highlight):
+                    ann.bboxes
+    with timer.stage('write'):
+        for book in books:
+            book.backend = pdf_backend
+            book.write_annotated_pdf(StringIO())
+            book.close()
+    diced = []
+    with timer.stage('dice'):
+        for book in books:
+            with Document(os.path.join(mount, book.file)) as document:
+                inpdf = pdf_backend.open(document)
+                outpdf, dice_map = dice(inpdf, *dice_args, backend=pdf_backend)
+                stream = StringIO()
+                pdf_backend.write(outpdf, stream)
+                diced.append(stream.getvalue())
+                pdf_backend.close(inpdf)
+    with timer.stage('optimize'):
+        for data in diced:
+            pdf_backend.optimize(StringIO(data), StringIO())
+    
+    m = fake_manager(mount, workdir)
+    with timer.stage('sync'):
+        m.sync()
+    return timer.times
+
+def git_commit():
+    """The current git commit of the source tree, or None."""
+    try:
+        proc = subprocess.Popen(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        output, _ = proc.communicate()
+    except OSError:
+        return None
+    return output.strip() or None
+
+def run(sizes, npages, repeat, annotations, stream=sys.stderr):
+    """Run the benchmarks, returning a list of result dictionaries.
+    
+    Inputs: sizes       A list of the numbers of books to put on the
+                        fake readers.
+            
+            npages      The number of pages in each book.
+            
+            repeat      The number of times to time each stage.  The
+                        fastest time is reported.
+            
+            annotations A tuple (nhighlights, nnotes, nfreehand) of the
+                        number of annotations of each type per book.
+            
+            stream      Where to print a summary as the benchmarks run.
+    
+    """
+    results = []
+    for nbooks in sizes:
+        tmpdir = tempfile.mkdtemp(prefix='prsannots-bench-')
+        try:
+            mount = os.path.join(tmpdir, 'reader')
+            fixture.make_reader(mount, nbooks, npages, *annotations)
+            best = {}
+            for i in range(repeat):
+                workdir = tempfile.mkdtemp(dir=tmpdir)
+                for stage, seconds in time_stages(mount, workdir).items():
+                    best[stage] = min(seconds, best.get(stage, seconds))
+        finally:
+            shutil.rmtree(tmpdir)
+        
+        for stage in STAGES:
+            results.append({'books': nbooks, 'pages': nbooks * npages,
+                            'annotations': nbooks * sum(annotations),
+                            'stage': stage, 'seconds': best[stage]})
+            print >>stream, "%5i books  %-8s %9.3f s" % (nbooks, stage, best[stage])
+    return results
+
+def main(args):
+    parser = OptionParser(usage="python -m benchmarks.run [options]",
+                          description=__doc__.strip().split('\n\n')[0])
+    parser.add_option('-s', '--sizes', default='1,5,20',
+                      help='comma-separated numbers of books on the fake reader [%default]')
+    parser.add_option('-p', '--pages', type='int', default=20,
+                      help='pages in each book [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='times to repeat each measurement [%default]')
+    parser.add_option('-a', '--annotations', default='10,5,5',
+                      help='highlights, notes, and freehand annotations per book [%default]')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='write the JSON results to FILE instead of stdout')
+    options, args = parser.parse_args(args)
+    
+    try:
+        sizes = map(int, options.sizes.split(','))
+        annotations = tuple(map(int, options.annotations.split(',')))
+        if len(annotations) != 3:
+            raise ValueError
+    except ValueError:
+        parser.error("--sizes and --annotations must be comma-separated integers")
+    
+    output = {'prsannots': __version__,
+              'commit': git_commit(),
+              'python': sys.version.split()[0],
+              'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'results': run(sizes, options.pages, options.repeat, annotations)}
+    
+    if options.output:
+        fd = open(options.output, 'w')
+    else:
+        fd = sys.stdout
+    json.dump(output, fd, indent=1, sort_keys=True)
+    fd.write('\n')
+    if options.output:
+        fd.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
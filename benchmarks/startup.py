@@ -0,0 +1,156 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Time how long each prsam subcommand takes to run against a fake
+reader, and note which of the slow-to-import libraries each one loads.
+
+Usage: python -m benchmarks.startup [options]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from prsannots import __version__
+from prsannots import manager
+from prsannots.prst1 import Reader
+from benchmarks import fixture
+from benchmarks.run import git_commit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRSAM = os.path.join(ROOT, 'prsam')
+HEAVY_MODULES = ('pyPdf', 'pdfminer', 'xml', 'gi')
+
+# Runs a script given on the command line, and then reports which of
+# HEAVY_MODULES it imported on standard error.
+DRIVER = '''
+import sys, atexit
+def report():
+    loaded = set(name.split('.')[0] for name in sys.modules if sys.modules[name] is not None)
+    sys.stderr.write('\\nLOADED %%s\\n' %% ','.join(sorted(loaded & set(%r))))
+atexit.register(report)
+sys.argv = sys.argv[1:]
+sys.path.insert(0, %r)
+execfile(sys.argv[0], {'__name__': '__main__'})
+''' % (HEAVY_MODULES, ROOT)
+
+# Each subcommand, with the arguments to run it, given the mount point.
+# After its first run, sync has nothing left to do, so its best time is
+# that of checking the reader for changes.
+COMMANDS = (('--version', lambda mount: ['--version']),
+            ('ls', lambda mount: ['ls', '-m', mount]),
+            ('config', lambda mount: ['config', '-m', mount]),
+            ('remove', lambda mount: ['remove', '-m', mount, 'not-in-library.pdf']),
+            ('clean', lambda mount: ['clean', '-m', mount]),
+            ('sync -l', lambda mount: ['sync', '-l', '-m', mount]),
+            ('sync', lambda mount: ['sync', '-q', '-m', mount]),
+            ('search', lambda mount: ['search', 'theorem']),
+            ('add --help', lambda mount: ['add', '--help']),
+            ('watch --help', lambda mount: ['watch', '--help']))
+
+def make_library(mount, workdir, config_home):
+    """Set up a library for the fake reader at mount, with all of its
+    books syncing to workdir.  The configuration is saved under
+    config_home, not in the user's configuration directory.
+    
+    """
+    m = manager.Manager()
+    m.settings = {'mount': mount, 'id': 'startup-benchmark'}
+    m._ensure_base_settings()
+    m.settings['gs'] = False
+    for book in Reader(mount).books:
+        m.library[book.file] = {'filename': os.path.join(workdir, os.path.basename(book.file)),
+                                'infix': 'annot', 'annhash': 0, 'dice_map': None}
+    config_dir = manager.CONFIG_DIR
+    manager.CONFIG_DIR = os.path.join(config_home, 'prsannots')
+    try:
+        m.save()
+    finally:
+        manager.CONFIG_DIR = config_dir
+    fd = open(os.path.join(mount, m._id_file), 'w')
+    fd.write(m.settings['id'] + '\n')
+    fd.close()
+
+def time_command(args, env):
+    """Run prsam with args, returning the time taken and a list of the
+    HEAVY_MODULES that it loaded.
+    
+    """
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, '-c', DRIVER, PRSAM] + args, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    seconds = time.time() - start
+    loaded = []
+    for line in err.splitlines():
+        if line.startswith('LOADED '):
+            loaded = filter(None, line[len('LOADED '):].split(','))
+    return seconds, loaded
+
+def run(repeat, nbooks, npages, stream=sys.stderr):
+    """Time each of COMMANDS repeat times, returning a list of result
+    dictionaries.  The fastest time is reported.
+    
+    """
+    tmpdir = tempfile.mkdtemp(prefix='prsannots-startup-')
+    env = dict(os.environ)
+    env['XDG_CONFIG_HOME'] = os.path.join(tmpdir, 'config')
+    results = []
+    try:
+        mount = os.path.join(tmpdir, 'reader')
+        workdir = os.path.join(tmpdir, 'computer')
+        os.makedirs(workdir)
+        fixture.make_reader(mount, nbooks, npages)
+        make_library(mount, workdir, env['XDG_CONFIG_HOME'])
+        for name, args in COMMANDS:
+            best = None
+            for i in range(repeat):
+                seconds, loaded = time_command(args(mount), env)
+                best = min(seconds, best or seconds)
+            results.append({'books': nbooks, 'stage': 'prsam ' + name, 'seconds': best,
+                            'modules': loaded})
+            print >>stream, "prsam %-14s %7.3f s  %s" % (name, best, ', '.join(loaded))
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+def main(args):
+    parser = OptionParser(usage="python -m benchmarks.startup [options]",
+                          description=__doc__.strip().split('\n\n')[0])
+    parser.add_option('-b', '--books', type='int', default=5,
+                      help='books on the fake reader [%default]')
+    parser.add_option('-p', '--pages', type='int', default=5,
+                      help='pages in each book [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='times to repeat each measurement [%default]')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='write the JSON results to FILE instead of stdout')
+    options, args = parser.parse_args(args)
+    
+    output = {'prsannots': __version__,
+              'commit': git_commit(),
+              'python': sys.version.split()[0],
+              'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'results': run(options.repeat, options.books, options.pages)}
+    
+    if options.output:
+        fd = open(options.output, 'w')
+    else:
+        fd = sys.stdout
+    json.dump(output, fd, indent=1, sort_keys=True)
+    fd.write('\n')
+    if options.output:
+        fd.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,212 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import os
+import mmap
+
+class MappedStream(object):
+    """A read-only file object reading from a memory map (or string).
+    
+    Each MappedStream keeps its own position, so several of them may
+    read from the same map at once.  This lets pyPdf and pdfminer share
+    the map of a single file.
+    
+    """
+    
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+    
+    def read(self, size=-1):
+        start = self._pos
+        if size < 0:
+            self._pos = len(self._data)
+        else:
+            self._pos = min(start + size, len(self._data))
+        return self._data[start:self._pos]
+    
+    def readline(self, size=-1):
+        end = self._data.find('\n', self._pos)
+        if end == -1:
+            end = len(self._data)
+        else:
+            end += 1
+        if size >= 0:
+            end = min(end, self._pos + size)
+        start, self._pos = self._pos, end
+        return self._data[start:end]
+    
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += len(self._data)
+        if offset < 0:
+            raise IOError, "Invalid seek position"
+        self._pos = offset
+    
+    def tell(self):
+        return self._pos
+    
+    def close(self):
+        pass
+
+
+class Document(object):
+    """A PDF file, opened once and mapped into memory.
+    
+    Readers for the file are made with open_pdf() (for pyPdf) and
+    stream() (for anything else, such as pdfminer).  They all read from
+    the same map, and so stop working once the Document is closed.
+    
+    A Document may be used as a context manager, which closes it at
+    the end of the with block.
+    
+    """
+    
+    def __init__(self, filename, data=None):
+        """Open filename, unless its contents have already been read
+        into the string data.
+        
+        """
+        self.filename = filename
+        # The cross-reference table and trailer of the first pyPdf reader
+        self._xref = None
+        if data is not None:
+            self._map = data
+            return
+        fd = open(filename, 'rb')
+        try:
+            try:
+                self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError):
+                # Empty files cannot be mapped.
+                self._map = fd.read()
+        finally:
+            # The map keeps its own reference to the file.
+            fd.close()
+    
+    @property
+    def size(self):
+        """The size of the file, in bytes."""
+        return len(self._map)
+    
+    @property
+    def closed(self):
+        return self._map is None
+    
+    @property
+    def data(self):
+        """The contents of the file, as a memory map or string."""
+        if self._map is None:
+            raise ValueError, "Document %s is closed." % self.filename
+        return self._map
+    
+    def stream(self):
+        """A new file object for reading the file."""
+        if self._map is None:
+            raise ValueError, "Document %s is closed." % self.filename
+        return MappedStream(self._map)
+    
+    def open_pdf(self):
+        """A new pyPdf.PdfFileReader for the file.
+        
+        Each call gives an independent reader, so changes made to the
+        pages of one will not show up in another.  (pyPdf's writers
+        change the objects of the readers they copy from, so readers
+        can't be shared.)  Only the first reader parses the file's
+        cross-reference table; the others reuse it.
+        
+        """
+        import pyPdf
+        if self._xref is None:
+            pdf = pyPdf.PdfFileReader(self.stream())
+            if '/Encrypt' not in pdf.trailer:
+                self._xref = (pdf.xref, pdf.xref_objStm, pdf.trailer)
+            return pdf
+        
+        pdf = pyPdf.PdfFileReader.__new__(pyPdf.PdfFileReader)
+        pdf.flattenedPages = None
+        pdf.resolvedObjects = {}
+        pdf.stream = self.stream()
+        pdf._override_encryption = False
+        # pyPdf only reads these after parsing them.
+        pdf.xref, pdf.xref_objStm, trailer = self._xref
+        pdf.trailer = _rebind(trailer, pdf)
+        return pdf
+    
+    def close(self):
+        """Release the file.  Readers made from it may no longer be used."""
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._map = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class DocumentRegistry(object):
+    """The Documents opened during a sync, so that several library
+    entries made from the same file share one Document.
+    
+    Documents are known by the real path of their file, along with its
+    size and modification time, so a file that changes is opened anew.
+    They stay open until the registry is closed.  It may be used as a
+    context manager, which closes it at the end of the with block.
+    
+    """
+    
+    def __init__(self):
+        self._documents = {}
+    
+    def open(self, filename):
+        """Get the Document for filename.
+        
+        Output: A tuple (document, new), where new indicates whether
+                the document was just opened.
+        
+        """
+        st = os.stat(filename)
+        key = (os.path.realpath(filename), st.st_size, st.st_mtime)
+        document = self._documents.get(key)
+        if document is not None and not document.closed:
+            return document, False
+        document = self._documents[key] = Document(filename)
+        return document, True
+    
+    def close(self):
+        """Close all of the Documents."""
+        for document in self._documents.values():
+            document.close()
+        self._documents = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def _rebind(obj, pdf):
+    """A copy of the direct object obj, with its indirect references
+    pointing into the pyPdf reader pdf.
+    
+    """
+    from pyPdf.generic import IndirectObject, DictionaryObject, ArrayObject
+    if isinstance(obj, IndirectObject):
+        return IndirectObject(obj.idnum, obj.generation, pdf)
+    if isinstance(obj, DictionaryObject):
+        new = DictionaryObject()
+        for key, value in obj.iteritems():
+            new[key] = _rebind(value, pdf)
+        return new
+    if isinstance(obj, ArrayObject):
+        return ArrayObject([_rebind(value, pdf) for value in obj])
+    return obj
@@ -0,0 +1,119 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""A cache, on disk, of freehand drawings converted to PDF content.
+
+Most drawings on the reader don't change between syncs, but converting
+them means parsing each SVG file and writing out every point again.
+The cache keeps the converted content under the MD5 digest of the SVG
+file, along with the crop and orientation of the drawing, so that an
+unchanged drawing costs only a hash of its file and a read of the cache.
+
+Each entry is a zlib-compressed file in the cache directory.  When the
+entries grow beyond max_size bytes, the least recently used are
+removed.  Reading an entry updates its modification time, which marks
+it as used.
+"""
+
+import os
+import zlib
+import hashlib
+
+from fileops import AtomicFile
+
+DEFAULT_MAX_SIZE = 16 << 20
+# Change when svg_to_pdf_content() changes the content it makes.
+FORMAT = 1
+
+class DrawingCache(object):
+    """A cache of converted drawings, kept in directory."""
+    
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        # The total size of the entries, once known
+        self._size = None
+    
+    def key(self, digest, crop, orientation):
+        """The key of a drawing whose SVG file has the MD5 digest, with
+        the crop and orientation it was drawn with.
+        
+        """
+        return hashlib.md5(repr((FORMAT, digest, list(crop), orientation))).hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+    
+    def get(self, key):
+        """The converted drawing stored under key, as a tuple (width,
+        height, content), or None if there is none.  width and height
+        are the size of the SVG, as strings, and content is the PDF
+        drawing commands.
+        
+        """
+        path = self._path(key)
+        try:
+            fd = open(path, 'rb')
+            try:
+                data = fd.read()
+            finally:
+                fd.close()
+            width, height, content = zlib.decompress(data).split('\n', 2)
+        except (IOError, zlib.error, ValueError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return width, height, content
+    
+    def put(self, key, width, height, content):
+        """Store the converted drawing under key.  The arguments are as
+        returned by get().
+        
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        data = zlib.compress('\n'.join((width, height, content)))
+        with AtomicFile(self._path(key)) as fd:
+            fd.write(data)
+        if self._size is not None:
+            self._size += len(data)
+        self._evict()
+    
+    def _entries(self):
+        """A list of (mtime, size, path) for each entry, oldest first."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.'):
+                # An AtomicFile still being written
+                continue
+            path = self._path(name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        return entries
+    
+    def _evict(self):
+        """Remove the least recently used entries until the cache is no
+        larger than max_size.
+        
+        """
+        if self._size is not None and self._size <= self.max_size:
+            return
+        entries = self._entries()
+        self._size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if self._size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            self._size -= size
+
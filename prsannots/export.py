@@ -0,0 +1,98 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Export the annotations on a reader as a stream of records, without
+making annotated PDFs.
+
+Each record is a dictionary, describing one annotation, with keys
+  book      The file name of the book on the reader
+  title     The title of the book
+  page      The page number (from 0) of the PDF on the reader
+  type      One of 'highlight', 'note', 'drawing', or 'freehand'
+  added     When the annotation was made and last changed, in seconds
+  modified  since the epoch (or None)
+For highlights, notes, and drawings:
+  text      The highlighted text (or None)
+  note      The text of the note (or None)
+  bboxes    A list of [x0, y0, x1, y1] boxes, in PDF coordinates relative
+            to the mediaBox, covering the highlighted text.  None if the
+            text could not be found on the page.  Left out if bounding
+            boxes were not requested.
+For freehand drawings:
+  width     The size of the drawing
+  height
+  crop      The part of the page, [left, top, right, bottom], shown when
+            the drawing was made
+  orientation
+  strokes   A list of strokes, each a list of [x, y] points in the
+            drawing's coordinates, with the origin at the top left
+
+Books are handled one at a time, and their caches dropped afterwards,
+so the memory used does not grow with the size of the reader.
+"""
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from generic import Freehand, HIGHLIGHT, HIGHLIGHT_TEXT, HIGHLIGHT_DRAWING
+
+TYPES = {HIGHLIGHT: 'highlight', HIGHLIGHT_TEXT: 'note', HIGHLIGHT_DRAWING: 'drawing'}
+
+def annotation_record(ann, bboxes=True):
+    """A dictionary describing the annotation ann.  Finding the bounding
+    boxes of highlights requires the layout of the page, which is slow.
+    Set bboxes to False to skip them.
+    
+    """
+    record = {'book': ann.book.file, 'title': ann.book.title, 'page': ann.page,
+              'added': ann.added, 'modified': ann.modified}
+    if isinstance(ann, Freehand):
+        record['type'] = 'freehand'
+        record['width'], record['height'] = [float(ann.svg.getAttribute(x))
+                                             for x in ('width', 'height')]
+        record['crop'] = ann.crop
+        record['orientation'] = ann.orientation
+        record['strokes'] = ann.strokes
+    else:
+        record['type'] = TYPES.get(ann.content_type, 'highlight')
+        record['text'] = isinstance(ann.area, basestring) and ann.area or None
+        record['note'] = ann.note
+        if bboxes:
+            boxes = ann.bboxes
+            record['bboxes'] = boxes is not None and [map(float, bb) for bb in boxes] or None
+    return record
+
+def book_records(book, bboxes=True):
+    """Generate the records for the annotations of book.  Afterwards, the
+    book's file is closed and its layouts and annotations forgotten.
+    
+    """
+    try:
+        for ann in book.annotations:
+            yield annotation_record(ann, bboxes)
+    finally:
+        book.close()
+        book.forget_layouts()
+        book.forget_annotations()
+
+def reader_records(reader, bboxes=True):
+    """Generate the records for all annotations on reader."""
+    for book in reader.books:
+        for record in book_records(book, bboxes):
+            yield record
+
+def write_json_lines(records, stream):
+    """Write each record as a line of JSON to stream.  Returns the
+    number of records written.
+    
+    """
+    count = 0
+    for record in records:
+        stream.write(json.dumps(record, sort_keys=True))
+        stream.write('\n')
+        count += 1
+    return count
@@ -0,0 +1,196 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import os
+import sys
+import shutil
+import hashlib
+from tempfile import mkstemp
+
+BUFSIZE = 1 << 20
+
+def file_digest(filename, bufsize=BUFSIZE):
+    """The MD5 digest of the contents of filename."""
+    md5 = hashlib.md5()
+    fd = open(filename, 'rb')
+    try:
+        while True:
+            data = fd.read(bufsize)
+            if not data:
+                break
+            md5.update(data)
+    finally:
+        fd.close()
+    return md5.digest()
+
+def same_contents(filename1, filename2):
+    """Whether the two files exist and have the same contents."""
+    try:
+        if os.path.getsize(filename1) != os.path.getsize(filename2):
+            return False
+        return file_digest(filename1) == file_digest(filename2)
+    except (OSError, IOError):
+        return False
+
+def file_signature(filename):
+    """The size and modification time of filename, which change when
+    it does, or None if it does not exist.
+    
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime)
+
+def copy_file(src, dst, progress=None, bufsize=BUFSIZE):
+    """Copy the file src to dst, unless dst already has the same contents.
+    
+    Inputs: src         The file to copy.
+            
+            dst         The file to copy to.  (Not a directory.)
+            
+            progress    If not None, a function that will be called as
+                        progress(bytes_copied, total_bytes) after each
+                        chunk is written.  If it raises an exception,
+                        the partial copy is removed.
+            
+            bufsize     The size of the chunks to copy.
+    
+    Output: A Boolean indicating whether the file was copied.
+    
+    The copy is flushed to disk before returning, so it is safe to
+    unmount the destination afterwards.  Raises an IOError if the copy
+    does not end up the same size as the original.
+    
+    """
+    if same_contents(src, dst):
+        return False
+    
+    total = os.path.getsize(src)
+    copied = 0
+    fsrc = open(src, 'rb')
+    try:
+        fdst = open(dst, 'wb')
+        try:
+            while True:
+                data = fsrc.read(bufsize)
+                if not data:
+                    break
+                fdst.write(data)
+                copied += len(data)
+                if progress is not None:
+                    progress(copied, total)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+        except:
+            fdst.close()
+            os.unlink(dst)
+            raise
+        fdst.close()
+    finally:
+        fsrc.close()
+    if os.path.getsize(dst) != total:
+        raise IOError, "Copy of %s to %s is incomplete." % (src, dst)
+    shutil.copymode(src, dst)
+    return True
+
+def replace_file(src, dst):
+    """Rename src to dst, replacing dst if it exists."""
+    if sys.platform == 'win32' and os.path.exists(dst):
+        # Windows won't rename over an existing file.
+        os.unlink(dst)
+    os.rename(src, dst)
+
+def default_mode():
+    """The permissions a newly created file would get."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0666 & ~umask
+
+class AtomicFile(object):
+    """A file object that writes to a temporary file, which replaces
+    filename when closed, but only if the contents differ.  This
+    prevents partially written files and leaves the modification time
+    of unchanged files alone.
+    
+    Use as a context manager:
+        with AtomicFile(filename) as fd:
+            fd.write(...)
+        if not fd.changed:
+            ...
+    
+    If an exception is raised inside the with block, the temporary file
+    is removed and filename is untouched.
+    
+    """
+    
+    def __init__(self, filename):
+        self.filename = filename
+        dirname, basename = os.path.split(os.path.abspath(filename))
+        tmpfd, self.tmpname = mkstemp(prefix='.%s.' % basename, dir=dirname)
+        self._fd = os.fdopen(tmpfd, 'wb')
+        self._md5 = hashlib.md5()
+        self.size = 0
+        self.changed = None
+    
+    def write(self, data):
+        self._md5.update(data)
+        self.size += len(data)
+        self._fd.write(data)
+    
+    def tell(self):
+        return self._fd.tell()
+    
+    def flush(self):
+        self._fd.flush()
+    
+    def _unchanged(self):
+        try:
+            if os.path.getsize(self.filename) != self.size:
+                return False
+            return file_digest(self.filename) == self._md5.digest()
+        except (OSError, IOError):
+            return False
+    
+    def close(self):
+        """Replace filename with the new contents, if they differ.
+        Sets self.changed to indicate whether filename was replaced.
+        
+        """
+        if self._fd.closed:
+            return
+        self._fd.close()
+        if self._unchanged():
+            os.unlink(self.tmpname)
+            self.changed = False
+            return
+        
+        # mkstemp makes a private file; give it the permissions it would
+        # have had if opened normally.
+        if os.path.exists(self.filename):
+            mode = os.stat(self.filename).st_mode & 0777
+        else:
+            mode = default_mode()
+        os.chmod(self.tmpname, mode)
+        replace_file(self.tmpname, self.filename)
+        self.changed = True
+    
+    def discard(self):
+        """Throw away what has been written, leaving filename untouched."""
+        if not self._fd.closed:
+            self._fd.close()
+        if os.path.exists(self.tmpname):
+            os.unlink(self.tmpname)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
@@ -3,14 +3,17 @@
 # This file is part of prsannots and is distributed under the terms of
 # the LGPL license.  See the file COPYING for full details.
 
+# pyPdf, PDFMiner, and the XML parser are slow to import, and many
+# uses of this module need none of them.  They are imported by the
+# methods that use them.
 import os
-from xml.dom import minidom
+from bisect import bisect_right
 from StringIO import StringIO
 import hashlib
-import pyPdf
-from pagetext import PageText, get_layouts, NoSubstringError, MultipleSubstringError
-from pdfannotation import highlight_annotation, text_annotation, add_annotation
-from pdfcontent import pdf_add_content, svg_to_pdf_content
+from documents import Document
+from fileops import file_digest
+from stats import NULL_STATS
+from progress import NULL_PROGRESS, ProgressStream
 
 HIGHLIGHT, HIGHLIGHT_TEXT, HIGHLIGHT_DRAWING = 10, 11, 12
 
@@ -30,6 +33,133 @@ class OneToOneMap(object):
             raise IndexError
         return (num, None)
 
+    def tiles(self, page):
+        """The pages on the reader made from page of the original."""
+        if page < 0 or page >= self.npages:
+            return xrange(0)
+        return xrange(page, page + 1)
+
+class DiceMap(object):
+    """Describes how the pages of a diced PDF were cut from the original.
+    
+    A DiceMap acts like a list of (page, bbox) tuples, one for each page
+    of the diced PDF, where page is the page of the original PDF and bbox
+    the region of it shown on the diced page.  Rather than storing every
+    bbox, it stores the dicing grid once for each run of original pages
+    that were diced the same way.
+    
+    """
+    
+    def __init__(self):
+        # Each run is (first page, number of pages, first diced page,
+        # ncols, nrows, grid), where grid is the tuple returned by
+        # pdfdice.dice_grid().
+        self._runs = []
+        self._build_index()
+    
+    def _build_index(self):
+        self._first_tiles = [run[2] for run in self._runs]
+        self._first_pages = [run[0] for run in self._runs]
+        if self._runs:
+            page, npages, tile, ncols, nrows, grid = self._runs[-1]
+            self._ntiles = tile + npages * ncols * nrows
+        else:
+            self._ntiles = 0
+    
+    def __getstate__(self):
+        # Not the bare list of runs, which pickle protocols 0 and 1 would
+        # drop, with no call to __setstate__, when empty.
+        return {'runs': self._runs}
+    
+    def __setstate__(self, state):
+        # Earlier versions pickled the bare list.
+        if isinstance(state, dict):
+            state = state['runs']
+        self._runs = state
+        self._build_index()
+    
+    @staticmethod
+    def bbox(grid, ncols, nrows, tile):
+        """The bbox of the tile-th piece of a page diced with grid.
+        
+        Pieces are numbered down each column, starting at the top left.
+        
+        """
+        x0, y0, width, height, xspace, yspace = grid
+        col, row = tile // nrows, nrows - 1 - tile % nrows
+        return (col * xspace + x0, row * yspace + y0,
+                col * xspace + x0 + width, row * yspace + y0 + height)
+    
+    def append(self, page, ncols, nrows, grid):
+        """Record that page of the original was diced into ncols columns
+        and nrows rows with grid, and appended to the diced PDF.
+        
+        """
+        grid = tuple(grid)
+        if self._runs:
+            first, npages, tile, rcols, rrows, rgrid = self._runs[-1]
+            if first + npages == page and (rcols, rrows, rgrid) == (ncols, nrows, grid):
+                self._runs[-1] = (first, npages + 1, tile, rcols, rrows, rgrid)
+                self._ntiles += ncols * nrows
+                return
+        self._runs.append((page, 1, self._ntiles, ncols, nrows, grid))
+        self._build_index()
+    
+    def __len__(self):
+        return self._ntiles
+    
+    def __getitem__(self, num):
+        if num < 0:
+            num += self._ntiles
+        if num < 0 or num >= self._ntiles:
+            raise IndexError
+        first, npages, tile, ncols, nrows, grid = self._runs[bisect_right(self._first_tiles, num) - 1]
+        page, piece = divmod(num - tile, ncols * nrows)
+        return (first + page, self.bbox(grid, ncols, nrows, piece))
+    
+    def tiles(self, page):
+        """The pages on the reader made from page of the original."""
+        i = bisect_right(self._first_pages, page) - 1
+        if i < 0:
+            return xrange(0)
+        first, npages, tile, ncols, nrows, grid = self._runs[i]
+        if page >= first + npages:
+            return xrange(0)
+        start = tile + (page - first) * ncols * nrows
+        return xrange(start, start + ncols * nrows)
+
+class ListDiceMap(object):
+    """Wraps a dice map stored as a list of (page, bbox) tuples, as was
+    done by earlier versions, to provide the same interface as DiceMap.
+    
+    """
+    
+    def __init__(self, dice_map):
+        self._map = dice_map
+        self._tiles = {}
+        for i, (page, bbox) in enumerate(dice_map):
+            start, stop = self._tiles.get(page, (i, i))
+            self._tiles[page] = (start, i + 1)
+    
+    def __len__(self):
+        return len(self._map)
+    
+    def __getitem__(self, num):
+        return self._map[num]
+    
+    def tiles(self, page):
+        """The pages on the reader made from page of the original."""
+        return xrange(*self._tiles.get(page, (0, 0)))
+
+def load_dice_map(dice_map):
+    """Return a dice map with the DiceMap interface from dice_map, which
+    may be None, a list of (page, bbox) tuples, or a DiceMap.
+    
+    """
+    if isinstance(dice_map, list):
+        return ListDiceMap(dice_map)
+    return dice_map
+
 class Reader(object):
     """Represents an ereader, with its annotated books.
     
@@ -49,6 +179,27 @@ class Reader(object):
     def _get_books(self):
         raise NotImplementedError, "Subclasses must implement a _get_books() method."
     
+    def refresh(self, changed=None):
+        """Reread the list of books, keeping the Book objects for those
+        already known, along with their cached layouts.
+        
+        Input:  changed     A collection of file names of books whose
+                            annotations should be reread.  If None, the
+                            annotations of all books are reread.
+        
+        """
+        if not hasattr(self, '_books'):
+            return
+        old = dict((b.file, b) for b in self._books)
+        books = []
+        for book in self._get_books():
+            if book.file in old and old[book.file].id == book.id:
+                book = old[book.file]
+                if changed is None or book.file in changed:
+                    book.forget_annotations()
+            books.append(book)
+        self._books = books
+    
     def __getitem__(self, filepath):
         # The path as saved in the database uses '/' for the path separator.
         filepath = filepath.replace(os.path.sep, '/')
@@ -61,14 +212,36 @@ class Reader(object):
 class Book(object):
     """Represents a PDF file stored on the ereader."""
     
+    # Set to a stats.Stats object to record where the time goes.
+    stats = NULL_STATS
+    # Set to a progress.Progress object to follow write_annotated_pdf().
+    progress = NULL_PROGRESS
+    # The pages to lay out when a layout is first needed, or None for all.
+    layout_pages = None
+    # Set either to find the text of pages in worker processes, with
+    # these limits (in seconds per page and MB).  See layoutworker.
+    layout_timeout = None
+    layout_memory = None
+    # Set to a drawcache.DrawingCache to reuse converted drawings.
+    drawing_cache = None
+    # Set to a prefetch.Prefetcher that reads this book's files ahead.
+    prefetcher = None
+    # Set to the pdfbackend backend to read and write the PDF file with,
+    # or None for the preferred one installed.
+    backend = None
+    
     def __init__(self, reader, id_, title, filepath, thumbnail):
         self.reader = reader
         self.id = id_
         self.title = title
         self.file = filepath
         self.thumbnail = thumbnail
+        self._document = None
         self._layouts = None
         self._page_texts = {}
+        self._analyzed_texts = {}
+        # Pages whose text could not be found, mapped to the reason
+        self.layout_failures = {}
     
     @property
     def annotations(self):
@@ -81,6 +254,27 @@ class Book(object):
     def _get_annotations(self):
         raise NotImplementedError, "Subclasses must implement a _get_annotations() method."
     
+    def forget_annotations(self):
+        """Drop the cached annotations, so that they are reread when
+        next needed.
+        
+        """
+        for attr in ('_annotations', '_annotations_by_page', '_hash'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+    
+    @property
+    def annotations_by_page(self):
+        """A dictionary mapping page numbers to lists of the annotations
+        on that page.
+        
+        """
+        if not hasattr(self, '_annotations_by_page'):
+            self._annotations_by_page = {}
+            for ann in self.annotations:
+                self._annotations_by_page.setdefault(ann.page, []).append(ann)
+        return self._annotations_by_page
+    
     @property
     def hash(self):
         """A number unique to the current annotation state."""
@@ -89,90 +283,381 @@ class Book(object):
             self._hash = hashlib.md5(''.join(hashes)).digest()
         return self._hash
     
+    @property
+    def hash_known(self):
+        """Whether self.hash is known, without reading the files of the
+        annotations.
+        
+        """
+        return hasattr(self, '_hash')
+    
+    @property
+    def document(self):
+        """The documents.Document for the PDF file, which is opened once
+        and shared by self.pdf and self.pdf_layout().
+        
+        """
+        if self._document is None or self._document.closed:
+            filename = os.path.join(self.reader.path, self.file)
+            self._document = Document(filename, self.prefetched(filename))
+            self.stats.count('bytes_read', self._document.size)
+        return self._document
+    
+    def reader_files(self, pdf=True):
+        """The files on the reader that syncing this book reads: those of
+        its drawings and notes and, if pdf, the PDF file itself.
+        
+        """
+        files = []
+        for ann in self.annotations:
+            if isinstance(ann, Freehand):
+                files.append(ann.svg_file)
+            elif ann.content_type is HIGHLIGHT_TEXT:
+                files.append(ann.content)
+        if pdf:
+            files.append(self.file)
+        return [os.path.join(self.reader.path, f) for f in files]
+    
+    def prefetched(self, filename):
+        """The contents of filename, if self.prefetcher has read it (or
+        is reading it), or None.
+        
+        """
+        if self.prefetcher is None:
+            return None
+        with self.stats.stage('prefetch'):
+            return self.prefetcher.get(filename)
+    
+    @property
+    def pdf_backend(self):
+        """self.backend, or the default backend if it is None."""
+        if self.backend is not None:
+            return self.backend
+        from pdfbackend import get_backend
+        return get_backend()
+    
     @property
     def pdf(self):
-        """A pyPdf.PdfFileReader instance of the PDF file."""
-        return pyPdf.PdfFileReader(open(os.path.join(self.reader.path, self.file), 'rb'))
+        """The PDF file, newly opened by self.pdf_backend."""
+        return self.pdf_backend.open(self.document)
     
     def pdf_layout(self, page):
         """Get a pdfminer.LTPage object for page."""
-        if self._layouts is None:
-            self._layouts = get_layouts(open(os.path.join(self.reader.path, self.file), 'rb'))
+        if self._layouts is None or self._layouts[page] is None:
+            from pagetext import get_layouts
+            if self._layouts is None:
+                pages = self.layout_pages
+            else:
+                # Left out of an earlier, partial layout.
+                pages = set([page])
+            with self.stats.stage('layout'):
+                layouts = get_layouts(self.document.stream(), pages)
+                self.stats.count('pages', len(layouts) - layouts.count(None))
+            if self._layouts is None:
+                self._layouts = layouts
+            else:
+                self._layouts[page] = layouts[page]
         return self._layouts[page]
     
+    def close(self):
+        """Release the PDF file.  PdfFileReaders from self.pdf may not
+        be used afterwards, but layouts already found are kept.
+        
+        """
+        if self._document is not None:
+            self._document.close()
+            self._document = None
+    
+    def forget_layouts(self):
+        """Drop the cached layouts and page texts, to save memory."""
+        self._layouts = None
+        self._page_texts = {}
+        self._analyzed_texts = {}
+        self.layout_failures = {}
+    
     def page_text(self, page):
-        """Get the pagetext.PageText object for page."""
+        """Get the pagetext.PageText object for page, or None if its text
+        could not be found within the limits of a layout worker.
+        
+        """
         if page not in self._page_texts:
-            self._page_texts[page] = PageText(self.pdf_layout(page))
+            if self.layout_timeout or self.layout_memory:
+                self._find_page_texts(page)
+            else:
+                from pagetext import PageText
+                self._page_texts[page] = PageText(self.pdf_layout(page))
         return self._page_texts[page]
     
-    def write_annotated_pdf(self, outfd, pdf=None, dice_map=None, **kw):
+    def analyzed_page_text(self, page):
+        """Get the pagetext.PageText object for page from PDFMiner's full
+        layout analysis, or None if its text could not be found within
+        the limits of a layout worker.  This is slower than page_text(),
+        but puts the text in the order PDFMiner always has.
+        
+        """
+        if page not in self._analyzed_texts:
+            from pagetext import PageText
+            with self.stats.stage('layout'):
+                if self.layout_timeout or self.layout_memory:
+                    from layoutworker import extract_page_texts
+                    document = self.document
+                    texts, failures = extract_page_texts(document.filename, [page],
+                                                         self.layout_timeout, self.layout_memory,
+                                                         self.progress, document.data, True)
+                    self._analyzed_texts[page] = texts.get(page)
+                else:
+                    from pagetext import get_layouts
+                    from pdfminer.layout import LAParams
+                    layout = get_layouts(self.document.stream(), set([page]), LAParams())[page]
+                    self._analyzed_texts[page] = PageText(layout)
+                self.stats.count('pages', 1)
+        return self._analyzed_texts[page]
+    
+    def _find_page_texts(self, page):
+        """Find the text of page, and of the other pages with highlights
+        that will need it, in layout workers.
+        
+        """
+        from layoutworker import extract_page_texts
+        pages = set(ann.page for ann in self.annotations
+                    if isinstance(ann, Highlight) and isinstance(ann.area, basestring))
+        if self.layout_pages is not None:
+            pages &= self.layout_pages
+        pages.add(page)
+        pages.difference_update(self._page_texts)
+        # The workers read the map shared with pyPdf, rather than the reader.
+        document = self.document
+        with self.stats.stage('layout'):
+            texts, failures = extract_page_texts(document.filename, pages, self.layout_timeout,
+                                                 self.layout_memory, self.progress, document.data)
+            self.stats.count('pages', len(texts))
+        self._page_texts.update(texts)
+        for p, reason in failures.iteritems():
+            self._page_texts[p] = None
+            self.layout_failures[p] = reason
+    
+    def write_annotated_pdf(self, outfd, pdf=None, dice_map=None, previous=None,
+                            previous_hashes=None, streaming=None, **kw):
         """Write an annotated version of the PDF file.
         
         Inputs: outfd       A file object, to which the PDF is output.
                 
-                pdf         The original PDF file.  If None, use self.pdf.
+                pdf         The original PDF file, as opened by
+                            self.pdf_backend.  If None, use self.pdf.
                 
                 dice_map    The dice map describing how the PDF on the
                             reader was made from the original PDF file.
+                            Either a DiceMap or, as stored by earlier
+                            versions, a list of (page, bbox) tuples.
+                
+                previous    An annotated PDF written earlier from the
+                            same original, with the same options, as
+                            opened by self.pdf_backend, or None.
+                
+                previous_hashes  The page hashes returned when previous
+                            was written.  Pages whose annotations have
+                            not changed since are copied from previous,
+                            rather than being annotated again.
+                
+                streaming   Whether to annotate and write the pages one
+                            at a time, if the backend can.  If None, do
+                            so for files of more than
+                            pdfwriter.STREAMING_PAGES pages.
                 
                 Other keywords are passed on to the annotations'
                 write_to_pdf() methods.
         
+        Output: A dictionary mapping the number of each annotated page of
+                the original to a hash of its annotations, for use as
+                previous_hashes next time.
+        
         """
+        backend = self.pdf_backend
         if pdf is None:
             pdf = self.pdf
+        npages = backend.num_pages(pdf)
         if dice_map is None:
-            dice_map = OneToOneMap(len(self.pdf.pages))
+            dice_map = OneToOneMap(npages)
+        else:
+            dice_map = load_dice_map(dice_map)
+        
+        # Find the annotated pages of the original, so that the rest can
+        # be copied without further inspection.
+        orig_pages = {}
+        for j, anns in self.annotations_by_page.iteritems():
+            if 0 <= j < len(dice_map):
+                i, crop = dice_map[j]
+                orig_pages.setdefault(i, []).append((j, crop, anns))
+        hashes = {}
+        for i, subpages in orig_pages.iteritems():
+            subpages.sort()
+            hashes[i] = hashlib.md5(''.join(repr((j, crop)) + ''.join(ann.hash for ann in anns)
+                                            for j, crop, anns in subpages)).digest()
+        
+        # Pages with their own annotations, such as links, are redone, lest
+        # their destinations pull in the previous version's pages.
+        if previous is None or previous_hashes is None or backend.num_pages(previous) != npages:
+            reuse = set()
+        else:
+            reuse = set(i for i in orig_pages if previous_hashes.get(i) == hashes[i]
+                        and not backend.has_annotations(backend.page(pdf, i)))
+        # Only lay out the reader's pages that will be annotated anew.
+        self.layout_pages = set(j for i in orig_pages if i not in reuse
+                                for j, crop, anns in orig_pages[i])
         
-        outpdf = pyPdf.PdfFileWriter()
-        j = k = 0
-        for i, page in enumerate(pdf.pages):
-            while j < len(dice_map) and dice_map[j][0] == i:
-                while k < len(self.annotations) and self.annotations[k].page == j:
-                    self.annotations[k].write_to_pdf(page, crop=dice_map[j][1], outpdf=outpdf, **kw)
-                    k += 1
-                j += 1
-            outpdf.addPage(page)
-        outpdf.write(outfd)
+        def annotated_pages(outpdf):
+            for i in xrange(npages):
+                self.progress.check()
+                page = backend.page(pdf, i)
+                if i in reuse or i in orig_pages:
+                    page = backend.page_to_change(outpdf, page)
+                if i in reuse:
+                    # The annotations only add to the page's contents and
+                    # annotations, so take those from the previous version.
+                    with self.stats.stage('reuse'):
+                        self.stats.count('pages')
+                        backend.reuse_page(pdf, page, backend.page(previous, i))
+                elif i in orig_pages:
+                    with self.stats.stage('annotate'):
+                        self.stats.count('pages')
+                        vskip = [0]
+                        for j, crop, anns in orig_pages[i]:
+                            for ann in anns:
+                                ann.write_to_pdf(page, crop=crop, outpdf=outpdf, backend=backend,
+                                                 vskip=vskip, **kw)
+                                self.stats.count('annotations')
+                yield page
+                self.progress.pages(i + 1, npages)
+        
+        self.progress.stage('annotate', self.file)
+        try:
+            # When streaming, the pages are annotated as they are written.
+            outpdf = backend.writer(annotated_pages, npages, streaming)
+            self.progress.stage('write', self.file)
+            self._write_pdf(backend, outpdf, outfd)
+        finally:
+            self.layout_pages = None
+        # Pages whose text couldn't be found are tried again next time.
+        for i, subpages in orig_pages.iteritems():
+            if [j for j, crop, anns in subpages if j in self.layout_failures]:
+                del hashes[i]
+        return hashes
+    
+    def _write_pdf(self, backend, outpdf, outfd):
+        """Write outpdf to outfd, reporting the progress."""
+        with self.stats.stage('write'):
+            start = outfd.tell()
+            stream = ProgressStream(outfd, self.progress)
+            backend.write(outpdf, stream)
+            stream.report()
+            self.stats.count('bytes_written', outfd.tell() - start)
 
 
 class Freehand(object):
     """Represents a freehand annotation to a Book."""
     
-    def __init__(self, book, page, svg_file, crop_left, crop_top, crop_right, crop_bottom, orientation):
+    def __init__(self, book, page, svg_file, crop_left, crop_top, crop_right, crop_bottom, orientation,
+                 added=None, modified=None):
         self.book = book
         self.page = int(page)
         self.svg_file = svg_file
         self.crop = map(float, (crop_left, crop_top, crop_right, crop_bottom))
         self.orientation = int(orientation)
+        self.added = added
+        self.modified = modified
     
     @property
     def svg(self):
         """The SVG associated with the annotation, as a minidom object."""
         if not hasattr(self, '_svg'):
-            doc = minidom.parse(os.path.join(self.book.reader.path, self.svg_file))
+            from xml.dom import minidom
+            filename = os.path.join(self.book.reader.path, self.svg_file)
+            data = self.book.prefetched(filename)
+            if data is not None:
+                doc = minidom.parseString(data)
+            else:
+                doc = minidom.parse(filename)
             drawing = doc.getElementsByTagNameNS('http://www.sony.com/notepad', 'drawing')[0]
             self._svg = doc.getElementsByTagNameNS('http://www.w3.org/2000/svg','svg')[0]
             for attr in ('width', 'height'):
                 self._svg.setAttribute(attr, drawing.getAttribute(attr))
         return self._svg
     
+    @property
+    def strokes(self):
+        """A list of the strokes in the drawing, each a list of (x, y)
+        points in the coordinates of the SVG, with the origin at the top
+        left.
+        
+        """
+        strokes = []
+        for node in self.svg.getElementsByTagNameNS('http://www.w3.org/2000/svg', 'polyline'):
+            pts = map(float, node.getAttribute('points').replace(',', ' ').split())
+            strokes.append(zip(pts[0::2], pts[1::2]))
+        return strokes
+    
+    @property
+    def digest(self):
+        """The MD5 digest of the SVG file."""
+        if not hasattr(self, '_digest'):
+            filename = os.path.join(self.book.reader.path, self.svg_file)
+            data = self.book.prefetched(filename)
+            if data is not None:
+                self._digest = hashlib.md5(data).digest()
+            else:
+                self._digest = file_digest(filename)
+        return self._digest
+    
     @property
     def hash(self):
         """Uniquely identifies the current annotation."""
-        return hashlib.md5(str(self.crop) + str(self.orientation) + self.svg.toxml('utf-8')).digest()
+        return hashlib.md5(str(self.crop) + str(self.orientation) + self.digest).digest()
     
-    def write_to_pdf(self, page, crop=None, **kw):
-        """Write the annotation to the page which will be in outpdf."""
+    def pdf_content(self):
+        """The drawing as PDF drawing commands, taken from the book's
+        drawing_cache if possible.
+        
+        Output: A tuple (width, height, content) of the size of the SVG,
+                as strings, and the commands.
+        
+        """
+        cache = self.book.drawing_cache
+        if cache is not None:
+            key = cache.key(self.digest, self.crop, self.orientation)
+            converted = cache.get(key)
+            if converted is not None:
+                return converted
+        from pdfcontent import svg_to_pdf_content
+        converted = (self.svg.getAttribute('width'), self.svg.getAttribute('height'),
+                     svg_to_pdf_content(self.svg))
+        if cache is not None:
+            cache.put(key, *converted)
+        return converted
+    
+    def write_to_pdf(self, page, crop=None, backend=None, **kw):
+        """Write the annotation to the page which will be in outpdf.
+        page belongs to backend, which is pyPdf's if None.
+        
+        """
+        if backend is None:
+            from pdfbackend import get_backend
+            backend = get_backend('pypdf')
         if crop is None:
             # The reader displays the intersection of the cropBox and the mediaBox.
-            crop = intersection(page.cropBox[:], page.mediaBox[:])
-        pdf_add_content(svg_to_pdf_content(self.svg), page, *self.scale_offset(crop))
+            crop = intersection(backend.crop_box(page), backend.media_box(page))
+        width, height, content = self.pdf_content()
+        backend.add_content(page, content, *self.scale_offset(crop, (width, height)))
     
-    def scale_offset(self, pdfcrop):
+    def scale_offset(self, pdfcrop, size=None):
+        """The scale and offsets to give pdf_add_content to fit the
+        drawing in pdfcrop.  size is the (width, height) of the SVG, if
+        already known.
+        
+        """
         svgw, svgh = self.crop[2:]
-        svgcw, svgch = [float(self.svg.getAttribute(x)) for x in ('width', 'height')]
+        if size is None:
+            size = [self.svg.getAttribute(x) for x in ('width', 'height')]
+        svgcw, svgch = map(float, size)
         cropx0, cropy0, cropx1, cropy1 = map(float, pdfcrop)
         cropw = cropx1 - cropx0
         croph = cropy1 - cropy0
@@ -190,7 +675,8 @@ class Freehand(object):
 class Highlight(object):
     """Represents a highlighted annotation to a Book."""
     
-    def __init__(self, book, page, area, content_type, content=None, strict=False):
+    def __init__(self, book, page, area, content_type, content=None, strict=False,
+                 added=None, modified=None):
         """Initialize the Highlight object.
         
         Inputs: book            The Book in which this annotation is.
@@ -211,6 +697,13 @@ class Highlight(object):
                                 on the page.  Instead, we add a text
                                 annotation in the top-left corner of the
                                 page, saying what happend.
+                
+                added           The times the annotation was made and last
+                modified        changed on the reader, in seconds since the
+                                epoch.  These are used as the dates of the
+                                PDF annotations, so that the annotated PDF
+                                is the same each time it is written.  If
+                                None, the current time is used.
         
         """
         self.book = book
@@ -220,15 +713,29 @@ class Highlight(object):
         self.strict = strict
         self.content_type = content_type
         self.content = content
+        self.added = added
+        self.modified = modified
     
     @property
     def bboxes(self):
         """A list of bounding boxes that cover the annotated region."""
         if not hasattr(self, '_bboxes'):
             if isinstance(self.area, basestring):
+                from pagetext import NoSubstringError, MultipleSubstringError
+                page_text = self.book.page_text(self.page)
                 try:
-                    self._bboxes = self.book.page_text(self.page).box_substring(
-                        self.area.replace(' ', ''), self.strict)
+                    if page_text is None:
+                        raise NoSubstringError
+                    try:
+                        self._bboxes = page_text.box_substring(self.area, self.strict)
+                    except NoSubstringError:
+                        # The text is put in order without PDFMiner's
+                        # layout analysis, which sometimes orders
+                        # headers, tables, and columns differently.
+                        page_text = self.book.analyzed_page_text(self.page)
+                        if page_text is None:
+                            raise NoSubstringError
+                        self._bboxes = page_text.box_substring(self.area, self.strict)
                 except NoSubstringError:
                     self.message = '\n\nThis note was supposed to be attached to the following ' \
                                    'text, which was not found on this page.\n' + self.area
@@ -241,6 +748,21 @@ class Highlight(object):
                 self._bboxes = self.area
         return self._bboxes
     
+    @property
+    def note(self):
+        """The text of the note attached to the highlight, or None."""
+        if self.content_type is not HIGHLIGHT_TEXT:
+            return None
+        from xml.dom import minidom
+        filename = os.path.join(self.book.reader.path, self.content)
+        data = self.book.prefetched(filename)
+        if data is not None:
+            doc = minidom.parseString(data)
+        else:
+            doc = minidom.parse(filename)
+        text = doc.getElementsByTagName('text')[0]
+        return text.childNodes[0].data
+    
     @property
     def text_content(self):
         """The text to put into the annotation."""
@@ -249,9 +771,7 @@ class Highlight(object):
                 return self.message[2:]  # Remove initial newlines
             return None
         if self.content_type is HIGHLIGHT_TEXT:
-            doc = minidom.parse(os.path.join(self.book.reader.path, self.content))
-            text = doc.getElementsByTagName('text')[0]
-            return text.childNodes[0].data + self.message
+            return self.note + self.message
         if self.content_type is HIGHLIGHT_DRAWING:
             return "Can't handle drawings yet.  (Sorry.)" + self.message
     
@@ -261,33 +781,45 @@ class Highlight(object):
         return hashlib.md5((str(self.page) + unicode(self.area)
                             + unicode(self.text_content)).encode('utf-8')).digest()
     
-    def write_to_pdf(self, page, outpdf, crop=None, fake_highlight_text=False, **kw):
-        """Write the annotation to page in outpdf."""
+    def write_to_pdf(self, page, outpdf, crop=None, fake_highlight_text=False, backend=None,
+                     vskip=None, **kw):
+        """Write the annotation to page in outpdf, both of backend (pyPdf's
+        if None).  vskip is a one-item list of how far down the page the
+        notes already written to it reach.
+        
+        """
+        from pdfannotation import highlight_annotation, text_annotation
+        if backend is None:
+            from pdfbackend import get_backend
+            backend = get_backend('pypdf')
+        if vskip is None:
+            vskip = [0]
         if crop is None:
             # PDFMiner reports positions relative to the mediaBox.
-            crop = map(float, page.mediaBox[:])
+            crop = map(float, backend.media_box(page))
         if self.bboxes is not None:
             shifted_bboxes = [(bb[0] + crop[0], bb[1] + crop[1], bb[2] + crop[0], bb[3] + crop[1])
                               for bb in self.bboxes]
             if (self.text_content and fake_highlight_text):
-                annot = highlight_annotation(shifted_bboxes, None, 'Sony eReader')
-                pcrop = intersection(page.cropBox[:], page.mediaBox[:])
+                annot = highlight_annotation(shifted_bboxes, None, 'Sony eReader',
+                                             created=self.added, modified=self.modified)
+                pcrop = intersection(backend.crop_box(page), backend.media_box(page))
                 bb_center = sum((bb[0] + bb[2])/2 for bb in shifted_bboxes) / len(shifted_bboxes)
                 if bb_center < (pcrop[0] + pcrop[2]) / 2:
                     x = 10
                 else:
                     x = pcrop[2] - 30
                 y = shifted_bboxes[0][1]
-                ta = text_annotation([x, y-20, x+20, y], self.text_content, 'Sony eReader')
-                add_annotation(outpdf, page, ta)
+                ta = text_annotation([x, y-20, x+20, y], self.text_content, 'Sony eReader',
+                                     created=self.added, modified=self.modified)
+                backend.add_annotation(outpdf, page, ta)
             else:
-                annot = highlight_annotation(shifted_bboxes, self.text_content, 'Sony eReader')
+                annot = highlight_annotation(shifted_bboxes, self.text_content, 'Sony eReader',
+                                             created=self.added, modified=self.modified)
         else:
-            if not hasattr(page, 'prsannot_vskip'):
-                page.prsannot_vskip = 0
-            
-            pcrop = intersection(page.cropBox[:], page.mediaBox[:])
-            x,y = pcrop[0]+10, pcrop[3]-10-page.prsannot_vskip # Add a little margin
-            page.prsannot_vskip += 25
-            annot = text_annotation([x, y-20, x+20, y], self.text_content, 'Sony eReader')
-        add_annotation(outpdf, page, annot)
+            pcrop = intersection(backend.crop_box(page), backend.media_box(page))
+            x,y = pcrop[0]+10, pcrop[3]-10-vskip[0] # Add a little margin
+            vskip[0] += 25
+            annot = text_annotation([x, y-20, x+20, y], self.text_content, 'Sony eReader',
+                                    created=self.added, modified=self.modified)
+        backend.add_annotation(outpdf, page, annot)
@@ -0,0 +1,169 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Find the text of PDF pages in a separate process, with limits on the
+time and memory each page may take.
+
+Some PDF files (huge vector maps, broken fonts) make PDFMiner run for
+ages or use up all the memory.  Laying them out in a worker process
+lets us give up on just those pages.  The worker sends back a
+pagetext.PageText for each page as it is finished.  If a page takes too
+long, the worker is killed; if it fails or runs out of memory, the
+worker reports it and quits.  Either way, a new worker carries on with
+the remaining pages.
+"""
+
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# How often to check for cancellation while waiting on the worker (s)
+POLL_INTERVAL = 0.5
+
+def _address_space():
+    """The size of this process's address space, in bytes, or 0 if it
+    cannot be found.
+    
+    """
+    try:
+        fd = open('/proc/self/statm')
+        try:
+            return int(fd.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+        finally:
+            fd.close()
+    except (IOError, OSError, ValueError):
+        return 0
+
+def _work(conn, filename, data, pages, memory, analyze=False):
+    """Run in the worker process: send ('page', PageText) for each of
+    pages of filename (or its contents, data) in order, and then
+    ('done', None).  On failure, send ('failed', reason) and stop.  If
+    analyze, the pages get PDFMiner's full layout analysis.
+    
+    """
+    if memory and resource is not None:
+        # The forked process already holds a copy of its parent; the
+        # limit is on what it uses beyond that.
+        limit = _address_space() + memory * 1024 * 1024
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ValueError, resource.error):
+            pass
+    try:
+        from pagetext import iter_layouts, PageText
+        laparams = None
+        if analyze:
+            from pdfminer.layout import LAParams
+            laparams = LAParams()
+        if data is not None:
+            from documents import MappedStream
+            fd = MappedStream(data)
+        else:
+            fd = open(filename, 'rb')
+        for layout in iter_layouts(fd, pages, laparams):
+            if layout is not None:
+                conn.send(('page', PageText(layout)))
+        fd.close()
+        conn.send(('done', None))
+    except MemoryError:
+        if memory:
+            conn.send(('failed', "it used more than %i MB of memory" % memory))
+        else:
+            conn.send(('failed', "it ran out of memory"))
+    except Exception, e:
+        conn.send(('failed', "%s: %s" % (e.__class__.__name__, e)))
+    conn.close()
+
+def _wait(conn, timeout, progress):
+    """Wait up to timeout seconds (or forever, if None) for a message
+    on conn.  Returns True if one arrived.
+    
+    """
+    waited = 0
+    while timeout is None or waited < timeout:
+        interval = POLL_INTERVAL
+        if timeout is not None:
+            interval = min(interval, timeout - waited)
+        if conn.poll(interval):
+            return True
+        waited += interval
+        if progress is not None:
+            progress.check()
+    return False
+
+def extract_page_texts(filename, pages, timeout=None, memory=None, progress=None, data=None,
+                       analyze=False):
+    """Find the text of pages of the PDF filename in worker processes.
+    
+    Inputs: filename    The PDF file.
+            
+            pages       The page numbers (from 0) to find the text of.
+            
+            timeout     The most time, in seconds, to spend on one page,
+                        or None for no limit.
+            
+            memory      The most memory, in MB, a worker may use beyond
+                        what it starts with, or None for no limit.
+            
+            progress    A progress.Progress to check for cancellation.
+            
+            data        The contents of filename, as a string or memory
+                        map, if already read.  The workers get it
+                        without copying, as they are forked.
+            
+            analyze     Whether to give the pages PDFMiner's full layout
+                        analysis, rather than just gathering their
+                        characters into lines.
+    
+    Output: A tuple (texts, failures).  texts is a dictionary mapping
+            page numbers to pagetext.PageText objects; failures maps the
+            numbers of the pages that could not be read to the reason.
+    
+    """
+    import multiprocessing
+    
+    remaining = sorted(pages)
+    texts = {}
+    failures = {}
+    while remaining:
+        parent, child = multiprocessing.Pipe(duplex=False)
+        worker = multiprocessing.Process(target=_work,
+                                         args=(child, filename, data, set(remaining), memory,
+                                               analyze))
+        worker.daemon = True
+        worker.start()
+        child.close()
+        try:
+            while remaining:
+                if not _wait(parent, timeout, progress):
+                    failures[remaining.pop(0)] = "it took longer than %g s" % timeout
+                    break
+                try:
+                    kind, value = parent.recv()
+                except EOFError:
+                    worker.join()
+                    failures[remaining.pop(0)] = ("the worker process exited with code %s"
+                                                  % worker.exitcode)
+                    break
+                if kind == 'page':
+                    texts[remaining.pop(0)] = value
+                elif kind == 'failed':
+                    failures[remaining.pop(0)] = value
+                    break
+                else:
+                    # The worker ran out of pages before we did.  This
+                    # shouldn't happen, unless pages is out of range.
+                    for page in remaining:
+                        failures[page] = "there is no such page"
+                    remaining = []
+        finally:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+            parent.close()
+    return texts, failures
@@ -3,28 +3,33 @@
 # This file is part of prsannots and is distributed under the terms of
 # the LGPL license.  See the file COPYING for full details.
 
+# pyPdf and pdfdice are imported only by the methods that write PDF
+# files, so that commands that don't need them start quickly.
 import os
 import sys
 import glob
-import uuid
-import shutil
 import subprocess
+from contextlib import contextmanager
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
-import pyPdf
 from prst1 import Reader
-from pdfdice import dice, write_pdf
+from fileops import AtomicFile, copy_file, same_contents, file_signature
+from documents import Document, DocumentRegistry
+from stats import NULL_STATS
+from profiling import sample_memory
+from progress import Progress, Cancelled
 
 if sys.platform == 'win32':
     CONFIG_DIR = os.path.join(os.getenv('APPDATA'), 'prsannots')
 else:
     CONFIG_DIR = os.path.join(os.getenv('XDG_CONFIG_HOME', os.path.join(os.getenv('HOME'), '.config')),
                               'prsannots')
-if not os.path.isdir(CONFIG_DIR):
-    os.makedirs(CONFIG_DIR)
 CONFIG_EXT = '.prc'
+# Change when the annotations written to PDFs change, so that pages from
+# annotated PDFs written by earlier versions are not reused.
+ANNOTATION_FORMAT = 1
 
 def test_gs():
     """Test if Ghostscript is installed with the pdfwrite device."""
@@ -54,7 +59,9 @@ class Manager(object):
     
     """
     _base_settings = {'infix': 'annot', 'reader_dir': os.path.join('Sony_Reader', 'media', 'books'),
-                      'gs': None, 'fake_highlight': False}
+                      'gs': None, 'fake_highlight': False,
+                      'layout_timeout': 300, 'layout_memory': 2048, 'prefetch': 2,
+                      'optimize': False, 'downsample': None}
     _id_file = '.prsannots'
     
     def __init__(self):
@@ -62,6 +69,23 @@ class Manager(object):
         self.library = {}
         self.reader = None
         self._mount = None
+        # Files whose annotated PDFs came out the same as those already
+        # on the computer, and so were not rewritten.
+        self.skipped_writes = []
+        # Files with pages whose text could not be found, mapped to
+        # dictionaries of those pages and the reasons.
+        self.layout_failures = {}
+        # Set to a stats.Stats object to record where the time goes.
+        self.stats = NULL_STATS
+        # Set to a progress.Progress object to follow long operations
+        # and to cancel them.
+        self.progress = Progress()
+        # The search.SearchIndex, opened when first needed.
+        self._search_index = None
+        self._drawing_cache = None
+        # While syncing, a documents.DocumentRegistry sharing the
+        # original PDFs between library entries.
+        self.documents = None
     
     def _ensure_base_settings(self):
         for key in self._base_settings:
@@ -171,11 +195,66 @@ class Manager(object):
     def save(self):
         """Save the configuration."""
         
-        fd = open(os.path.join(CONFIG_DIR, self.settings['id'] + CONFIG_EXT), 'wb')
+        if not os.path.isdir(CONFIG_DIR):
+            os.makedirs(CONFIG_DIR)
+        fd = open(self.config_file, 'wb')
         pickle.dump(self.settings, fd, -1)
         pickle.dump(self.library, fd, -1)
         fd.close()
     
+    @property
+    def config_file(self):
+        """The configuration file for the current reader."""
+        return os.path.join(CONFIG_DIR, self.settings['id'] + CONFIG_EXT)
+    
+    @property
+    def search_index(self):
+        """The search.SearchIndex of the highlights and notes in the
+        library, kept next to the configuration file.
+        
+        """
+        if self._search_index is None:
+            from search import SearchIndex, index_filename
+            if not os.path.isdir(CONFIG_DIR):
+                os.makedirs(CONFIG_DIR)
+            self._search_index = SearchIndex(index_filename(self.config_file))
+        return self._search_index
+    
+    def has_search_index(self):
+        """Whether the search index exists, without creating it."""
+        from search import index_filename
+        return (self._search_index is not None
+                or os.path.exists(index_filename(self.config_file)))
+    
+    @property
+    def backend(self):
+        """The pdfbackend backend to read and write PDFs with."""
+        from pdfbackend import get_backend
+        return get_backend()
+    
+    @property
+    def drawing_cache(self):
+        """The drawcache.DrawingCache of converted freehand drawings,
+        shared by all libraries.
+        
+        """
+        if self._drawing_cache is None:
+            from drawcache import DrawingCache
+            self._drawing_cache = DrawingCache(os.path.join(CONFIG_DIR, 'drawings'))
+        return self._drawing_cache
+    
+    def reload(self):
+        """Reread the settings and library from the configuration file,
+        keeping the current reader.  This picks up changes saved by
+        other processes.
+        
+        """
+        fd = open(self.config_file, 'rb')
+        self.settings = pickle.load(fd)
+        self.library = pickle.load(fd)
+        fd.close()
+        self._ensure_base_settings()
+    
     def update_settings(self, **kw):
         """Update the global settings for the manager.
         
@@ -225,6 +304,7 @@ class Manager(object):
         mount = os.path.abspath(mount)
         if not os.path.ismount(mount):
             raise NotMountedError, "Reader does not appear to be mounted at %s." % mount
+        import uuid
         self.settings['mount'] = mount
         self.settings['id'] = str(uuid.uuid4())
         
@@ -240,15 +320,20 @@ class Manager(object):
         
         self.reader = Reader(self.mount)
     
+    def _copy_progress(self, copied, total):
+        self.progress.bytes_written(copied, total)
+        self.progress.check()
+    
     def add_pdf(self, filename, dice_pdf=None, dice_map=None, title=None,
                 author=None, infix=None, reader_dir=None, gs=None,
-                allow_dups=False, preview=None):
+                allow_dups=False, preview=None, orig_pdf=None, optimize=None,
+                downsample=None):
         """Add a PDF file to the reader, to be managed by this manager.
         
         Inputs: filename    The location on the computer of the PDF file.
                 
-                dice_pdf    A pyPdf.PdfFileWriter with the diced PDF file
-                            to be put on the reader.  If None, then
+                dice_pdf    The diced PDF file to be put on the reader,
+                            made by self.backend.  If None, then
                             filename is copied to the reader.
                 
                 dice_map    The dice map describing how the original PDF
@@ -281,6 +366,23 @@ class Manager(object):
                             of saving it on the reader.  If this is not
                             None, then the PDF will not be added to the
                             reader.
+                
+                orig_pdf    filename, if it has already been opened by
+                            self.backend.  If None, filename will be
+                            opened if needed.
+                
+                optimize    Whether to lay the PDF file out for the
+                            reader to open quickly, with object streams
+                            and linearization.  The file is rewritten
+                            even if nothing else about it changes.  If
+                            None, use the global settings.
+                
+                downsample  The resolution, in dots per inch on the
+                            reader's screen, to resample the images of the
+                            PDF file to, in grayscale.  See pdfimages.
+                            The original file is not changed.  If None,
+                            use the global settings; if 0, don't.  This
+                            is done by add_diced_pdf() for diced files.
         
         Output: The filename to which the file was saved on the reader.
         
@@ -300,12 +402,31 @@ class Manager(object):
             reader_dir = self.settings['reader_dir']
         if gs is None:
             gs = self.settings['gs']
+        if optimize is None:
+            optimize = self.settings['optimize']
+        if downsample is None:
+            downsample = self.settings['downsample']
+        if dice_pdf is None and downsample:
+            from pdfimages import Downsampler
+            downsampler = Downsampler(downsample, self.backend)
+        else:
+            downsampler = None
+        rewriting = (dice_pdf is not None or title is not None or author is not None
+                     or optimize or downsampler is not None)
         
+        on_reader = False
         if preview:
             readerfn = preview
         else:
             readerfn = os.path.join(self.mount, reader_dir, basename)
             while os.path.exists(readerfn):
+                if (not rewriting and readerfn[len_with_sep(self.mount):] not in self.library
+                        and same_contents(filename, readerfn)):
+                    # This file is already on the reader (perhaps from
+                    # before a clean), so we can reuse it without reading
+                    # it again to copy it.
+                    on_reader = True
+                    break
                 parts = readerfn.split('.', 2)
                 if len(parts) == 2:
                     num = 0
@@ -317,36 +438,43 @@ class Manager(object):
                         num = 0
                 readerfn = '.'.join((parts[0], str(num), parts[-1]))
         
-        orig_pdf = pyPdf.PdfFileReader(open(filename, 'rb'))
-        # If we're changing the title or author, we need to rewrite the
-        # whole PDF file.
-        if dice_pdf is None and (title is not None or author is not None):
-            dice_pdf = pyPdf.PdfFileWriter()
-            for page in orig_pdf.pages:
-                dice_pdf.addPage(page)
-        
-        if dice_pdf is not None:
-            info_dict = {}
-            if title is not None:
-                info_dict[pyPdf.generic.NameObject('/Title')] = pyPdf.generic.TextStringObject(title)
-            else:
-                try:
-                    info_dict[pyPdf.generic.NameObject('/Title')] = orig_pdf.documentInfo['/Title']
-                except KeyError:
-                    pass
-            if author is not None:
-                info_dict[pyPdf.generic.NameObject('/Author')] = pyPdf.generic.TextStringObject(author)
-            else:
-                try:
-                    info_dict[pyPdf.generic.NameObject('/Author')] = orig_pdf.documentInfo['/Author']
-                except KeyError:
-                    pass
+        # We only need a PDF library, and to read the original, if we're
+        # rewriting it.
+        document = None
+        if rewriting:
+            from pdfdice import write_pdf
+            backend = self.backend
+            if orig_pdf is None:
+                with self.stats.stage('parse'):
+                    document = Document(filename)
+                    self.stats.count('bytes_read', document.size)
+                    orig_pdf = backend.open(document)
+        try:
+            # If we're changing the title or author, optimizing, or
+            # resampling images, we need to rewrite the whole PDF file.
+            if dice_pdf is None and rewriting:
+                npages = backend.num_pages(orig_pdf)
+                def pages(outpdf):
+                    for i in xrange(npages):
+                        page = backend.page(orig_pdf, i)
+                        if downsampler is not None:
+                            page = downsampler.page(outpdf, backend.page_to_change(outpdf, page))
+                        yield page
+                dice_pdf = backend.writer(pages, npages)
             
-            info = dice_pdf._info.getObject()
-            info.update(info_dict)
-            write_pdf(dice_pdf, readerfn, gs)
-        else:
-            shutil.copy(filename, readerfn)
+            if dice_pdf is not None:
+                backend.set_info(dice_pdf, orig_pdf, title, author)
+                write_pdf(dice_pdf, readerfn, gs, self.stats, self.progress, backend,
+                          optimize)
+            elif not on_reader:
+                self.progress.stage('copy', filename)
+                with self.stats.stage('copy'):
+                    if copy_file(filename, readerfn, self._copy_progress):
+                        self.stats.count('bytes_written', os.path.getsize(readerfn))
+        finally:
+            if document is not None:
+                backend.close(orig_pdf)
+                document.close()
         
         if preview:
             return preview
@@ -372,9 +500,30 @@ class Manager(object):
         Be sure to call save() sometime after this method.
         
         """
-        pdf = pyPdf.PdfFileReader(open(filename, 'rb'))
-        outpdf, dice_map = dice(pdf, *diceargs)
-        return self.add_pdf(filename, outpdf, dice_map, **kw)
+        from pdfdice import dice
+        backend = self.backend
+        downsample = kw.get('downsample')
+        if downsample is None:
+            downsample = self.settings['downsample']
+        if downsample:
+            from pdfimages import Downsampler
+            downsample = Downsampler(downsample, backend)
+        else:
+            downsample = None
+        with self.stats.file(filename):
+            with self.stats.stage('parse'):
+                document = Document(filename)
+                self.stats.count('bytes_read', document.size)
+                pdf = backend.open(document)
+            try:
+                with self.stats.stage('dice'):
+                    outpdf, dice_map = dice(pdf, *diceargs, progress=self.progress,
+                                            backend=backend, downsample=downsample)
+                    self.stats.count('pages', len(dice_map))
+                return self.add_pdf(filename, outpdf, dice_map, orig_pdf=pdf, **kw)
+            finally:
+                backend.close(pdf)
+                document.close()
     
     def import_pdf(self, readerpath, comppath, infix=None, copy=False):
         """Add a file on the reader to the library, copying it to the
@@ -420,7 +569,8 @@ class Manager(object):
         
         self.library[readerpath] = { 'filename': comppath, 'infix': infix, 'annhash': 0, 'dice_map': None }
         if copy:
-            shutil.copy(os.path.join(self.mount, readerpath), comppath)
+            self.progress.stage('copy', readerpath)
+            copy_file(os.path.join(self.mount, readerpath), comppath, self._copy_progress)
         self.sync_pdf(readerpath)
     
     def import_all(self, comppath, infix=None, copy=False):
@@ -449,6 +599,7 @@ class Manager(object):
         
         count = 0
         for book in self.reader.books:
+            self.progress.check()
             try:
                 self.import_pdf(book.file, comppath, infix, copy)  # raises IOError if already in library
             except IOError:
@@ -467,21 +618,96 @@ class Manager(object):
                 be synced.
         
         """
-        try:
-            book = self.reader[filepath]
-        except KeyError:
-            # Not annotated
-            return False
-        if book.hash == self.library[filepath]['annhash']:
-            # No change in annotations
-            return False
-        return True
+        with self.stats.file(filepath):
+            try:
+                with self.stats.stage('database'):
+                    book = self.reader[filepath]
+                    book.annotations
+            except KeyError:
+                # Not annotated
+                return False
+            with self.stats.stage('hash'):
+                if book.hash == self.library[filepath]['annhash']:
+                    # No change in annotations
+                    return False
+            return True
     
     @property
     def needing_sync(self):
         """The files that need their annotations synced."""
-        return [f for f in self.library if self.needs_sync(f)]
+        files = list(self.library)
+        with self.prefetching(files, pdfs=False):
+            return [f for f in files if self.needs_sync(f)]
     
+    @contextmanager
+    def syncing(self, filepaths):
+        """Set up to sync filepaths, in that order, within the with
+        block.  Their files on the reader are read ahead of time (see
+        prefetching()), and an original PDF used by several of them is
+        opened, and its cross-reference table parsed, only once.
+        
+        """
+        outer = self.documents
+        if outer is None:
+            self.documents = DocumentRegistry()
+        try:
+            with self.prefetching(filepaths):
+                yield
+        finally:
+            if outer is None:
+                self.documents.close()
+                self.documents = None
+    
+    @contextmanager
+    def prefetching(self, filepaths, pdfs=True):
+        """Within the with block, read the files on the reader that
+        syncing filepaths needs in a background thread, a few books
+        ahead of their use.  Files should be synced in the order given.
+        
+        Inputs: filepaths   The books to be synced, relative to the
+                            mount point.
+                
+                pdfs        Whether to read the PDF files, or just the
+                            drawings and notes.  Without the PDFs, only
+                            the books whose hashes aren't known yet are
+                            read.
+        
+        The number of books read ahead is given by settings['prefetch'];
+        0 turns this off.  Large PDFs are not read ahead (see prefetch).
+        
+        """
+        window = self.settings['prefetch']
+        self.stats.setting('prefetch', window)
+        groups = []
+        if window:
+            for filepath in filepaths:
+                with self.stats.file(filepath):
+                    with self.stats.stage('database'):
+                        try:
+                            book = self.reader[filepath]
+                            if not pdfs and book.hash_known:
+                                continue
+                            groups.append((book, book.reader_files(pdfs)))
+                        except KeyError:
+                            # Not annotated
+                            continue
+        if not groups:
+            yield
+            return
+        
+        from prefetch import Prefetcher
+        prefetcher = Prefetcher(window)
+        try:
+            for book, files in groups:
+                book.prefetcher = prefetcher
+                prefetcher.add(files)
+            yield
+        finally:
+            prefetcher.close()
+            for book, files in groups:
+                book.prefetcher = None
+    
+    @sample_memory('Manager.sync_pdf')
     def sync_pdf(self, filepath):
         """Create an up-to-date annotated PDF for the specified file.
         
@@ -494,18 +720,79 @@ class Manager(object):
                 updated or not.  If True, be sure to call save()
                 sometime in the future.
         
+        The annotated PDF is written to a temporary file, which replaces
+        the existing annotated PDF only if their contents differ.  If
+        they don't, filepath is added to self.skipped_writes.
+        
         """
-        if not self.needs_sync(filepath):
-            return False
+        with self.stats.file(filepath):
+            try:
+                synced = self._sync_pdf(filepath)
+            except Cancelled:
+                raise
+            except Exception, e:
+                self.progress.file_failed(filepath, e)
+                raise
+        if synced:
+            self.progress.file_done(filepath)
+        return synced
+    
+    def annotated_filename(self, filepath):
+        """The file on the computer to which the annotated PDF for
+        filepath is written.
         
-        book = self.reader[filepath]
+        """
         libentry = self.library[filepath]
         parts = libentry['filename'].rsplit('.', 1)
         try:
             suffix = parts[1]
         except IndexError:
             suffix = 'pdf'
-        annfn = '.'.join((parts[0], libentry['infix'], suffix))
+        return '.'.join((parts[0], libentry['infix'], suffix))
+    
+    def index_pdf(self, filepath):
+        """Bring the search index up to date with the annotations of
+        filepath.  Its entries are only rewritten if the annotation
+        hash has changed since they were last indexed.
+        
+        """
+        with self.stats.stage('index'):
+            try:
+                book = self.reader[filepath]
+                book.annotations
+            except KeyError:
+                # Not annotated (any more)
+                if self.search_index.indexed_hash(filepath) is not None:
+                    self.search_index.remove_book(filepath)
+                return
+            self.search_index.update_book(filepath, book, self.annotated_filename(filepath))
+    
+    def _pages_key(self, pdffn, annfn):
+        """Changes when the pages of the annotated PDF annfn, made from
+        pdffn, can no longer be reused.
+        
+        """
+        return (ANNOTATION_FORMAT, self.settings['fake_highlight'],
+                file_signature(pdffn), file_signature(annfn))
+    
+    def _sync_pdf(self, filepath):
+        if not self.needs_sync(filepath):
+            self.index_pdf(filepath)
+            return False
+        
+        book = self.reader[filepath]
+        book.stats = self.stats
+        book.progress = self.progress
+        book.drawing_cache = self.drawing_cache
+        backend = book.backend = self.backend
+        self.stats.setting('backend', backend.name)
+        if sys.platform != 'win32':
+            # Find the text in worker processes, so that one pathological
+            # page can't hang the sync.  (Windows can't fork them.)
+            book.layout_timeout = self.settings['layout_timeout']
+            book.layout_memory = self.settings['layout_memory']
+        libentry = self.library[filepath]
+        annfn = self.annotated_filename(filepath)
         
         pdffn = libentry['filename']
         if not os.path.exists(pdffn):
@@ -516,23 +803,95 @@ class Manager(object):
             else:
                 raise IOError, "Original PDF file %s does not exist." % pdffn
         
-        book.write_annotated_pdf(open(annfn, 'wb'), pyPdf.PdfFileReader(open(pdffn, 'rb')),
-                                 libentry['dice_map'],
-                                 fake_highlight_text=self.settings['fake_highlight'])
+        # An imported file without an original on the computer is read
+        # from the reader, sharing the map used for its layouts.
+        with self.stats.stage('parse'):
+            shared = False
+            if pdffn == os.path.join(self.mount, filepath):
+                document = book.document
+            elif self.documents is not None:
+                document, new = self.documents.open(pdffn)
+                if new:
+                    self.stats.count('bytes_read', document.size)
+                shared = True
+            else:
+                document = Document(pdffn)
+                self.stats.count('bytes_read', document.size)
+            pdf = backend.open(document)
+            # Pages whose annotations haven't changed can be copied from
+            # the annotated PDF written last time, if it and the original
+            # are as we left them.
+            previous_document = previous = previous_hashes = None
+            pages = libentry.get('pages')
+            if pages is not None and pages['key'] == self._pages_key(pdffn, annfn):
+                try:
+                    previous_document = Document(annfn)
+                    self.stats.count('bytes_read', previous_document.size)
+                    previous = backend.open(previous_document)
+                    previous_hashes = pages['hashes']
+                except Exception:
+                    # If it can't be read, it is simply written anew.
+                    if previous_document is not None:
+                        previous_document.close()
+                    previous_document = previous = None
+        try:
+            with AtomicFile(annfn) as outfd:
+                try:
+                    hashes = book.write_annotated_pdf(outfd, pdf, libentry['dice_map'],
+                                                      previous, previous_hashes,
+                                                      fake_highlight_text=self.settings['fake_highlight'])
+                finally:
+                    # Closed before annfn is replaced, for Windows' sake.
+                    if previous_document is not None:
+                        backend.close(previous)
+                        previous_document.close()
+        finally:
+            backend.close(pdf)
+            if not shared:
+                document.close()
+            book.close()
+        if not outfd.changed:
+            self.skipped_writes.append(filepath)
+        if book.layout_failures:
+            self.layout_failures[filepath] = dict(book.layout_failures)
         libentry['annhash'] = book.hash
+        libentry['pages'] = {'hashes': hashes, 'key': self._pages_key(pdffn, annfn)}
+        self.index_pdf(filepath)
         return True
     
+    def layout_failure_messages(self):
+        """A message for each page, in the files synced, whose text could
+        not be found.  The highlights on those pages become notes.
+        
+        """
+        messages = []
+        for filepath in sorted(self.layout_failures):
+            for page, reason in sorted(self.layout_failures[filepath].items()):
+                messages.append("Could not find the text of page %i of %s, because %s."
+                                % (page + 1, self.library[filepath]['filename'], reason))
+        return messages
+    
+    @sample_memory('Manager.sync')
     def sync(self):
         """Sync all PDF files tracked my this manager.
         
         Returns the number of updated annotated PDF files.  Be sure to
-        call save() in the future if this number is > 0.
+        call save() in the future if this number is > 0.  Afterwards,
+        self.skipped_writes lists those files whose annotated PDFs did
+        not actually change, and self.layout_failures those with pages
+        whose text could not be found.
         
         """
+        self.skipped_writes = []
+        self.layout_failures = {}
         count = 0
-        for f in self.library:
-            if self.sync_pdf(f):
-                count += 1
+        need_sync = set(self.needing_sync)
+        files = list(self.library)
+        with self.syncing([f for f in files if f in need_sync]):
+            for f in files:
+                self.progress.check()
+                if self.sync_pdf(f):
+                    count += 1
         return count
     
     def delete(self, filename, delete_from_reader=False):
@@ -566,6 +925,8 @@ class Manager(object):
             except OSError:
                 pass
         del(self.library[filepath])
+        if self.has_search_index():
+            self.search_index.remove_book(filepath)
         return True
     
     def clean(self):
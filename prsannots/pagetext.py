@@ -3,9 +3,11 @@
 # This file is part of prsannots and is distributed under the terms of
 # the LGPL license.  See the file COPYING for full details.
 
+import unicodedata
+
 from pdfminer.pdfparser import PDFParser
 from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
-from pdfminer.layout import LAParams, LTTextBox
+from pdfminer.layout import LAParams, LTTextBox, LTChar
 from pdfminer.converter import PDFPageAggregator
 
 # pdfminer suddenly decided to change its API...
@@ -37,12 +39,43 @@ except ImportError:
     from pdfminer.layout import LTAnno as LTAnon
 
 
-LIGATURES = {u"\ufb00": "ff",
-             u"\ufb01": "fi",
-             u"\ufb02": "fl",
-             u"\ufb03": "ffi",
-             u"\ufb04": "ffl",
-            }
+# Characters that may be written one way on the page and another in the
+# reader's copy of the highlighted text.  Ligatures, full-width forms,
+# and the like are taken care of by NFKC normalization.
+HYPHENS = u"\u2010\u2011\u2212\ufe63"
+DASHES = u"\u2012\u2013\u2014\u2015\ufe58"
+SINGLE_QUOTES = u"\u2018\u2019\u201a\u201b\u2032"
+DOUBLE_QUOTES = u"\u201c\u201d\u201e\u201f"
+# Soft hyphens and zero-width spaces and joiners
+INVISIBLE = u"\u00ad\u200b\u200c\u200d\u2060\ufeff"
+
+FOLDS = dict((ord(c), folded)
+             for chars, folded in ((HYPHENS, u"-"), (DASHES, u"\u2014"), (SINGLE_QUOTES, u"'"),
+                                   (DOUBLE_QUOTES, u'"'), (INVISIBLE, None))
+             for c in chars)
+# The characters that break a word at the end of a line, which are
+# dropped there.  Others folded into hyphens, like minus signs, are kept.
+LINE_HYPHENS = u"-\u00ad\u2010\u2011"
+
+def normalize(text):
+    """Put text into the form in which highlighted text is matched to
+    the page: NFKC normalized, with hyphens, dashes, and quotes folded
+    together, and without whitespace or invisible characters.
+    
+    """
+    text = unicodedata.normalize('NFKC', unicode(text)).translate(FOLDS)
+    return u"".join(c for c in text if not c.isspace())
+
+# normalize() of each character seen so far.  Pages use few distinct
+# characters, so this stays small.
+_normal_chars = {}
+
+
+# The tests PDFMiner uses to put two characters on the same line.  The
+# vertical overlap must be this fraction of the smaller height, and the
+# gap no more than this many times the larger width.
+LINE_OVERLAP = LAParams().line_overlap
+CHAR_MARGIN = LAParams().char_margin
 
 
 class NoSubstringError(Exception):
@@ -51,23 +84,161 @@ class MultipleSubstringError(Exception):
     pass
 
 
-def get_layouts(fd):
-    """From an open PDF file, get the page layouts (of type pdfminer.layout.LTPage)."""
+class CharAggregator(PDFPageAggregator):
+    """A PDFMiner device that collects the characters on each page, and
+    nothing else.  Paths and images are dropped, and no layout analysis
+    is done, so the resulting LTPage holds LTChar objects in the order
+    they were drawn (along with LTFigures).
+    
+    """
+    
+    def __init__(self, rsrcmgr, pageno=1):
+        PDFPageAggregator.__init__(self, rsrcmgr, pageno=pageno, laparams=None)
+    
+    def paint_path(self, gstate, stroke, fill, evenodd, path):
+        pass
+    
+    def render_image(self, name, stream):
+        pass
+
+
+def iter_layouts(fd, pages=None, laparams=None):
+    """From an open PDF file, generate the page layouts one at a time, as
+    each page is laid out.  The arguments are as for get_layouts().
+    
+    """
     
     parser = PDFParser(fd)
     doc = new_doc(parser)
     doc.initialize()
     
-    laparams = LAParams()
     rsrcmgr = PDFResourceManager()
-    device = PDFPageAggregator(rsrcmgr, laparams=laparams)
+    if laparams is None:
+        device = CharAggregator(rsrcmgr)
+    else:
+        device = PDFPageAggregator(rsrcmgr, laparams=laparams)
     interpreter = PDFPageInterpreter(rsrcmgr, device)
     
-    layouts = []
-    for page in get_pages(doc):
+    for i, page in enumerate(get_pages(doc)):
+        if pages is not None and i not in pages:
+            yield None
+            continue
         interpreter.process_page(page)
-        layouts.append(device.get_result())
-    return layouts
+        yield device.get_result()
+
+def get_layouts(fd, pages=None, laparams=None):
+    """From an open PDF file, get the page layouts (of type pdfminer.layout.LTPage).
+    If pages, a set of page numbers, is given, only those pages are laid
+    out, and None is returned for the others.
+    
+    By default, the pages hold only their characters, which is all that
+    PageText needs.  Pass a pdfminer.layout.LAParams as laparams to have
+    PDFMiner's full layout analysis done instead.
+    
+    """
+    return list(iter_layouts(fd, pages, laparams))
+
+def _segments(chars, line_overlap, char_margin):
+    """Split chars into runs, drawn one after the other, that PDFMiner
+    would put on the same line: each character overlaps the one before
+    it vertically and is close to it horizontally.
+    
+    """
+    # This is the inner loop, so PDFMiner's tests are written out here.
+    segment = []
+    px0 = py0 = px1 = py1 = None
+    for char in chars:
+        x0, y0, x1, y1 = char.bbox
+        if px0 is not None:
+            if y0 <= py1 and py0 <= y1:
+                voverlap = min(abs(py0 - y1), abs(py1 - y0))
+            else:
+                voverlap = None
+            if x0 <= px1 and px0 <= x1:
+                hdistance = 0
+            else:
+                hdistance = min(abs(px0 - x1), abs(px1 - x0))
+            if not (voverlap is not None and
+                    min(y1 - y0, py1 - py0) * line_overlap < voverlap and
+                    hdistance < max(x1 - x0, px1 - px0) * char_margin):
+                yield segment
+                segment = []
+        segment.append(char)
+        px0, py0, px1, py1 = x0, y0, x1, y1
+    if segment:
+        yield segment
+
+class _Line(object):
+    """Segments sharing a baseline, and the box around them."""
+    
+    def __init__(self, segment, bbox, width):
+        self.segments = [(bbox[0], segment)]
+        self.x0, self.y0, self.x1, self.y1 = bbox
+        self.width = width
+    
+    def accepts(self, bbox, width, line_overlap, char_margin):
+        """Whether a segment with bbox, and characters up to width wide,
+        lies beside this line.
+        
+        """
+        x0, y0, x1, y1 = bbox
+        voverlap = min(self.y1, y1) - max(self.y0, y0)
+        if voverlap <= min(self.y1 - self.y0, y1 - y0) * line_overlap:
+            return False
+        margin = max(self.width, width) * char_margin
+        return self.x1 <= x0 < self.x1 + margin or self.x0 - margin < x1 <= self.x0
+    
+    def add(self, segment, bbox, width):
+        self.segments.append((bbox[0], segment))
+        self.x0, self.y0 = min(self.x0, bbox[0]), min(self.y0, bbox[1])
+        self.x1, self.y1 = max(self.x1, bbox[2]), max(self.y1, bbox[3])
+        self.width = max(self.width, width)
+    
+    def chars(self):
+        self.segments.sort(key=lambda s: s[0])
+        return [char for x0, segment in self.segments for char in segment]
+
+# Lines are found by the height of their middle, in buckets this tall (pt).
+BUCKET = 4.
+
+def text_lines(chars, line_overlap=LINE_OVERLAP, char_margin=CHAR_MARGIN):
+    """Group characters into lines, without PDFMiner's layout analysis.
+    
+    Runs of characters are found as PDFMiner does.  Then runs on the
+    same baseline that lie side by side are joined, left to right, even
+    if they weren't drawn one after the other.  The lines come out in
+    the order their first characters were drawn.  That is often, but
+    not always, the order PDFMiner's text boxes would have put them in:
+    page headers, tables, and listings may come out differently.  A
+    generic.Highlight whose text isn't found looks again in the text of
+    the full layout analysis.
+    
+    Input:  chars   A sequence of pdfminer.layout.LTChar objects, in
+                    the order they were drawn.
+    
+    Output: A list of lines, each a list of LTChars.
+    
+    """
+    lines = []
+    buckets = {}
+    for segment in _segments(chars, line_overlap, char_margin):
+        bbox = (min(c.x0 for c in segment), min(c.y0 for c in segment),
+                max(c.x1 for c in segment), max(c.y1 for c in segment))
+        width = max(c.width for c in segment)
+        key = int((bbox[1] + bbox[3]) / 2 / BUCKET)
+        for k in (key, key - 1, key + 1, key - 2, key + 2):
+            for line in buckets.get(k, ()):
+                if line.accepts(bbox, width, line_overlap, char_margin):
+                    line.add(segment, bbox, width)
+                    break
+            else:
+                continue
+            break
+        else:
+            line = _Line(segment, bbox, width)
+            lines.append(line)
+            buckets.setdefault(key, []).append(line)
+    return [line.chars() for line in lines]
 
 
 class PageText(object):
@@ -75,27 +246,42 @@ class PageText(object):
     location of each of them.  The characters may be read out by calling
     string or unicode on this object.
     
+    The text is kept normalized (see normalize()), one character per
+    position, so that a highlight is found with a single search of the
+    text, and its position maps straight back to character boxes.
+    
     """
     def __init__(self, page=None):
         """Input:  page    A pdfminer.layout.LTPage to load the text from."""
         
         self._chars = []
         self._pos = []
+        self._text = None
+        self._hyphenated = False   # Whether the last character is in LINE_HYPHENS
         if page is not None:
             self.load(page)
     
     def __str__(self):
-        return "".join(self._chars)
+        return self.text
+    
+    @property
+    def text(self):
+        """The normalized text of the page."""
+        if self._text is None:
+            self._text = u"".join(self._chars)
+        return self._text
     
     def _get_chars(self, char):
         t = char.get_text()
         if isinstance(char, LTAnon):  # Either a newline or space
             if t == '\n':
-                if self._chars[-1] == '-':
-                    del(self._chars[-1])
-                    del(self._pos[-1])
+                self.end_line()
             return ''
-        return LIGATURES.get(t, t)
+        try:
+            return _normal_chars[t]
+        except KeyError:
+            n = _normal_chars[t] = normalize(t)
+            return n
     
     def add(self, char, lnum):
         """Add a character to the page.
@@ -107,18 +293,59 @@ class PageText(object):
                         between lines and is constant within a line.
         
         """
-        for c in self._get_chars(char):
+        text = self._get_chars(char)
+        box = getattr(char, 'bbox', None)
+        if text and self._pos and self._pos[-1][0] == lnum and unicodedata.combining(text[0]):
+            # An accent drawn apart from its letter.  Put them back
+            # together, so they compose as in the highlighted text.
+            text = normalize(self._chars.pop() + text)
+            prev = self._pos.pop()[1]
+            if box is None or prev is None:
+                box = box or prev
+            else:
+                box = (min(box[0], prev[0]), min(box[1], prev[1]),
+                       max(box[2], prev[2]), max(box[3], prev[3]))
+        for c in text:
             self._chars.append(c)
-            self._pos.append((lnum, getattr(char, 'bbox', None)))
+            self._pos.append((lnum, box))
+        if text:
+            self._hyphenated = char.get_text() in LINE_HYPHENS
+        self._text = None
+    
+    def end_line(self):
+        """Mark the end of a line.  A hyphen ending the line is dropped,
+        but not a minus sign.
+        
+        """
+        if self._chars and self._hyphenated:
+            del(self._chars[-1])
+            del(self._pos[-1])
+            self._hyphenated = False
+            self._text = None
     
     def load(self, page):
-        """Add the text from the page (a pdfminer.layout.LTPage)."""
+        """Add the text from the page (a pdfminer.layout.LTPage), either
+        from get_layouts() or laid out by PDFMiner.
         
-        for box in page:
-            if isinstance(box, LTTextBox):
+        """
+        boxes = [box for box in page if isinstance(box, LTTextBox)]
+        if boxes:
+            for box in boxes:
                 for l, line in enumerate(box):
                     for char in line:
                         self.add(char, l)
+            return
+        
+        lnum = 0
+        for line in text_lines(char for char in page if isinstance(char, LTChar)):
+            # PDFMiner drops lines without area.
+            if max(c.x1 for c in line) <= min(c.x0 for c in line) or \
+                    max(c.y1 for c in line) <= min(c.y0 for c in line):
+                continue
+            for char in line:
+                self.add(char, lnum)
+            self.end_line()
+            lnum += 1
     
     def bboxes(self, start, length):
         """Get some bounding boxes that contain the specified characters.
@@ -153,7 +380,9 @@ class PageText(object):
         
         If the specified string does not appear on the page, a
         NoSubstringError is raised.  The behavior when the substring
-        appears multiple times depends on strict.
+        appears multiple times depends on strict.  The string is
+        normalized as the page's text is, so differences in spacing,
+        ligatures, dashes, and quotes don't matter.
         
         Input:  substr  The string to be contained.
                 
@@ -167,7 +396,8 @@ class PageText(object):
         lower left of the mediaBox, NOT in absolute coordinates.
         
         """
-        s = unicode(self)
+        substr = normalize(substr)
+        s = self.text
         lf = s.find(substr)
         if lf == -1:
             raise NoSubstringError
@@ -15,16 +15,25 @@ def now():
     # Python timezone handling is a messs, so just use UTC
     return TextStringObject(datetime.utcnow().strftime("D:%Y%m%d%H%M%SZ00'00"))
 
+def pdf_date(timestamp=None):
+    """A PDF date string for timestamp, in seconds since the epoch.  If
+    timestamp is None, use the current time.
+    
+    """
+    if timestamp is None:
+        return now()
+    return TextStringObject(datetime.utcfromtimestamp(timestamp).strftime("D:%Y%m%d%H%M%SZ00'00"))
+
 def _markup_annotation(rect, contents=None, author=None, subject=None,
-                       color=None, alpha=1, flag=4):
+                       color=None, alpha=1, flag=4, created=None, modified=None):
     """Set shared properties of all markup annotations."""
     
     retval = DictionaryObject({ NameObject('/CA'): FloatObject(alpha),
                                 NameObject('/F'): NumberObject(flag),
                                 NameObject('/Rect'): float_array(rect),
                                 NameObject('/Type'): NameObject('/Annot'),
-                                NameObject('/CreationDate'): now(),
-                                NameObject('/M'): now(),
+                                NameObject('/CreationDate'): pdf_date(created),
+                                NameObject('/M'): pdf_date(modified),
                              })
     retval.popup = False  # Whether to add an explicit popup when adding to page
     if contents is not None:
@@ -37,24 +46,29 @@ def _markup_annotation(rect, contents=None, author=None, subject=None,
         retval[NameObject('/C')] = float_array(color)
     return retval
 
+def popup_rect(rect):
+    """The rectangle of the popup for an annotation at rect."""
+    # Make Golden ratio rectangle lined up at right-hand side of parent
+    _, _, x, y = rect
+    return [x, y-100, x+162, y]
+
 def _popup_annotation(parent, rect=None):
     """Create a 'Popup' annotation connected to parent (an indirect object)."""
     
     if rect is None:
-        # Make Golden ratio rectangle lined up at right-hand side of parent
-        _, _, x, y = parent.getObject()['/Rect']
-        rect = [x, y-100, x+162, y]
+        rect = popup_rect(parent.getObject()['/Rect'])
     
     return DictionaryObject({ NameObject('/Type'): NameObject('/Annot'),
                               NameObject('/Subtype'): NameObject('/Popup'),
-                              NameObject('/M'): now(),
+                              NameObject('/M'): parent.getObject()['/M'],
                               NameObject('/Rect'): float_array(rect),
                               NameObject('/Parent'): parent,
                            })
 
 
 def highlight_annotation(quadpoints, contents=None, author=None,
-                         subject=None, color=YELLOW, alpha=1, flag=4):
+                         subject=None, color=YELLOW, alpha=1, flag=4,
+                         created=None, modified=None):
     """Create a 'Highlight' annotation that covers the area given by quadpoints.
     
     Inputs: quadpoints  A list of rectangles to be highlighted as part of this
@@ -73,6 +87,10 @@ def highlight_annotation(quadpoints, contents=None, author=None,
             
             flag        A bit flag of options.  4 means the annotation should be
                         printed.  See the PDF spec for more.
+            
+            created     The times the annotation was created and last
+            modified    modified, in seconds since the epoch.  If None,
+                        the current time is used.
     
     Output: A DictionaryObject representing the annotation.
     
@@ -87,13 +105,15 @@ def highlight_annotation(quadpoints, contents=None, author=None,
     rect = [min(quadpoints_col(0)), min(quadpoints_col(1)),
             max(quadpoints_col(2)), max(quadpoints_col(3))]
     
-    retval = _markup_annotation(rect, contents, author, subject, color, alpha, flag)
+    retval = _markup_annotation(rect, contents, author, subject, color, alpha, flag,
+                                created, modified)
     retval[NameObject('/Subtype')] = NameObject('/Highlight')
     retval[NameObject('/QuadPoints')] = float_array(qpl)
     return retval
 
 def text_annotation(rect, contents=None, author=None, subject=None, color=YELLOW,
-                    alpha=1, flag=4, icon=None, open_=False, state=None, state_model=None):
+                    alpha=1, flag=4, icon=None, open_=False, state=None, state_model=None,
+                    created=None, modified=None):
     """Create a 'Text' annotation, a sticky note at the location rect.
     
     Inputs: rect        A rectangle [x0,y0,x1,y1].  The icon will be in the top-
@@ -119,11 +139,16 @@ def text_annotation(rect, contents=None, author=None, subject=None, color=YELLOW
             
             state       These set the state of the annotation.  See the PDF spec
             state_model for further details.
+            
+            created     The times the annotation was created and last
+            modified    modified, in seconds since the epoch.  If None,
+                        the current time is used.
     
     Output: A DictionaryObject representing the annotation.
     
     """
-    retval = _markup_annotation(rect, contents, author, subject, color, alpha, flag)
+    retval = _markup_annotation(rect, contents, author, subject, color, alpha, flag,
+                                created, modified)
     retval.popup = True
     retval[NameObject('/Subtype')] = NameObject('/Text')
     retval[NameObject('/Open')] = BooleanObject(open_)
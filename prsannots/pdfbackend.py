@@ -0,0 +1,329 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Read, change, and write PDF files through a backend.
+
+prsannots does only a few things to PDF files: it opens them, goes
+through their pages, reads and sets the boxes of the pages, adds
+content and annotations to them, replaces their images, and writes them
+out.  A backend does these with a particular library.  There is one so
+far:
+
+pypdf     pyPdf, which is pure Python and always available.  Large files
+          are written a page at a time, with pdfwriter, and laid out for
+          the reader to open quickly with pdfoptimize.
+
+get_backend() gives a backend by name, or the preferred one installed.
+The PDF files and pages a backend returns are that library's own
+objects, and may only be given back to the same backend.  Annotations
+are made by pdfannotation as pyPdf objects, which another backend would
+have to convert.
+"""
+
+# In order of preference
+BACKENDS = ('pypdf',)
+
+_backends = {}
+
+def get_backend(name=None):
+    """The backend called name or, if name is None or 'auto', the first
+    of BACKENDS that is installed.  Raises a ValueError for an unknown
+    name, and an ImportError if its library is not installed.
+    
+    """
+    if name is None or name == 'auto':
+        for name in BACKENDS:
+            try:
+                return get_backend(name)
+            except ImportError:
+                pass
+        raise ImportError, "No PDF library is installed."
+    if name not in _backends:
+        if name == 'pypdf':
+            _backends[name] = PyPdfBackend()
+        else:
+            raise ValueError, "Unknown PDF backend %s." % name
+    return _backends[name]
+
+
+class PyPdfBackend(object):
+    """Works on PDF files with pyPdf.  Files are pyPdf.PdfFileReaders
+    when read, and pyPdf.PdfFileWriters or pdfwriter.StreamingPdfWriters
+    when written; pages are pyPdf.pdf.PageObjects.
+    
+    """
+    
+    name = 'pypdf'
+    
+    def __init__(self):
+        import pyPdf
+        self.errors = (pyPdf.utils.PdfReadError,)
+    
+    def open(self, document):
+        """A new PDF file for reading the documents.Document."""
+        return document.open_pdf()
+    
+    def close(self, pdf):
+        """Release the PDF file pdf.  (Its Document must be closed too.)"""
+        pass
+    
+    def num_pages(self, pdf):
+        return pdf.getNumPages()
+    
+    def page(self, pdf, i):
+        """The i-th page (from 0) of pdf."""
+        return pdf.getPage(i)
+    
+    def media_box(self, page):
+        """The media box of page, as a list [x0, y0, x1, y1]."""
+        return page.mediaBox[:]
+    
+    def crop_box(self, page):
+        """The crop box of page, as a list [x0, y0, x1, y1]."""
+        return page.cropBox[:]
+    
+    def rotation(self, page):
+        """The clockwise rotation of page when shown: 0, 90, 180, or 270."""
+        try:
+            return int(page.get('/Rotate', 0)) % 360
+        except (TypeError, ValueError):
+            return 0
+    
+    def has_annotations(self, page):
+        return '/Annots' in page
+    
+    def copy_page(self, page):
+        """A copy of page, whose boxes may be changed."""
+        from pdfdice import copy_page
+        return copy_page(page)
+    
+    def set_boxes(self, page, bbox):
+        """Set all of the boxes of page to bbox."""
+        from pyPdf.generic import RectangleObject
+        page.cropBox = page.artBox = page.trimBox = page.mediaBox = RectangleObject(bbox)
+    
+    def page_to_change(self, outpdf, page):
+        """The page to change and add to outpdf, in place of page.
+        
+        It is a copy of page when outpdf is written a page at a time,
+        so that the changes don't stay in memory with the original.
+        
+        """
+        from pdfwriter import StreamingPdfWriter
+        if not isinstance(outpdf, StreamingPdfWriter):
+            return page
+        from pyPdf.pdf import PageObject
+        from pyPdf.generic import NameObject, ArrayObject
+        copy = PageObject(page.pdf, page.indirectRef)
+        copy.update(page)
+        if '/Annots' in copy:
+            copy[NameObject('/Annots')] = ArrayObject(copy['/Annots'])
+        return copy
+    
+    def reuse_page(self, pdf, page, oldpage):
+        """Give page, of pdf, the contents and annotations of oldpage, a
+        page of an earlier annotated version of the same file.
+        
+        """
+        from pyPdf.generic import NameObject
+        for key in ('/Contents', '/Annots'):
+            if key in oldpage:
+                page[NameObject(key)] = oldpage.raw_get(key)
+    
+    def add_content(self, page, content, scale=1, offsetx=0, offsety=0):
+        """Add the PDF drawing commands content to the end of page.  See
+        pdfcontent.pdf_add_content().
+        
+        """
+        from pdfcontent import pdf_add_content
+        pdf_add_content(content, page, scale, offsetx, offsety)
+    
+    def add_annotation(self, outpdf, page, annot):
+        """Add annot, made by pdfannotation, to page of outpdf."""
+        from pdfannotation import add_annotation
+        add_annotation(outpdf, page, annot)
+    
+    def images(self, page):
+        """The images in the resources of page, as a list of tuples
+        (name, key, image).  The key is the same for each use of an image
+        in the file.
+        
+        """
+        from pyPdf.generic import IndirectObject
+        if '/Resources' not in page or '/XObject' not in page['/Resources']:
+            return []
+        xobjects = page['/Resources']['/XObject']
+        images = []
+        for name in xobjects:
+            ref = xobjects.raw_get(name)
+            if isinstance(ref, IndirectObject) and ref.getObject().get('/Subtype') == '/Image':
+                images.append((str(name), (ref.idnum, ref.generation), ref.getObject()))
+        return images
+    
+    def _plain(self, obj):
+        """obj as plain Python objects: dictionaries, lists, numbers,
+        and names as strings.
+        
+        """
+        from pyPdf import generic
+        if isinstance(obj, generic.PdfObject):
+            obj = obj.getObject()
+        if isinstance(obj, generic.DictionaryObject):
+            return dict((str(key), self._plain(value)) for key, value in obj.iteritems())
+        if isinstance(obj, generic.ArrayObject):
+            return [self._plain(value) for value in obj]
+        if isinstance(obj, generic.NameObject):
+            return str(obj)
+        if isinstance(obj, generic.BooleanObject):
+            return obj.value
+        if isinstance(obj, generic.NullObject):
+            return None
+        if isinstance(obj, generic.FloatObject):
+            return float(obj)
+        if isinstance(obj, generic.NumberObject):
+            return int(obj)
+        return obj
+    
+    def image_params(self, image):
+        """The dictionary of image, as plain Python objects."""
+        return self._plain(image)
+    
+    def image_data(self, image):
+        """The data of image, still encoded."""
+        return image._data
+    
+    def content_operations(self, page):
+        """The operations of the content stream of page, as a list of
+        tuples (operands, operator).  The operands are plain Python
+        objects.
+        
+        """
+        from pyPdf.pdf import ContentStream
+        contents = page.getContents()
+        if contents is None:
+            return []
+        return [([self._plain(x) for x in operands], operator)
+                for operands, operator in ContentStream(contents, page.pdf).operations]
+    
+    def add_image(self, outpdf, page, params, data):
+        """Add an image to outpdf, for page.  Returns its handle, to give
+        to set_images().
+        
+        Inputs: params  The image's dictionary, whose values are strings
+                        for names, or numbers.
+                
+                data    The image's data, encoded.
+        
+        """
+        from pyPdf.generic import StreamObject, NameObject, NumberObject, BooleanObject
+        image = StreamObject()
+        image._data = data
+        for key, value in params.iteritems():
+            if isinstance(value, bool):
+                value = BooleanObject(value)
+            elif isinstance(value, basestring):
+                value = NameObject(value)
+            else:
+                value = NumberObject(value)
+            image[NameObject(key)] = value
+        return outpdf._addObject(image)
+    
+    def set_images(self, page, images):
+        """Have page use the images added by add_image(), in place of
+        those of the same names.
+        
+        Input:  images  A dictionary mapping names to handles.
+        
+        """
+        from pyPdf.generic import DictionaryObject, NameObject
+        # The resources may be shared with other pages.
+        resources = DictionaryObject(page['/Resources'])
+        xobjects = DictionaryObject(resources['/XObject'])
+        for name, image in images.iteritems():
+            xobjects[NameObject(name)] = image
+        resources[NameObject('/XObject')] = xobjects
+        page[NameObject('/Resources')] = resources
+    
+    def writer(self, pages, npages, streaming=None):
+        """A new PDF file of pages.
+        
+        Inputs: pages       A function that takes the new file and
+                            returns an iterable of its pages.  (Their
+                            annotations are added to the new file.)
+                
+                npages      The number of pages there will be.
+                
+                streaming   Whether to produce the pages as the file is
+                            written, with a pdfwriter.StreamingPdfWriter,
+                            rather than at once.  If None, do so for more
+                            than pdfwriter.STREAMING_PAGES pages.
+        
+        """
+        from pdfwriter import StreamingPdfWriter, STREAMING_PAGES
+        if streaming is None:
+            streaming = npages > STREAMING_PAGES
+        if streaming:
+            return StreamingPdfWriter(pages)
+        from pyPdf import PdfFileWriter
+        outpdf = PdfFileWriter()
+        for page in pages(outpdf):
+            outpdf.addPage(page)
+        return outpdf
+    
+    def info(self, outpdf):
+        """The title and author of the new file outpdf, or None."""
+        info = outpdf._info.getObject()
+        return info.get('/Title', None), info.get('/Author', None)
+    
+    def set_info(self, outpdf, pdf, title=None, author=None):
+        """Set the title and author of the new file outpdf, to those of
+        pdf where they are None.
+        
+        """
+        from pyPdf.generic import NameObject, TextStringObject
+        info_dict = {}
+        if title is not None:
+            info_dict[NameObject('/Title')] = TextStringObject(title)
+        else:
+            try:
+                info_dict[NameObject('/Title')] = pdf.documentInfo['/Title']
+            except KeyError:
+                pass
+        if author is not None:
+            info_dict[NameObject('/Author')] = TextStringObject(author)
+        else:
+            try:
+                info_dict[NameObject('/Author')] = pdf.documentInfo['/Author']
+            except KeyError:
+                pass
+        
+        info = outpdf._info.getObject()
+        info.update(info_dict)
+    
+    def write(self, outpdf, stream, optimize=False):
+        """Write the new file outpdf to stream.  If optimize, it is laid
+        out for the reader to open quickly, as by optimize().
+        
+        """
+        if not optimize:
+            outpdf.write(stream)
+            return
+        from tempfile import TemporaryFile
+        tmp = TemporaryFile()
+        try:
+            outpdf.write(tmp)
+            tmp.seek(0)
+            self.optimize(tmp, stream)
+        finally:
+            tmp.close()
+    
+    def optimize(self, fd, stream):
+        """Write the PDF file read from fd to stream, with object streams,
+        cross-reference streams, and linearization.
+        
+        """
+        from pyPdf import PdfFileReader
+        from pdfoptimize import OptimizedPdfWriter
+        OptimizedPdfWriter(PdfFileReader(fd)).write(stream)
@@ -23,9 +23,7 @@ def pdf_add_content(content_string, page, scale=1, offsetx=0, offsety=0):
             offsety         translation of offsetx and offsety.
     
     """
-    coord_trans = '%.2f 0 0 %.2f %.2f %.2f cm' % (scale, scale, offsetx, offsety)
-    commands = '\n'.join(('Q', 'q', coord_trans, content_string, 'Q'))
-    
+    commands = content_commands(content_string, scale, offsetx, offsety)
     try:
         orig_content = page['/Contents'].getObject()
     except KeyError:
@@ -35,6 +33,14 @@ def pdf_add_content(content_string, page, scale=1, offsetx=0, offsety=0):
     stream.operations.append([[], commands])  # graphics state at the end.
     page[NameObject('/Contents')] = stream
 
+def content_commands(content_string, scale=1, offsetx=0, offsety=0):
+    """The commands that pdf_add_content() appends to the page's content
+    stream, after a 'q' is put at its start.
+    
+    """
+    coord_trans = '%.2f 0 0 %.2f %.2f %.2f cm' % (scale, scale, offsetx, offsety)
+    return '\n'.join(('Q', 'q', coord_trans, content_string, 'Q'))
+
 def svg_to_pdf_content(svg):
     """The world's worst SVG-to-PDF converter.
     
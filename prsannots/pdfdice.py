@@ -7,19 +7,24 @@
 import os
 from subprocess import call
 from tempfile import mkstemp
-from pyPdf.pdf import PdfFileWriter, PdfFileReader, PageObject, \
-                      NameObject, RectangleObject
-from generic import intersection
+from pyPdf.pdf import PdfFileReader, PageObject, NameObject, RectangleObject
+from generic import intersection, DiceMap
+from pdfbackend import get_backend
+from stats import NULL_STATS
+from profiling import sample_memory
+from progress import NULL_PROGRESS, ProgressStream
 
 PAGE_BOXES = ("/MediaBox", "/CropBox", "/BleedBox", "/TrimBox", "/ArtBox")
 
 _mm = 72 / 25.4
 UNITS = {'pt': 1, 'in': 72, 'mm': _mm, 'cm': 10*_mm}
 
-def dice(inpdf, ncols, nrows, crop=0, overlap=0.05):
+@sample_memory('pdfdice.dice')
+def dice(inpdf, ncols, nrows, crop=0, overlap=0.05, progress=NULL_PROGRESS, backend=None,
+         downsample=None):
     """Dice each page in the PDF file into a number of sub-pages.
     
-    Inputs: inpdf       The pyPdf.PdfFileReader to be diced.
+    Inputs: inpdf       The PDF file to be diced, as opened by backend.
             
             ncols       Each page will be diced into ncols columns and
             nrows       nrows rows.
@@ -33,14 +38,27 @@ def dice(inpdf, ncols, nrows, crop=0, overlap=0.05):
                         percentage of the cropped page size.  Either a
                         float or a list of two floats for the horizontal
                         and vertical overlaps.
+            
+            progress    A progress.Progress object, told of each page
+                        diced and checked for cancellation.
+            
+            backend     The pdfbackend backend to use.  If None, use
+                        pyPdf's.
+            
+            downsample  A pdfimages.Downsampler for backend, to resample
+                        the images of each sub-page, or None.
     
-    Output: outpdf      A pyPdf.PdfFileWriter for the diced PDF.
+    Output: outpdf      The diced PDF file, made by backend.writer().
+                        With pyPdf, if it has more than
+                        pdfwriter.STREAMING_PAGES pages, the pages are
+                        diced as it is written.
             
-            dice_map    A list of tuples, one for each page in outpdf.
-                        Each tuple is of the form (page, bbox), where
-                        page is the page in inpdf and bbox a tuple of
-                        length 4 giving the bounding box that specifies
-                        the diced page on the original page.
+            dice_map    A generic.DiceMap, which acts as a list of
+                        tuples, one for each page in outpdf.  Each tuple
+                        is of the form (page, bbox), where page is the
+                        page in inpdf and bbox a tuple of length 4 giving
+                        the bounding box that specifies the diced page
+                        on the original page.
     
     """
     if isinstance(crop, (float, int)):
@@ -57,37 +75,83 @@ def dice(inpdf, ncols, nrows, crop=0, overlap=0.05):
     if len(overlap) == 1:
         overlap = (overlap[0], overlap[0])
     
-    outpdf = PdfFileWriter()
-    dice_map = []
-    for i, page in enumerate(inpdf.pages):
-        bboxes = dice_page(outpdf, page, ncols, nrows, crop, overlap)
-        for bbox in bboxes:
-            dice_map.append((i, bbox))
+    if backend is None:
+        backend = get_backend('pypdf')
+    dice_map = DiceMap()
+    grids = []
+    npages = backend.num_pages(inpdf)
+    progress.stage('dice')
+    for i in xrange(npages):
+        progress.check()
+        grid = dice_grid(backend.page(inpdf, i), ncols, nrows, crop, overlap, backend)
+        dice_map.append(i, ncols, nrows, grid)
+        grids.append(grid)
+        progress.pages(i + 1, npages)
+    
+    def pages(outpdf):
+        for i, grid in enumerate(grids):
+            for newpage in diced_pages(backend.page(inpdf, i), ncols, nrows, grid, backend):
+                if downsample is not None:
+                    downsample.page(outpdf, newpage)
+                yield newpage
+    outpdf = backend.writer(pages, len(dice_map))
     return outpdf, dice_map
 
-def write_pdf(outpdf, filename, gs=False):
+def write_pdf(outpdf, filename, gs=False, stats=NULL_STATS, progress=NULL_PROGRESS,
+              backend=None, optimize=False):
     """Write the PDF file, possibly sending running it through Ghostscript.
     
-    Inputs: outpdf      The pyPdf.PdfFileWriter to be output.
+    Inputs: outpdf      The PDF file to be output, made by backend.
             
             filename    The file where the PDF is to be saved.
             
             gs          If True, the file will be sent through Ghostscript's
                         pdfwrite device.  Sometimes this can reduce the
                         file size and improve the Reader's rendering time.
+            
+            stats       A stats.Stats object, to record the time spent.
+            
+            progress    A progress.Progress object, told of the bytes
+                        written.  If the write is cancelled, the partly
+                        written file is removed.
+            
+            backend     The pdfbackend backend that made outpdf.  If
+                        None, pyPdf's.
+            
+            optimize    If True, the file is laid out for the reader to
+                        open quickly, with object streams and
+                        linearization.  See pdfoptimize.
+    
+    If stats are being recorded, the file written is then opened to find
+    how long its first page takes to read.
     
     """
+    if backend is None:
+        backend = get_backend('pypdf')
     if gs:
-        info = outpdf._info.getObject()
-        title = info.get('/Title', None)
-        author = info.get('/Author', None)
+        title, author = backend.info(outpdf)
         
         tmpfd, tmpfn = mkstemp()
         tmp = os.fdopen(tmpfd, 'wb')
-        outpdf.write(tmp)
+        progress.stage('write')
+        try:
+            with stats.stage('write'):
+                backend.write(outpdf, ProgressStream(tmp, progress))
+                stats.count('bytes_written', tmp.tell())
+        except:
+            tmp.close()
+            os.unlink(tmpfn)
+            raise
         tmp.close()
+        progress.stage('ghostscript')
+        if optimize:
+            # Ghostscript's output is optimized into filename.
+            gsfd, gsfn = mkstemp()
+            os.close(gsfd)
+        else:
+            gsfn = filename
         callarr = ['gs', '-sDEVICE=pdfwrite', '-dCompatibility=1.4', '-dNOPAUSE',
-                   '-dQUIET', '-dBATCH', '-sOutputFile=%s' % filename, tmpfn]
+                   '-dQUIET', '-dBATCH', '-sOutputFile=%s' % gsfn, tmpfn]
         
         if title or author:
             # See http://milan.kupcevic.net/ghostscript-ps-pdf/#marks
@@ -105,15 +169,70 @@ def write_pdf(outpdf, filename, gs=False):
         else:
             markfn = None
         
-        retcode = call(callarr)
+        with stats.stage('ghostscript'):
+            retcode = call(callarr)
+            if retcode == 0:
+                stats.count('bytes_written', os.path.getsize(gsfn))
         os.unlink(tmpfn)
         if markfn is not None:
             os.unlink(markfn)
         if retcode == 0:
+            if optimize:
+                progress.stage('optimize')
+                try:
+                    with stats.stage('optimize'):
+                        gsout = open(gsfn, 'rb')
+                        try:
+                            _write_file(filename, lambda stream: backend.optimize(gsout, stream),
+                                        stats, progress)
+                        finally:
+                            gsout.close()
+                finally:
+                    os.unlink(gsfn)
+            _time_first_page(filename, stats)
             return
+        if optimize:
+            os.unlink(gsfn)
         print "Error code %i returned by Ghostscript.  Trying direct output." % retcode
     
-    outpdf.write(open(filename, 'wb'))
+    progress.stage('write')
+    with stats.stage('write'):
+        _write_file(filename, lambda stream: backend.write(outpdf, stream, optimize),
+                    stats, progress)
+    _time_first_page(filename, stats)
+
+def _write_file(filename, write, stats, progress):
+    """Call write with a stream to filename, which is removed if write
+    fails.
+    
+    """
+    fd = open(filename, 'wb')
+    try:
+        stream = ProgressStream(fd, progress)
+        write(stream)
+        stream.report()
+        stats.count('bytes_written', fd.tell())
+    except:
+        fd.close()
+        os.unlink(filename)
+        raise
+    fd.close()
+
+def _time_first_page(filename, stats):
+    """Record the time and bytes needed to read the first page of
+    filename, if stats are being recorded.
+    
+    """
+    if stats is NULL_STATS:
+        return
+    from pdfoptimize import read_first_page
+    with stats.stage('first page'):
+        fd = open(filename, 'rb')
+        try:
+            stats.count('bytes_read', read_first_page(fd))
+        finally:
+            fd.close()
+        stats.count('pages', 1)
 
 # Helper functions
 def copy_page(page):
@@ -125,26 +244,38 @@ def copy_page(page):
             newpage[NameObject(attr)] = RectangleObject(list(page[attr]))
     return newpage
 
-def dice_page(outpdf, page, ncols, nrows, crop, overlap):
-    obox = map(float, intersection(page.cropBox[:], page.mediaBox[:]))
+def dice_grid(page, ncols, nrows, crop, overlap, backend=None):
+    """Return the grid (x0, y0, width, height, xspace, yspace) for dicing page."""
+    if backend is None:
+        backend = get_backend('pypdf')
+    obox = map(float, intersection(backend.crop_box(page), backend.media_box(page)))
     box = (obox[0] + crop[0], obox[1] + crop[1], obox[2] - crop[2], obox[3] - crop[3])
     width = (box[2] - box[0]) * ((1. - overlap[0])/ncols + overlap[0])
     xspace = (box[2] - box[0]) * (1. - overlap[0])/ncols
     height = (box[3] - box[1]) * ((1. - overlap[1])/nrows + overlap[1])
     yspace = (box[3] - box[1]) * (1. - overlap[1])/nrows
-    x0, y0 = box[0], box[1]
-    
+    return (box[0], box[1], width, height, xspace, yspace)
+
+def diced_pages(page, ncols, nrows, grid, backend=None):
+    """Yield the sub-pages of page, diced by grid."""
+    if backend is None:
+        backend = get_backend('pypdf')
+    for tile in range(ncols * nrows):
+        newpage = backend.copy_page(page)
+        backend.set_boxes(newpage, DiceMap.bbox(grid, ncols, nrows, tile))
+        yield newpage
+
+def add_diced_pages(outpdf, page, ncols, nrows, grid):
     bboxes = []
-    for col in range(ncols):
-        for row in range(nrows-1, -1, -1):
-            newpage = copy_page(page)
-            bbox = (col * xspace + x0, row * yspace + y0,
-                    col * xspace + x0 + width, row * yspace + y0 + height)
-            newpage.cropBox = newpage.artBox = newpage.trimBox = newpage.mediaBox = RectangleObject(bbox)
-            outpdf.addPage(newpage)
-            bboxes.append(bbox)
+    for tile, newpage in enumerate(diced_pages(page, ncols, nrows, grid)):
+        outpdf.addPage(newpage)
+        bboxes.append(DiceMap.bbox(grid, ncols, nrows, tile))
     return bboxes
 
+def dice_page(outpdf, page, ncols, nrows, crop, overlap):
+    grid = dice_grid(page, ncols, nrows, crop, overlap)
+    return add_diced_pages(outpdf, page, ncols, nrows, grid)
+
 
 if __name__ == '__main__':
     import sys
@@ -0,0 +1,253 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Resample the images of PDF files for the reader's screen.
+
+Scanned books are often 300 or 600 dpi, and in color.  The reader's
+screen shows shades of gray at about 167 dpi, so most of those pixels
+are never seen, but the reader must still decode them all at each page
+turn.  A Downsampler resamples the images of the pages written to the
+reader to a target resolution, converts them to grayscale, and
+re-encodes them.
+
+The resolution is that of the image as it appears on the screen.  A
+page, or a tile of a diced page, is enlarged to fill the screen, so an
+image on a small tile keeps more of its pixels than the same image on a
+whole page.  The size at which each image is drawn is found from the
+content stream of the first page that draws it.  Images drawn only from
+within forms, and those that can't be decoded (JBIG2, CCITT, and JPEG
+2000 images, those with masks, and those in other color spaces), are
+left as they are.
+
+Only the copy on the reader is changed; annotations are still synced
+onto the original file.  This needs the Python Imaging Library, or
+Pillow.
+"""
+
+import zlib
+from math import hypot, ceil
+from cStringIO import StringIO
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        Image = None
+
+# The reader's screen, in pixels, and its resolution
+SCREEN_SIZE = (600, 800)
+SCREEN_DPI = 167
+JPEG_QUALITY = 75
+# Images that would shrink less than this are only made gray, not
+# resampled.
+RESAMPLE_THRESHOLD = 0.9
+
+def _multiply(m, n):
+    """The product of the transformation matrices m and n."""
+    return (m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+            m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3],
+            m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5])
+
+def drawn_sizes(operations):
+    """Find the sizes at which a content stream draws its XObjects.
+    
+    Input:  operations  The operations of the content stream, as given
+                        by a pdfbackend backend's content_operations().
+    
+    Output: A dictionary mapping the names of the XObjects drawn to the
+            largest (width, height), in points, they are drawn at.
+    
+    """
+    ctm = (1, 0, 0, 1, 0, 0)
+    stack = []
+    sizes = {}
+    for operands, operator in operations:
+        if operator == 'q':
+            stack.append(ctm)
+        elif operator == 'Q':
+            if stack:
+                ctm = stack.pop()
+        elif operator == 'cm' and len(operands) == 6:
+            try:
+                ctm = _multiply([float(x) for x in operands], ctm)
+            except (TypeError, ValueError):
+                pass
+        elif operator == 'Do' and operands:
+            # Images fill the unit square.
+            width, height = hypot(ctm[0], ctm[1]), hypot(ctm[2], ctm[3])
+            old = sizes.get(operands[0], (0, 0))
+            sizes[operands[0]] = (max(old[0], width), max(old[1], height))
+    return sizes
+
+def zoom(box, rotation=0):
+    """How much a page with crop box box, shown rotated by rotation
+    degrees, is enlarged to fill the screen.
+    
+    """
+    width, height = float(box[2] - box[0]), float(box[3] - box[1])
+    if rotation % 180 == 90:
+        width, height = height, width
+    if width <= 0 or height <= 0:
+        return 1
+    return min(SCREEN_SIZE[0] * 72. / SCREEN_DPI / width,
+               SCREEN_SIZE[1] * 72. / SCREEN_DPI / height)
+
+def _components(colorspace):
+    """The number of color components of colorspace, if it is gray or
+    RGB.  Otherwise, None.
+    
+    """
+    if isinstance(colorspace, list) and colorspace:
+        if colorspace[0] == '/ICCBased' and len(colorspace) > 1:
+            return isinstance(colorspace[1], dict) and colorspace[1].get('/N') or None
+        colorspace = colorspace[0]
+    return {'/DeviceGray': 1, '/CalGray': 1, '/DeviceRGB': 3, '/CalRGB': 3}.get(colorspace)
+
+def decode_image(params, data):
+    """Decode an image of a PDF file.
+    
+    Inputs: params  The image's dictionary, as given by a pdfbackend
+                    backend's image_params().
+            
+            data    The image's data, still encoded.
+    
+    Output: A tuple (image, jpeg), where image is the PIL Image and jpeg
+            whether it was a JPEG, or None if the image can't be decoded.
+    
+    """
+    if (params.get('/ImageMask') or '/Mask' in params or '/SMask' in params
+            or '/Decode' in params or params.get('/BitsPerComponent') != 8):
+        return None
+    ncomponents = _components(params.get('/ColorSpace'))
+    if ncomponents is None:
+        return None
+    filters = params.get('/Filter', [])
+    if not isinstance(filters, list):
+        filters = [filters]
+    decode_parms = params.get('/DecodeParms')
+    if isinstance(decode_parms, list):
+        decode_parms = decode_parms and decode_parms[0]
+    try:
+        if filters == ['/DCTDecode']:
+            image = Image.open(StringIO(data))
+            image.load()
+            if image.mode not in ('L', 'RGB'):
+                return None
+            return image, True
+        if filters not in ([], ['/FlateDecode']):
+            return None
+        if decode_parms and decode_parms.get('/Predictor', 1) > 1:
+            return None
+        if filters:
+            data = zlib.decompress(data)
+        size = (int(params['/Width']), int(params['/Height']))
+        if len(data) < size[0] * size[1] * ncomponents:
+            return None
+        mode = ncomponents == 1 and 'L' or 'RGB'
+        return Image.frombuffer(mode, size, data, 'raw', mode, 0, 1), False
+    except (IOError, ValueError, KeyError, zlib.error):
+        return None
+
+
+class Downsampler(object):
+    """Resamples the images of the pages written to a PDF file.  Each
+    image is converted once, and the new version used on every page
+    with the old one.  A Downsampler is for just one new file.
+    
+    """
+    
+    def __init__(self, dpi, backend, quality=JPEG_QUALITY):
+        """Inputs: dpi         The resolution, in dots per inch, images
+                                are to have on the reader's screen.
+                    
+                    backend     The pdfbackend backend of the pages.
+                    
+                    quality     The quality of the JPEG images written,
+                                from 1 to 95.
+        
+        """
+        if Image is None:
+            raise ImportError, "Resampling images needs the Python Imaging Library."
+        self.dpi = dpi
+        self.backend = backend
+        self.quality = quality
+        self._images = {}   # The new version of each image, or None to keep it
+    
+    def convert(self, params, data, size, zoom=1):
+        """Resample an image, if that makes it smaller.
+        
+        Inputs: params  The image's dictionary, as given by the backend's
+                        image_params().
+                
+                data    The image's data, still encoded.
+                
+                size    The (width, height), in points, the image is
+                        drawn at.
+                
+                zoom    How much the page is enlarged on the screen.
+        
+        Output: A tuple (params, data) for the new image, or None if the
+                image is to be kept.
+        
+        """
+        decoded = decode_image(params, data)
+        if decoded is None:
+            return None
+        image, jpeg = decoded
+        width, height = image.size
+        scale = max(size[0] * zoom * self.dpi / 72. / width,
+                    size[1] * zoom * self.dpi / 72. / height)
+        if scale > RESAMPLE_THRESHOLD and image.mode == 'L':
+            return None
+        if image.mode != 'L':
+            image = image.convert('L')
+        if scale <= RESAMPLE_THRESHOLD:
+            image = image.resize((max(1, int(ceil(width * scale))),
+                                  max(1, int(ceil(height * scale)))), Image.ANTIALIAS)
+        if jpeg:
+            stream = StringIO()
+            image.save(stream, 'JPEG', quality=self.quality)
+            newdata = stream.getvalue()
+        else:
+            tobytes = getattr(image, 'tobytes', None) or image.tostring
+            newdata = zlib.compress(tobytes())
+        if len(newdata) >= len(data):
+            return None
+        newparams = {'/Type': '/XObject', '/Subtype': '/Image',
+                     '/Width': image.size[0], '/Height': image.size[1],
+                     '/ColorSpace': '/DeviceGray', '/BitsPerComponent': 8,
+                     '/Filter': jpeg and '/DCTDecode' or '/FlateDecode'}
+        if params.get('/Interpolate'):
+            newparams['/Interpolate'] = True
+        return newparams, newdata
+    
+    def page(self, outpdf, page):
+        """Give page, which is to be added to the new file outpdf, the
+        resampled versions of its images.  Returns page.
+        
+        """
+        backend = self.backend
+        sizes = None
+        replace = {}
+        for name, key, image in backend.images(page):
+            if key not in self._images:
+                if sizes is None:
+                    sizes = drawn_sizes(backend.content_operations(page))
+                    page_zoom = zoom(backend.crop_box(page), backend.rotation(page))
+                if name not in sizes:
+                    # Perhaps a later page draws it.
+                    continue
+                new = self.convert(backend.image_params(image), backend.image_data(image),
+                                   sizes[name], page_zoom)
+                if new is not None:
+                    new = backend.add_image(outpdf, page, *new)
+                self._images[key] = new
+            if self._images[key] is not None:
+                replace[name] = self._images[key]
+        if replace:
+            backend.set_images(page, replace)
+        return page
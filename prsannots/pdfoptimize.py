@@ -0,0 +1,754 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Lay out PDF files for the reader to open quickly.
+
+The reader's processor is slow.  Before it can show the first page of
+an ordinary PDF file, it must read the cross-reference table at the end
+of the file, twenty bytes for every object, and then find the objects
+of the first page wherever they happen to be.  An OptimizedPdfWriter
+rewrites a PDF file so that:
+  
+  - Objects other than pages and streams are packed, a hundred at a
+    time, into compressed object streams, and the cross-reference
+    tables are compressed streams too (PDF 1.5).
+  - The file is linearized (PDF Reference, Appendix F).  It starts with
+    a short cross-reference stream for the objects of the first page,
+    followed by those objects, so the first page can be shown from the
+    start of the file.  The other pages follow in order, each with the
+    objects only it uses, and then the objects that several pages
+    share.  A hint stream gives the position of each page.
+
+This is done with pyPdf alone, so it needs neither Ghostscript nor
+qpdf.  The layout follows that of qpdf, whose --check-linearization
+accepts the files made.  The input is read twice: once to find which
+pages use which objects, and once to write the objects.  They are
+written to a temporary file, so that the start of the output, which
+gives the positions of the rest, can be written first.  The output
+itself is written in order, without seeking.
+"""
+
+import re
+import zlib
+from cStringIO import StringIO
+from tempfile import TemporaryFile
+from pyPdf.pdf import PdfFileReader
+from pyPdf.utils import PdfReadError
+from pyPdf.generic import DictionaryObject, ArrayObject, StreamObject, IndirectObject, \
+                          NameObject, NumberObject, NullObject, readObject
+
+# The most objects packed into one object stream
+OBJECT_STREAM_SIZE = 100
+# Entries of the catalog needed to open the document, whose objects come
+# before the first page
+OPEN_DOCUMENT_KEYS = ('/ViewerPreferences', '/PageMode', '/Threads', '/OpenAction',
+                      '/AcroForm')
+
+# Objects are known by keys.  Those of the input are (idnum, generation);
+# these are those written anew.  The pages are ('page', i).
+ROOT = 'root'
+PAGES = 'pages'
+
+HEADER = '%PDF-1.5\n%\xe2\xe3\xcf\xd3\n'
+# A number at least as long as any offset or length in the file, to find
+# the space to leave for the objects written last
+PLACEHOLDER = 10**12
+COPY_CHUNK = 64 * 1024
+
+def nbits(value):
+    """The number of bits needed to hold value."""
+    return int(value).bit_length()
+
+def _pack(value, width):
+    """value as a big-endian number of width bytes."""
+    return ''.join(chr((value >> (8 * i)) & 0xff) for i in reversed(xrange(width)))
+
+def _indirect_refs(obj):
+    """The keys of the objects referred to from the direct object obj."""
+    refs = []
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, IndirectObject):
+            refs.append((obj.idnum, obj.generation))
+        elif isinstance(obj, DictionaryObject):
+            stack.extend(obj.values())
+        elif isinstance(obj, ArrayObject):
+            stack.extend(obj)
+    refs.reverse()
+    return refs
+
+
+class _BitWriter(object):
+    """Packs numbers of any number of bits into a string, as needed for
+    the hint tables.
+    
+    """
+    
+    def __init__(self):
+        self._bytes = []
+        self._value = 0
+        self._nbits = 0
+    
+    def write(self, value, nbits):
+        self._value = (self._value << nbits) | value
+        self._nbits += nbits
+        while self._nbits >= 8:
+            self._nbits -= 8
+            self._bytes.append(chr((self._value >> self._nbits) & 0xff))
+        self._value &= (1 << self._nbits) - 1
+    
+    def write_vector(self, values, nbits):
+        """Write each of values, and then pad to a whole byte."""
+        for value in values:
+            self.write(value, nbits)
+        self.flush()
+    
+    def flush(self):
+        if self._nbits:
+            self.write(0, 8 - self._nbits)
+    
+    def getvalue(self):
+        self.flush()
+        return ''.join(self._bytes)
+
+
+class OptimizedPdfWriter(object):
+    """Writes a copy of a PDF file with object streams, cross-reference
+    streams, and linearization.
+    
+    Objects are sorted into the parts of a linearized file by their
+    users: the pages that refer to them, and the entries of the catalog
+    and trailer.  The output is made of units, each either an object or
+    an object stream.  The objects packed together in a stream all
+    belong to the same part, so that the stream does too.
+    
+    """
+    
+    def __init__(self, inpdf):
+        """Input:  inpdf   The PDF file to rewrite, a pyPdf.PdfFileReader.
+        
+        """
+        if inpdf.isEncrypted:
+            raise ValueError, "Cannot optimize an encrypted PDF file."
+        self.inpdf = inpdf
+        self.npages = inpdf.getNumPages()
+        if not self.npages:
+            raise ValueError, "Cannot linearize a PDF file without pages."
+        self._alias = {}      # Keys of the input written as something else, or None
+        self._refs = {}       # The keys each object of the input refers to
+        self._users = {}      # The users of each object
+        self._order = []      # The objects, in the order first found
+        self._streams = set()
+        self._number = {}     # The object number of each key in the output
+    
+    def _key(self, key):
+        return self._alias.get(key, key)
+    
+    def _get(self, key):
+        return self.inpdf.getObject(IndirectObject(key[0], key[1], self.inpdf))
+    
+    def _load(self, key):
+        """Note the references of the object key.  Returns False, and
+        aliases key, if it is not to be written as it is.
+        
+        """
+        try:
+            obj = self._get(key)
+        except (KeyError, PdfReadError):
+            obj = None
+        if obj is None or isinstance(obj, NullObject):
+            self._alias[key] = None
+            return False
+        if isinstance(obj, DictionaryObject):
+            if obj.get('/Type') == '/Pages':
+                self._alias[key] = PAGES
+                return False
+            if obj.get('/Type') == '/Page':
+                # Not a page of the document
+                self._alias[key] = None
+                return False
+        if isinstance(obj, StreamObject):
+            self._streams.add(key)
+        self._refs[key] = _indirect_refs(obj)
+        self._users[key] = set()
+        self._order.append(key)
+        return True
+    
+    def _visit(self, obj, user):
+        """Note that user uses the objects that the direct object obj
+        refers to, and those that they refer to, and so on.  Other pages
+        are not followed.
+        
+        """
+        stack = _indirect_refs(obj)
+        stack.reverse()
+        while stack:
+            key = self._key(stack.pop())
+            if key is None or key in (ROOT, PAGES) or key[0] == 'page':
+                continue
+            if key not in self._users and not self._load(key):
+                continue
+            users = self._users[key]
+            if user not in users:
+                users.add(user)
+                stack.extend(reversed(self._refs[key]))
+    
+    def _analyze(self):
+        inpdf = self.inpdf
+        root = inpdf.trailer.raw_get('/Root')
+        self._alias[(root.idnum, root.generation)] = ROOT
+        catalog = root.getObject()
+        pages = catalog.raw_get('/Pages')
+        if isinstance(pages, IndirectObject):
+            self._alias[(pages.idnum, pages.generation)] = PAGES
+        for i in xrange(self.npages):
+            ref = inpdf.getPage(i).indirectRef
+            if ref is not None:
+                self._alias.setdefault((ref.idnum, ref.generation), ('page', i))
+        
+        for key, value in catalog.items():
+            if key not in ('/Type', '/Pages'):
+                self._visit(value, ('root', key))
+        self._use_outlines = catalog.get('/PageMode') == '/UseOutlines'
+        for i in xrange(self.npages):
+            page = inpdf.getPage(i)
+            for key, value in page.items():
+                if key == '/Thumb':
+                    self._visit(value, ('thumb', i))
+                elif key != '/Parent':
+                    self._visit(value, ('page', i))
+            inpdf.resolvedObjects.clear()
+        for key, value in inpdf.trailer.items():
+            if key not in ('/Root', '/Size', '/Prev', '/ID', '/Encrypt', '/XRefStm'):
+                self._visit(value, ('trailer', key))
+        inpdf.resolvedObjects.clear()
+    
+    def _part(self, users):
+        """The part of the file for an object with users: 'open', 'first',
+        ('page', i) for pages after the first, 'shared', ('thumb', i),
+        'thumbs', 'outlines', or 'other'.  This is how qpdf divides them.
+        
+        """
+        pages = set()
+        thumbs = set()
+        others = 0
+        outlines = False
+        for user in users:
+            kind, which = user
+            if kind == 'root':
+                if which in OPEN_DOCUMENT_KEYS:
+                    return 'open'
+                elif which == '/Outlines':
+                    outlines = True
+                else:
+                    others += 1
+            elif kind == 'page':
+                pages.add(which)
+            elif kind == 'thumb':
+                thumbs.add(which)
+            else:
+                others += 1
+        if 0 in pages:
+            return 'first'
+        if len(pages) == 1 and not others and not thumbs:
+            return ('page', pages.pop())
+        if len(pages) > 1:
+            return 'shared'
+        if len(thumbs) == 1 and not others:
+            return ('thumb', thumbs.pop())
+        if thumbs:
+            return 'thumbs'
+        if outlines:
+            return 'outlines'
+        return 'other'
+    
+    def _compressible(self, key, part):
+        """Whether the object key, in part, may go in an object stream.
+        Whatever else goes in the stream, it must stay in the same part.
+        
+        """
+        if key in self._streams:
+            return False
+        if part in ('first', 'shared') or isinstance(part, tuple) and part[0] == 'page':
+            return True
+        return part == 'other' and not [u for u in self._users[key] if u[0] == 'page']
+    
+    def _layout(self):
+        """Sort the objects into units and parts, and number them."""
+        groups = {}
+        filling = {}   # The object stream being filled for each part
+        for key in self._order:
+            part = self._part(self._users[key])
+            units = groups.setdefault(part, [])
+            if self._compressible(key, part):
+                stream = filling.get(part)
+                if stream is None or len(stream[0]) >= OBJECT_STREAM_SIZE:
+                    stream = filling[part] = ([], True)
+                    units.append(stream)
+                stream[0].append(key)
+            else:
+                units.append(([key], False))
+        
+        self.part4 = [([ROOT], False)] + groups.get('open', [])
+        self.part6 = [([('page', 0)], False)] + groups.get('first', [])
+        self.outlines = groups.get('outlines', [])
+        if self._use_outlines:
+            self.part6 += self.outlines
+        self.part7 = [[([('page', i)], False)] + groups.get(('page', i), [])
+                      for i in xrange(1, self.npages)]
+        self.part8 = groups.get('shared', [])
+        self.part9 = [([PAGES], False)]
+        for i in xrange(self.npages):
+            self.part9 += groups.get(('thumb', i), [])
+        self.part9 += groups.get('thumbs', [])
+        if not self._use_outlines:
+            self.part9 += self.outlines
+        self.part9 += groups.get('other', [])
+        
+        # The main section, for the pages after the first, is numbered
+        # from 1, and the first-page section after it.  In each, the
+        # compressed objects come after the others.
+        main = sum(self.part7, []) + self.part8 + self.part9
+        num = self._number_units(main, 1)
+        self.main_xref = num
+        num = self._number_members(main, num + 1)
+        self.first = num
+        self.lin = num
+        self.first_xref = num + 1
+        num = self._number_units(self.part4, num + 2)
+        self.hint = num
+        num = self._number_units(self.part6, num + 1)
+        num = self._number_members(self.part4 + self.part6, num)
+        self.size = num
+    
+    def _number_units(self, units, num):
+        """Number units from num, returning the next number."""
+        for keys, stream in units:
+            if stream:
+                self._number[id(keys)] = num
+            else:
+                self._number[keys[0]] = num
+            num += 1
+        return num
+    
+    def _number_members(self, units, num):
+        """Number the objects in the object streams of units."""
+        for keys, stream in units:
+            if stream:
+                for key in keys:
+                    self._number[key] = num
+                    num += 1
+        return num
+    
+    def _unit_number(self, unit):
+        keys, stream = unit
+        if stream:
+            return self._number[id(keys)]
+        return self._number[keys[0]]
+    
+    def _ref(self, num):
+        return IndirectObject(num, 0, None)
+    
+    def _translate(self, obj):
+        """A copy of obj referring to objects by their new numbers."""
+        if isinstance(obj, IndirectObject):
+            num = self._number.get(self._key((obj.idnum, obj.generation)))
+            if num is None:
+                return NullObject()
+            return self._ref(num)
+        if isinstance(obj, StreamObject):
+            new = StreamObject()
+            new._data = obj._data
+            for key, value in obj.items():
+                if key != '/Length':
+                    new[key] = self._translate(value)
+            if '/Filter' not in new and new._data:
+                data = zlib.compress(new._data)
+                if len(data) < len(new._data):
+                    new[NameObject('/Filter')] = NameObject('/FlateDecode')
+                    new._data = data
+            return new
+        if isinstance(obj, DictionaryObject):
+            new = DictionaryObject()
+            for key, value in obj.items():
+                new[key] = self._translate(value)
+            return new
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self._translate(value) for value in obj])
+        return obj
+    
+    def _object(self, key):
+        """The object key, as it is to be written."""
+        if key == ROOT:
+            root = self._translate(self.inpdf.trailer['/Root'])
+            root[NameObject('/Pages')] = self._ref(self._number[PAGES])
+            return root
+        if key == PAGES:
+            pages = DictionaryObject()
+            pages[NameObject('/Type')] = NameObject('/Pages')
+            pages[NameObject('/Kids')] = ArrayObject([self._ref(self._number[('page', i)])
+                                                      for i in xrange(self.npages)])
+            pages[NameObject('/Count')] = NumberObject(self.npages)
+            return pages
+        if key[0] == 'page':
+            page = DictionaryObject()
+            for name, value in self.inpdf.getPage(key[1]).items():
+                if name != '/Parent':
+                    page[name] = self._translate(value)
+            page[NameObject('/Parent')] = self._ref(self._number[PAGES])
+            return page
+        return self._translate(self._get(key))
+    
+    def _write_object(self, stream, num, obj):
+        stream.write('%i 0 obj\n' % num)
+        obj.writeToStream(stream, None)
+        stream.write('\nendobj\n')
+    
+    def _write_unit(self, spool, unit):
+        """Write unit to spool, noting where it went."""
+        keys, stream = unit
+        start = spool.tell()
+        if stream:
+            offsets = []
+            body = StringIO()
+            for key in keys:
+                offsets.append('%i %i' % (self._number[key], body.tell()))
+                self._object(key).writeToStream(body, None)
+                body.write('\n')
+            header = ' '.join(offsets) + '\n'
+            objstm = StreamObject()
+            objstm[NameObject('/Type')] = NameObject('/ObjStm')
+            objstm[NameObject('/N')] = NumberObject(len(keys))
+            objstm[NameObject('/First')] = NumberObject(len(header))
+            objstm[NameObject('/Filter')] = NameObject('/FlateDecode')
+            objstm._data = zlib.compress(header + body.getvalue())
+            self._write_object(spool, self._unit_number(unit), objstm)
+        else:
+            self._write_object(spool, self._unit_number(unit), self._object(keys[0]))
+        self._position[id(unit)] = start
+        self._length[id(unit)] = spool.tell() - start
+    
+    def _write_units(self, spool, units):
+        for i, unit in enumerate(units):
+            self._write_unit(spool, unit)
+            if i % OBJECT_STREAM_SIZE == OBJECT_STREAM_SIZE - 1:
+                self.inpdf.resolvedObjects.clear()
+        self.inpdf.resolvedObjects.clear()
+    
+    def _users_of(self, unit):
+        keys, stream = unit
+        users = set()
+        for key in keys:
+            users.update(self._users.get(key, ()))
+        return users
+    
+    def _hint_stream(self, offset):
+        """The hint stream, given offset(unit), the offset of unit in the
+        file as if the hint stream were not there.
+        
+        """
+        length = lambda units: sum(self._length[id(unit)] for unit in units)
+        shared = self.part6 + self.part8
+        shared_index = {}
+        for i, unit in enumerate(shared):
+            for user in self._users_of(unit):
+                if user[0] == 'page' and user[1] != 0:
+                    shared_index.setdefault(user[1], []).append(i)
+        
+        # The page offset hint table
+        nobjects = [len(self.part6)] + [len(units) for units in self.part7]
+        lengths = [length(self.part6)] + [length(units) for units in self.part7]
+        nshared = [0] + [len(shared_index.get(i, ())) for i in xrange(1, self.npages)]
+        min_nobjects, min_length = min(nobjects), min(lengths)
+        bits_nobjects = nbits(max(nobjects) - min_nobjects)
+        bits_length = nbits(max(lengths) - min_length)
+        bits_nshared = nbits(max(nshared))
+        bits_shared_id = nbits(len(shared))
+        w = _BitWriter()
+        for value, bits in ((min_nobjects, 32), (offset(self.part6[0]), 32),
+                            (bits_nobjects, 16), (min_length, 32), (bits_length, 16),
+                            (0, 32), (0, 16), (min_length, 32), (bits_length, 16),
+                            (bits_nshared, 16), (bits_shared_id, 16), (0, 16), (4, 16)):
+            w.write(value, bits)
+        w.write_vector([n - min_nobjects for n in nobjects], bits_nobjects)
+        w.write_vector([n - min_length for n in lengths], bits_length)
+        w.write_vector(nshared, bits_nshared)
+        w.write_vector(sum((shared_index.get(i, []) for i in xrange(1, self.npages)), []),
+                       bits_shared_id)
+        w.write_vector([n - min_length for n in lengths], bits_length)
+        page_table = w.getvalue()
+        
+        # The shared object hint table
+        lengths = [length([unit]) for unit in shared]
+        min_length = min(lengths)
+        bits_length = nbits(max(lengths) - min_length)
+        if self.part8:
+            first = (self._unit_number(self.part8[0]), offset(self.part8[0]))
+        else:
+            first = (0, 0)
+        w = _BitWriter()
+        for value, bits in (first[0], 32), (first[1], 32), (len(self.part6), 32), \
+                           (len(shared), 32), (0, 16), (min_length, 32), (bits_length, 16):
+            w.write(value, bits)
+        w.write_vector([n - min_length for n in lengths], bits_length)
+        w.write_vector([0] * len(shared), 1)
+        shared_table = w.getvalue()
+        
+        hint = StreamObject()
+        hint[NameObject('/S')] = NumberObject(len(page_table))
+        data = page_table + shared_table
+        if self.outlines:
+            # The outline hint table
+            hint[NameObject('/O')] = NumberObject(len(data))
+            data += ''.join(_pack(value, 4) for value in (
+                self._unit_number(self.outlines[0]), offset(self.outlines[0]),
+                len(self.outlines), length(self.outlines)))
+        hint[NameObject('/Filter')] = NameObject('/FlateDecode')
+        hint._data = zlib.compress(data)
+        stream = StringIO()
+        self._write_object(stream, self.hint, hint)
+        return stream.getvalue()
+    
+    def _xref_entries(self, units, offset):
+        """The cross-reference entries, by object number, of units, given
+        offset(unit), its offset in the file.
+        
+        """
+        entries = {}
+        for unit in units:
+            num = self._unit_number(unit)
+            entries[num] = (1, offset(unit), 0)
+            keys, stream = unit
+            if stream:
+                for i, key in enumerate(keys):
+                    entries[self._number[key]] = (2, num, i)
+        return entries
+    
+    def _xref_stream(self, num, entries, first, count, size, widths, extra='',
+                     compress=False):
+        data = ''.join(_pack(t, 1) + _pack(a, widths[0]) + _pack(b, widths[1])
+                       for t, a, b in (entries.get(n, (0, 0, 0))
+                                       for n in xrange(first, first + count)))
+        if compress:
+            data = zlib.compress(data)
+            extra += ' /Filter /FlateDecode'
+        return ('%i 0 obj\n<< /Type /XRef /W [ 1 %i %i ] /Index [ %i %i ] /Size %i%s '
+                '/Length %i >>\nstream\n%s\nendstream\nendobj\n'
+                % (num, widths[0], widths[1], first, count, size, extra, len(data), data))
+    
+    def _linearization_dict(self, values):
+        return ('%i 0 obj\n<< /Linearized 1 /L %i /H [ %i %i ] /O %i /E %i /N %i /T %i >>\n'
+                'endobj\n' % ((self.lin,) + values))
+    
+    def _padded(self, text, size):
+        return text + ' ' * (size - len(text) - 1) + '\n'
+    
+    def write(self, stream):
+        """Write the optimized PDF file to stream."""
+        self._analyze()
+        self._layout()
+        self._position = {}
+        self._length = {}
+        spool = TemporaryFile()
+        try:
+            self._write_units(spool, self.part4)
+            split = spool.tell()
+            self._write_units(spool, self.part6)
+            first_end = spool.tell()
+            for units in self.part7:
+                self._write_units(spool, units)
+            self._write_units(spool, self.part8)
+            self._write_units(spool, self.part9)
+            end = spool.tell()
+            
+            # Space for the linearization dictionary and first-page
+            # cross-reference stream, which are written last
+            size = len(HEADER) + 2 * end + 2 * 1024 + 20 * self.size
+            widths = ((max(nbits(size), nbits(self.size)) + 7) // 8, 1)
+            lin_size = len(self._linearization_dict((PLACEHOLDER,) * 7)) + 1
+            extra = ' /Prev %i /Root %i 0 R' % (PLACEHOLDER, PLACEHOLDER)
+            if '/Info' in self.inpdf.trailer:
+                extra += ' /Info %i 0 R' % PLACEHOLDER
+            xref_size = len(self._xref_stream(self.first_xref, {}, self.first,
+                                              self.size - self.first, self.size,
+                                              widths, extra)) + 1
+            base = len(HEADER) + lin_size + xref_size
+            
+            after_hint = lambda unit: self._position[id(unit)] >= split
+            offset = lambda unit: base + self._position[id(unit)]
+            hint = self._hint_stream(offset)
+            actual = lambda unit: offset(unit) + (after_hint(unit) and len(hint) or 0)
+            
+            main = sum(self.part7, []) + self.part8 + self.part9
+            main_offset = base + end + len(hint)
+            entries = self._xref_entries(main, actual)
+            entries[self.main_xref] = (1, main_offset, 0)
+            main_xref = self._xref_stream(self.main_xref, entries, 0, self.first,
+                                          self.first, widths, compress=True)
+            tail = 'startxref\n%i\n%%%%EOF\n' % (len(HEADER) + lin_size)
+            lin = self._linearization_dict((main_offset + len(main_xref) + len(tail),
+                                            base + split, len(hint),
+                                            self._number[('page', 0)],
+                                            base + first_end + len(hint),
+                                            self.npages, main_offset - 1))
+            
+            entries = self._xref_entries(self.part4 + self.part6, actual)
+            entries[self.lin] = (1, len(HEADER), 0)
+            entries[self.first_xref] = (1, len(HEADER) + lin_size, 0)
+            entries[self.hint] = (1, base + split, 0)
+            extra = ' /Prev %i /Root %i 0 R' % (main_offset, self._number[ROOT])
+            if '/Info' in self.inpdf.trailer:
+                info = self._translate(self.inpdf.trailer.raw_get('/Info'))
+                if isinstance(info, IndirectObject):
+                    extra += ' /Info %i 0 R' % info.idnum
+            first_xref = self._xref_stream(self.first_xref, entries, self.first,
+                                           self.size - self.first, self.size,
+                                           widths, extra)
+            
+            stream.write(HEADER)
+            stream.write(self._padded(lin, lin_size))
+            stream.write(self._padded(first_xref, xref_size))
+            spool.seek(0)
+            self._copy(spool, stream, split)
+            stream.write(hint)
+            self._copy(spool, stream, end - split)
+            stream.write(main_xref)
+            stream.write(tail)
+        finally:
+            spool.close()
+    
+    def _copy(self, source, dest, nbytes):
+        while nbytes > 0:
+            data = source.read(min(nbytes, COPY_CHUNK))
+            if not data:
+                raise IOError, "The temporary file was cut short."
+            dest.write(data)
+            nbytes -= len(data)
+
+
+class _CountingStream(object):
+    """A file being read, counting the bytes read from it."""
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_read = 0
+    
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+    
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def _unpack(data):
+    """The big-endian number in the string data, which may be empty."""
+    return data and int(data.encode('hex'), 16) or 0
+
+
+class _FirstPageReader(PdfFileReader):
+    """Reads a linearized PDF file as the reader does before showing the
+    first page: through the first-page cross-reference stream, near the
+    start of the file, alone.  The main cross-reference table at the end
+    of the file is never read, so getting an object not listed in the
+    first-page table raises a KeyError.
+    
+    """
+    
+    def __init__(self, stream, offset):
+        """Inputs: stream  The PDF file, opened for reading.
+                    
+                    offset  The position of the first-page
+                            cross-reference stream.
+        
+        """
+        self._offset = offset
+        PdfFileReader.__init__(self, stream)
+    
+    def read(self, stream):
+        self.xref = {}
+        self.xref_objStm = {}
+        self.trailer = DictionaryObject()
+        stream.seek(self._offset)
+        idnum, generation = self.readObjectHeader(stream)
+        xref = readObject(stream, self)
+        if not isinstance(xref, StreamObject) or xref.get('/Type') != '/XRef':
+            raise PdfReadError, "No cross-reference stream follows the linearization dictionary."
+        self.cacheIndirectObject(generation, idnum, xref)
+        data = StringIO(xref.getData())
+        widths = xref['/W']
+        index = xref.get('/Index', [0, xref['/Size']])
+        for i in range(0, len(index) - 1, 2):
+            for num in xrange(index[i], index[i] + index[i+1]):
+                kind, field1, field2 = [_unpack(data.read(width)) for width in widths]
+                if not widths[0]:
+                    kind = 1
+                if kind == 1:
+                    self.xref.setdefault(field2, {})[num] = field1
+                elif kind == 2:
+                    self.xref_objStm[num] = (field1, field2)
+        for key in ('/Root', '/Info', '/ID', '/Encrypt'):
+            if key in xref:
+                self.trailer[NameObject(key)] = xref.raw_get(key)
+
+def _read_page(page):
+    """Read every object that page uses, other than pages."""
+    seen = set()
+    stack = [value for key, value in page.items() if key != '/Parent']
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, IndirectObject):
+            if (obj.idnum, obj.generation) in seen:
+                continue
+            seen.add((obj.idnum, obj.generation))
+            obj = obj.getObject()
+            if isinstance(obj, DictionaryObject) and obj.get('/Type') in ('/Page', '/Pages'):
+                continue
+        if isinstance(obj, DictionaryObject):
+            stack.extend(obj.values())
+        elif isinstance(obj, ArrayObject):
+            stack.extend(obj)
+
+def read_first_page(stream):
+    """Read what is needed to show the first page of a PDF file, as the
+    reader would, and count the bytes read.
+    
+    A linearized file with a first-page cross-reference stream, as
+    written by OptimizedPdfWriter, is read from its start: the
+    linearization dictionary gives the first page's object number, and
+    the first-page cross-reference stream that follows it gives the
+    positions of the page's objects.  Nothing at the end of the file is
+    read.  Other files, and linearized files whose first page uses
+    objects not in that stream, are read as pyPdf reads them, starting
+    from the cross-reference tables at the end of the file.
+    
+    Input:  stream  The PDF file, opened for reading.
+    
+    Output: The number of bytes read.
+    
+    """
+    counting = _CountingStream(stream)
+    head = counting.read(1024)
+    first = None
+    linearized = re.search(r'<<\s*/Linearized\s(.*?)>>\s*endobj\s*', head, re.S)
+    if linearized:
+        match = re.search(r'/O\s+(\d+)', linearized.group(1))
+        if match:
+            first = int(match.group(1))
+    if first is not None:
+        try:
+            pdf = _FirstPageReader(counting, linearized.end())
+            _read_page(IndirectObject(first, 0, pdf).getObject())
+            return counting.bytes_read
+        except (PdfReadError, KeyError):
+            pass
+    pdf = PdfFileReader(counting)
+    if first is not None:
+        page = IndirectObject(first, 0, pdf).getObject()
+    else:
+        page = pdf.getPage(0)
+    _read_page(page)
+    return counting.bytes_read
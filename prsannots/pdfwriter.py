@@ -0,0 +1,214 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Write PDF files one page at a time.
+
+pyPdf's PdfFileWriter holds every page, and every object they use,
+until the whole file is written, and the readers it copies from keep
+every object they have parsed.  For a scan of a few thousand pages,
+diced, that is gigabytes.  A StreamingPdfWriter is given its pages as
+an iterable.  When written, it writes each page, and the objects it
+uses that haven't been written yet, as soon as the page is produced,
+and then forgets them, keeping only the offsets of the objects for the
+cross-reference table.  Peak memory is set by the largest page, not
+the whole document.
+
+References to other pages, such as in links, are kept if the page is
+written, whether before or after; otherwise they become null.
+"""
+
+from pyPdf.generic import DictionaryObject, ArrayObject, StreamObject, IndirectObject, \
+                          NameObject, NumberObject, NullObject, createStringObject
+
+# Documents with more output pages than this are written a page at a
+# time.  Smaller ones use pyPdf's PdfFileWriter.
+STREAMING_PAGES = 500
+
+class StreamingPdfWriter(object):
+    """A PDF file written a page at a time.
+    
+    It provides the parts of pyPdf.PdfFileWriter's interface used here:
+    _addObject() and getObject() for objects to go with the pages, _info
+    for the document information, and write().  Objects added with
+    _addObject() are written along with the first page that uses them.
+    
+    """
+    
+    def __init__(self, pages):
+        """Input:  pages   The pages to write, as an iterable of
+                            pyPdf.pdf.PageObjects, or as a function that
+                            takes this writer and returns such an
+                            iterable.  It is consumed by write().
+        
+        """
+        self._pages = pages
+        self._offsets = []        # Of each object; None until written
+        self._pending = {}        # Our objects not yet written
+        self._external = {}       # Maps readers to {(generation, idnum): our idnum}
+        self._kids = []           # The idnums of the pages written
+        self._stream = None
+        self._pages_id = self._new_id()
+        self._root_id = self._new_id()
+        info = DictionaryObject()
+        info[NameObject('/Producer')] = createStringObject(u'Python PDF Library - http://pybrary.net/pyPdf/')
+        self._info = self._addObject(info)
+    
+    def _new_id(self):
+        self._offsets.append(None)
+        return len(self._offsets)
+    
+    def _addObject(self, obj):
+        idnum = self._new_id()
+        self._pending[idnum] = obj
+        return IndirectObject(idnum, 0, self)
+    
+    def getObject(self, ido):
+        if ido.pdf is not self:
+            raise ValueError("pdf must be self")
+        try:
+            return self._pending[ido.idnum]
+        except KeyError:
+            raise ValueError("object %i has already been written" % ido.idnum)
+    
+    def _page_id(self, page):
+        """The idnum for page, which may already have been given to
+        references to it.
+        
+        """
+        ref = getattr(page, 'indirectRef', None)
+        if ref is not None:
+            ids = self._external.setdefault(ref.pdf, {})
+            idnum = ids.get((ref.generation, ref.idnum))
+            if idnum is not None and self._offsets[idnum - 1] is None:
+                return idnum
+            # The same page may be written more than once.
+            idnum = ids[(ref.generation, ref.idnum)] = self._new_id()
+            return idnum
+        return self._new_id()
+    
+    def _ref(self, ref, queue):
+        """Our idnum for the indirect reference ref, queueing the object
+        to be written if this is the first reference to it.
+        
+        """
+        if ref.pdf is self:
+            if ref.idnum in self._pending:
+                queue.append((ref.idnum, self._pending.pop(ref.idnum)))
+            return ref.idnum
+        ids = self._external.setdefault(ref.pdf, {})
+        key = (ref.generation, ref.idnum)
+        idnum = ids.get(key)
+        if idnum is None:
+            idnum = ids[key] = self._new_id()
+            obj = ref.getObject()
+            # Pages are written when they come up, or not at all.
+            if not (isinstance(obj, DictionaryObject) and obj.get('/Type') == '/Page'):
+                queue.append((idnum, obj))
+        return idnum
+    
+    def _translate(self, obj, queue):
+        """A copy of obj whose indirect references are to our objects.
+        Streams inside obj are made indirect.
+        
+        """
+        if isinstance(obj, IndirectObject):
+            return IndirectObject(self._ref(obj, queue), 0, self)
+        if isinstance(obj, StreamObject):
+            new = StreamObject()
+            new._data = obj._data
+            for key, value in obj.items():
+                if key != '/Length':
+                    new[key] = self._translate(value, queue)
+            return new
+        if isinstance(obj, DictionaryObject):
+            new = DictionaryObject()
+            for key, value in obj.items():
+                new[key] = self._translate_value(value, queue)
+            return new
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self._translate_value(value, queue) for value in obj])
+        return obj
+    
+    def _translate_value(self, value, queue):
+        """Translate value, within a dictionary or array."""
+        if isinstance(value, StreamObject):
+            # Streams must be indirect objects.
+            idnum = self._new_id()
+            queue.append((idnum, value))
+            return IndirectObject(idnum, 0, self)
+        return self._translate(value, queue)
+    
+    def _write_object(self, idnum, obj):
+        self._offsets[idnum - 1] = self._stream.tell()
+        self._stream.write('%i 0 obj\n' % idnum)
+        obj.writeToStream(self._stream, None)
+        self._stream.write('\nendobj\n')
+    
+    def _write_queue(self, queue):
+        while queue:
+            idnum, obj = queue.pop()
+            self._write_object(idnum, self._translate(obj, queue))
+    
+    def _write_page(self, page):
+        idnum = self._page_id(page)
+        queue = []
+        new = DictionaryObject()
+        for key, value in page.items():
+            if key != '/Parent':
+                new[key] = self._translate_value(value, queue)
+        new[NameObject('/Parent')] = IndirectObject(self._pages_id, 0, self)
+        self._write_object(idnum, new)
+        self._write_queue(queue)
+        self._kids.append(idnum)
+        # Let the readers forget the objects they parsed for this page.
+        # Those already written are known by number, and any others
+        # will be parsed again if needed.
+        for reader in self._external:
+            if hasattr(reader, 'resolvedObjects'):
+                reader.resolvedObjects.clear()
+    
+    def write(self, stream):
+        """Write the PDF file to stream, producing the pages as it goes."""
+        self._stream = stream
+        stream.write('%PDF-1.3\n')
+        pages = self._pages
+        if callable(pages):
+            pages = pages(self)
+        for page in pages:
+            self._write_page(page)
+        
+        pages = DictionaryObject()
+        pages[NameObject('/Type')] = NameObject('/Pages')
+        pages[NameObject('/Count')] = NumberObject(len(self._kids))
+        pages[NameObject('/Kids')] = ArrayObject([IndirectObject(idnum, 0, self)
+                                                  for idnum in self._kids])
+        self._write_object(self._pages_id, pages)
+        root = DictionaryObject()
+        root[NameObject('/Type')] = NameObject('/Catalog')
+        root[NameObject('/Pages')] = IndirectObject(self._pages_id, 0, self)
+        self._write_object(self._root_id, root)
+        # Objects added but not used by any page, including the info.
+        # Each is taken out of _pending before it is written, so one
+        # referring to another doesn't write that one twice.
+        while self._pending:
+            self._write_queue([self._pending.popitem()])
+        # References to pages that were never written
+        for i, offset in enumerate(self._offsets):
+            if offset is None:
+                self._write_object(i + 1, NullObject())
+        
+        xref_location = stream.tell()
+        stream.write('xref\n0 %i\n' % (len(self._offsets) + 1))
+        stream.write('%010i %05i f \n' % (0, 65535))
+        for offset in self._offsets:
+            stream.write('%010i %05i n \n' % (offset, 0))
+        trailer = DictionaryObject()
+        trailer[NameObject('/Size')] = NumberObject(len(self._offsets) + 1)
+        trailer[NameObject('/Root')] = IndirectObject(self._root_id, 0, self)
+        trailer[NameObject('/Info')] = self._info
+        stream.write('trailer\n')
+        trailer.writeToStream(stream, None)
+        stream.write('\nstartxref\n%i\n%%%%EOF\n' % xref_location)
+        self._stream = None
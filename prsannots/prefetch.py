@@ -0,0 +1,139 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Read files from the reader ahead of time, in a background thread.
+
+Syncing a book reads its drawings, notes, and PDF from the reader, and
+then spends a while working on them.  Reading over USB and working on
+the PDFs take about as long as each other, so doing them one after the
+other leaves the reader idle half the time, and the CPU the other half.
+A Prefetcher reads the files of the next few books while the current
+one is worked on.
+
+Files are added in groups, one for each book, in the order they will be
+used.  The files of a group are read in order of their directories,
+which keeps the reads on the reader together.  Only window groups past
+the one in use are read ahead.  Once a file from a later group is asked
+for, the earlier groups are forgotten, freeing their memory and letting
+the reading move on.  Files larger than max_size, such as big scanned
+PDFs, are not read; they are better memory-mapped when used.
+"""
+
+import os
+import threading
+
+DEFAULT_WINDOW = 2
+# Files larger than this (in bytes) are left to be read when used.
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+
+class Prefetcher(object):
+    """Reads groups of files in a background thread, keeping at most
+    window groups ahead of the one in use.
+    
+    """
+    
+    def __init__(self, window=DEFAULT_WINDOW, max_size=DEFAULT_MAX_SIZE):
+        self.window = window
+        self.max_size = max_size
+        self._groups = []      # The files of each group, in reading order
+        self._group_of = {}    # The group of each file
+        self._data = {}        # The contents of the files read, or None
+        self._current = 0      # The group in use
+        self._next = 0         # The group being read
+        self._closed = False
+        self._stopped = False  # Set once the thread has finished
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='prefetch')
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def add(self, filenames):
+        """Add a group of files to be read."""
+        with self._cond:
+            n = len(self._groups)
+            self._groups.append(sorted(filenames, key=os.path.split))
+            for filename in filenames:
+                self._group_of.setdefault(filename, n)
+            self._cond.notify_all()
+    
+    def _run(self):
+        try:
+            self._read_groups()
+        except Exception:
+            # Perhaps a MemoryError.  get() falls back to reading the files.
+            pass
+        finally:
+            with self._cond:
+                self._stopped = True
+                self._cond.notify_all()
+    
+    def _read_groups(self):
+        while True:
+            with self._cond:
+                while not self._closed and (self._next >= len(self._groups) or
+                                            self._next > self._current + self.window):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                if self._next < self._current:
+                    # Already passed by
+                    self._next += 1
+                    continue
+                n = self._next
+                filenames = self._groups[n]
+            for filename in filenames:
+                try:
+                    if os.path.getsize(filename) > self.max_size:
+                        data = None
+                    else:
+                        fd = open(filename, 'rb')
+                        try:
+                            data = fd.read()
+                        finally:
+                            fd.close()
+                except (IOError, OSError):
+                    # Let whoever wants it fail when reading it.
+                    data = None
+                with self._cond:
+                    if self._closed or n < self._current:
+                        break
+                    self._data[filename] = data
+                    self._cond.notify_all()
+            with self._cond:
+                self._next = max(self._next, n + 1)
+                self._cond.notify_all()
+    
+    def _forget_before(self, n):
+        """Drop the contents of the groups before n."""
+        for group in self._groups[self._current:n]:
+            for filename in group:
+                self._data.pop(filename, None)
+        self._current = n
+    
+    def get(self, filename):
+        """The contents of filename, waiting for it to be read if it
+        will be.  Returns None if filename was not added, was too large,
+        or could not be read.
+        
+        """
+        with self._cond:
+            n = self._group_of.get(filename)
+            if n is None or n < self._current:
+                return None
+            if n > self._current:
+                self._forget_before(n)
+                self._cond.notify_all()
+            while (filename not in self._data and self._next <= n and not self._closed
+                   and not self._stopped):
+                self._cond.wait()
+            return self._data.get(filename)
+    
+    def close(self):
+        """Stop reading and forget everything read."""
+        with self._cond:
+            self._closed = True
+            self._data = {}
+            self._cond.notify_all()
+        self._thread.join()
@@ -0,0 +1,185 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Profiling hooks for the command-line scripts.
+
+Each script calls start_from_argv() at startup.  This removes the
+following options from the command line, so the scripts never see them:
+  
+  --profile FILE     Run the command under cProfile, writing the stats
+                     to FILE when it exits.  Use '-' to print a summary
+                     to standard error instead.
+  --profile-memory   Report the peak memory used by the functions
+                     decorated with @sample_memory, along with the top
+                     allocations if tracemalloc is available.
+"""
+
+import sys
+import time
+import atexit
+from functools import wraps
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILE_OPTION = '--profile'
+MEMORY_OPTION = '--profile-memory'
+TOP_ALLOCATIONS = 10
+
+_memory_samples = None  # A list, when memory sampling is on
+# For each sampled call in progress, the highest peak traced memory from
+# before tracemalloc's peak was last reset for an inner call.
+_peaks = []
+
+def pop_profile_args(argv):
+    """Remove the profiling options from argv, in place.
+    
+    Inputs: argv    A list of command line arguments.  The first is the
+                    program name, and is ignored.
+    
+    Output: A tuple (filename, memory), where filename is the argument
+            to --profile (or None) and memory is True if
+            --profile-memory was given.
+    
+    """
+    filename = None
+    memory = False
+    i = 1
+    while i < len(argv):
+        arg = argv[i]
+        if arg == MEMORY_OPTION:
+            memory = True
+            del argv[i]
+        elif arg == PROFILE_OPTION:
+            if i + 1 >= len(argv):
+                raise ValueError, "%s requires a file name" % PROFILE_OPTION
+            filename = argv[i+1]
+            del argv[i:i+2]
+        elif arg.startswith(PROFILE_OPTION + '='):
+            filename = arg[len(PROFILE_OPTION)+1:]
+            del argv[i]
+        elif arg == '--':
+            break
+        else:
+            i += 1
+    return filename, memory
+
+def start_from_argv():
+    """Start profiling as requested on the command line.
+    
+    The profiling options are removed from both sys.argv and
+    prsannots.misc.u_argv, and the results are written out when the
+    program exits.
+    
+    """
+    from misc import u_argv
+    
+    try:
+        filename, memory = pop_profile_args(u_argv)
+    except ValueError, e:
+        print >>sys.stderr, e
+        sys.exit(1)
+    # u_argv is decoded from sys.argv, so the same arguments come out.
+    pop_profile_args(sys.argv)
+    
+    if memory:
+        start_memory_sampling()
+        atexit.register(report_memory)
+    if filename is not None:
+        start_profile(filename)
+
+def start_profile(filename):
+    """Profile the rest of the program, writing the results to filename
+    (or a summary to standard error, if filename is '-') at exit.
+    
+    """
+    import cProfile
+    profile = cProfile.Profile()
+    
+    def finish():
+        profile.disable()
+        if filename == '-':
+            import pstats
+            pstats.Stats(profile, stream=sys.stderr).sort_stats('cumulative').print_stats(40)
+        else:
+            profile.dump_stats(filename)
+            print >>sys.stderr, "Profile written to %s" % filename
+    
+    atexit.register(finish)
+    profile.enable()
+
+def start_memory_sampling():
+    global _memory_samples
+    _memory_samples = []
+    if tracemalloc is not None:
+        tracemalloc.start()
+
+def _peak_rss():
+    """The peak resident set size of this process, in bytes, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak *= 1024  # Reported in kilobytes, except on OS X
+    return peak
+
+def sample_memory(label):
+    """Decorator recording the memory used by each call of a function,
+    when memory sampling is on.  Otherwise, the function is called
+    without any overhead beyond a check.
+    
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kw):
+            if _memory_samples is None:
+                return func(*args, **kw)
+            
+            start = time.time()
+            if tracemalloc is not None:
+                before, peak = tracemalloc.get_traced_memory()
+                # Resetting the peak loses that of the calls we're in, so
+                # keep it for them.
+                if _peaks:
+                    _peaks[-1] = max(_peaks[-1], peak)
+                _peaks.append(0)
+                if hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+            try:
+                return func(*args, **kw)
+            finally:
+                sample = {'label': label, 'time': time.time() - start, 'rss': _peak_rss()}
+                if tracemalloc is not None:
+                    peak = max(_peaks.pop(), tracemalloc.get_traced_memory()[1])
+                    if _peaks:
+                        _peaks[-1] = max(_peaks[-1], peak)
+                    sample['peak'] = peak - before
+                    sample['top'] = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]
+                _memory_samples.append(sample)
+        return wrapper
+    return decorator
+
+def report_memory(stream=sys.stderr):
+    """Print the memory samples taken so far."""
+    if not _memory_samples:
+        print >>stream, "No memory samples taken."
+        return
+    if tracemalloc is None:
+        print >>stream, "tracemalloc is not available; only the peak resident size is reported."
+    for sample in _memory_samples:
+        line = "%s: %.3f s" % (sample['label'], sample['time'])
+        if 'peak' in sample:
+            line += ", peak allocated %.1f MB" % (sample['peak'] / 1048576.)
+        if sample['rss'] is not None:
+            line += ", peak process size %.1f MB" % (sample['rss'] / 1048576.)
+        print >>stream, line
+        for stat in sample.get('top', ()):
+            print >>stream, "    %s" % stat
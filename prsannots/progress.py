@@ -0,0 +1,107 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+# Report bytes written at most this often.
+REPORT_INTERVAL = 64*1024
+
+class Cancelled(Exception):
+    """Raised inside a long-running operation when it has been cancelled."""
+    pass
+
+
+class Progress(object):
+    """Receives progress reports from long-running operations, and lets
+    them be cancelled.
+    
+    The reporting methods do nothing; frontends should subclass this and
+    override those they are interested in.  The operations call check()
+    between pages, so calling cancel() from a callback or another thread
+    causes a Cancelled exception to be raised there at the next page.
+    
+    """
+    
+    def __init__(self):
+        self.cancelled = False
+    
+    def cancel(self):
+        """Ask the operation in progress to stop."""
+        self.cancelled = True
+    
+    def check(self):
+        """Raise Cancelled if cancel() has been called."""
+        if self.cancelled:
+            raise Cancelled, "Operation cancelled"
+    
+    def stage(self, name, filename=None):
+        """Called when a stage (such as 'annotate' or 'write') starts."""
+        pass
+    
+    def pages(self, done, total):
+        """Called as pages are processed, with done out of total complete."""
+        pass
+    
+    def bytes_written(self, written, total=None):
+        """Called as a file is written.  total is None if not known."""
+        pass
+    
+    def file_done(self, filename):
+        """Called when filename has been completed."""
+        pass
+    
+    def file_failed(self, filename, error):
+        """Called when work on filename fails with the exception error."""
+        pass
+
+
+class NullProgress(Progress):
+    """A Progress object that reports nothing and is never cancelled.
+    It keeps no state, so that one may be shared by everything not
+    given a Progress of its own.
+    
+    """
+    
+    def __init__(self):
+        pass
+    
+    @property
+    def cancelled(self):
+        return False
+    
+    def cancel(self):
+        pass
+
+NULL_PROGRESS = NullProgress()
+
+
+class ProgressStream(object):
+    """A write-only file object that reports the bytes written through
+    it to a Progress object, and checks it for cancellation.
+    
+    """
+    
+    def __init__(self, stream, progress, total=None):
+        self.stream = stream
+        self.progress = progress
+        self.total = total
+        self.written = 0
+        self._reported = 0
+    
+    def write(self, data):
+        self.stream.write(data)
+        self.written += len(data)
+        if self.written - self._reported >= REPORT_INTERVAL:
+            self.report()
+            self.progress.check()
+    
+    def tell(self):
+        return self.stream.tell()
+    
+    def flush(self):
+        self.stream.flush()
+    
+    def report(self):
+        """Report the bytes written so far."""
+        self._reported = self.written
+        self.progress.bytes_written(self.written, self.total)
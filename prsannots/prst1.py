@@ -5,43 +5,87 @@
 
 import os
 import sqlite3
+import threading
 import generic
 
 class Reader(generic.Reader):
     
     def __init__(self, path):
         generic.Reader.__init__(self, path)
-        self.db = sqlite3.connect(os.path.join(path, 'Sony_Reader', 'database', 'books.db'))
+        self.database_path = os.path.join(path, 'Sony_Reader', 'database', 'books.db')
+        # prsam-tk imports and syncs in a worker thread, while the GUI
+        # may also look at the books.
+        self.db = sqlite3.connect(self.database_path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+    
+    def query(self, sql, parameters=()):
+        """The rows returned by the SQL statement sql, as a list.  Safe
+        to call from any thread.
+        
+        """
+        with self._db_lock:
+            c = self.db.cursor()
+            c.execute(sql, parameters)
+            return c.fetchall()
     
     def _get_books(self):
-        c = self.db.cursor()
         # markup_types:  0 bookmark
         #               10 highlight
         #               11 text
         #               12 drawing
         #               20 freehand
-        c.execute('''select books._id, books.title, books.file_path, books.thumbnail
-                        from books inner join markups
-                        on books._id = markups.content_id
-                        where books.mime_type = "application/pdf" and markups.markup_type != 0
-                        group by books._id''')
-        return [Book(self, *line) for line in c]
+        rows = self.query('''select books._id, books.title, books.file_path, books.thumbnail
+                                from books inner join markups
+                                on books._id = markups.content_id
+                                where books.mime_type = "application/pdf" and markups.markup_type != 0
+                                group by books._id''')
+        return [Book(self, *line) for line in rows]
+    
+    def markup_state(self):
+        """A dictionary mapping the file name of each annotated PDF to a
+        tuple that changes when its markups do.
+        
+        """
+        rows = self.query('''select books.file_path, count(markups._id), max(markups.modified_date)
+                                from books inner join markups
+                                on books._id = markups.content_id
+                                where books.mime_type = "application/pdf" and markups.markup_type != 0
+                                group by books._id''')
+        return dict((line[0], tuple(line[1:])) for line in rows)
+    
+    def markup_dirs(self):
+        """The directories, relative to the mount point, that hold the
+        files referred to by the markups.
+        
+        """
+        rows = self.query('''select svg_file from freehand where svg_file is not null
+                             union select file_path from annotation where file_path is not null''')
+        return set(os.path.dirname(line[0]) for line in rows)
+
+def timestamp(date):
+    """Convert a date in the database (in milliseconds) to seconds."""
+    if date is None:
+        return None
+    return date / 1000.
 
 class Book(generic.Book):
     
     def _get_annotations(self):
-        c = self.reader.db.cursor()
-        c.execute('''select page, svg_file, crop_left, crop_top, crop_right, crop_bottom, orientation
-                        from freehand
-                        where content_id = ?
-                        order by page''', (self.id,))
-        freehand = [generic.Freehand(self, *line) for line in c]
+        rows = self.reader.query('''select page, svg_file, crop_left, crop_top, crop_right,
+                                           crop_bottom, orientation, added_date, modified_date
+                                       from freehand
+                                       where content_id = ?
+                                       order by page''', (self.id,))
+        freehand = [generic.Freehand(self, *line[:7], added=timestamp(line[7]),
+                                     modified=timestamp(line[8])) for line in rows]
         
-        c.execute('''select page, marked_text, markup_type, file_path
-                        from annotation
-                        where content_id = ?
-                        order by page''', (self.id,))
-        highlight = [generic.Highlight(self, *line) for line in c]
+        rows = self.reader.query('''select page, marked_text, markup_type, file_path, added_date,
+                                           modified_date
+                                       from annotation
+                                       where content_id = ?
+                                       order by page''', (self.id,))
+        highlight = [generic.Highlight(self, *line[:4], added=timestamp(line[4]),
+                                       modified=timestamp(line[5])) for line in rows]
         
         return freehand + highlight
 
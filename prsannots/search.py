@@ -0,0 +1,174 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""A full-text index of the highlighted text and notes in a library.
+
+The index is an SQLite database kept next to the library's configuration
+file.  The Manager updates a book's entries whenever its annotation hash
+changes, so the index can be searched without the reader or the PDFs.
+If SQLite was built without FTS4, a plain table searched with LIKE is
+used instead.
+"""
+
+import os
+import glob
+import sqlite3
+
+INDEX_EXT = '.idx'
+
+class SearchIndex(object):
+    """The search index stored in filename."""
+    
+    def __init__(self, filename):
+        self.filename = filename
+        # prsam-tk syncs in a worker thread, one operation at a time.
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.text_factory = unicode
+        self.fts = self._create_tables()
+    
+    def _create_tables(self):
+        """Create the tables if needed.  Returns True if the annotations
+        table uses FTS4.
+        
+        """
+        c = self.db.cursor()
+        c.execute('''create table if not exists books
+                        (file text primary key, title text, filename text, annhash blob)''')
+        c.execute('''select sql from sqlite_master where name = "annotations"''')
+        row = c.fetchone()
+        if row is not None:
+            return 'fts4' in row[0].lower()
+        try:
+            c.execute('''create virtual table annotations using fts4
+                            (text, note, file, page, type, notindexed=file, notindexed=page,
+                             notindexed=type)''')
+            fts = True
+        except sqlite3.OperationalError:
+            c.execute('''create table annotations
+                            (text text, note text, file text, page integer, type text)''')
+            c.execute('''create index annotations_file on annotations (file)''')
+            fts = False
+        self.db.commit()
+        return fts
+    
+    def close(self):
+        self.db.close()
+    
+    def indexed_hash(self, filepath):
+        """The annotation hash of filepath when it was indexed, or None."""
+        c = self.db.cursor()
+        c.execute('select annhash from books where file = ?', (filepath,))
+        row = c.fetchone()
+        return row and str(row[0]) or None
+    
+    def update_book(self, filepath, book, filename):
+        """Index the annotations of book, stored on the reader at
+        filepath, if they have changed.  Returns True if the index was
+        updated.
+        
+        Inputs: filepath    The path of the book relative to the mount
+                            point, as used in the library.
+                
+                book        The generic.Book on the reader.
+                
+                filename    The annotated PDF on the computer.
+        
+        """
+        if self.indexed_hash(filepath) == book.hash:
+            return False
+        from export import annotation_record
+        from generic import Freehand
+        
+        c = self.db.cursor()
+        c.execute('delete from annotations where file = ?', (filepath,))
+        c.execute('insert or replace into books values (?, ?, ?, ?)',
+                  (filepath, book.title, filename, sqlite3.Binary(book.hash)))
+        for ann in book.annotations:
+            if isinstance(ann, Freehand):
+                continue
+            record = annotation_record(ann, bboxes=False)
+            c.execute('insert into annotations (text, note, file, page, type) values (?, ?, ?, ?, ?)',
+                      (record['text'], record['note'], filepath, record['page'], record['type']))
+        self.db.commit()
+        return True
+    
+    def remove_book(self, filepath):
+        """Remove filepath from the index."""
+        c = self.db.cursor()
+        c.execute('delete from annotations where file = ?', (filepath,))
+        c.execute('delete from books where file = ?', (filepath,))
+        self.db.commit()
+    
+    def search(self, query, limit=None):
+        """Find the annotations matching query.
+        
+        With FTS4, query uses the full-text query syntax, so
+        'word*' finds prefixes and '"two words"' finds phrases.  Without
+        it, or if the query cannot be parsed, every word in query must
+        appear in the highlighted text or the note.
+        
+        Output: A list of dictionaries with keys file, title, filename,
+                page, type, text, note, and score, best first (see
+                rank_key()).  If limit is not None, only that many are
+                returned.
+        
+        """
+        select = '''select books.file, books.title, books.filename, annotations.page,
+                           annotations.type, annotations.text, annotations.note
+                        from annotations inner join books on annotations.file = books.file'''
+        c = self.db.cursor()
+        rows = None
+        if self.fts:
+            try:
+                c.execute(select + ' where annotations match ?', (query,))
+                rows = c.fetchall()
+            except sqlite3.OperationalError:
+                pass
+        if rows is None:
+            words = query.split()
+            where = ' and '.join(['(annotations.text like ? or annotations.note like ?)'] * len(words))
+            params = []
+            for word in words:
+                params.extend(['%' + word.strip('"*') + '%'] * 2)
+            c.execute(select + (where and ' where ' + where), params)
+            rows = c.fetchall()
+        keys = ('file', 'title', 'filename', 'page', 'type', 'text', 'note')
+        results = [dict(zip(keys, row)) for row in rows]
+        for result in results:
+            result['score'] = score(query, result['text'], result['note'])
+        results.sort(key=rank_key)
+        if limit is not None:
+            results = results[:limit]
+        return results
+
+def _query_words(query):
+    """The words of query, without full-text query syntax."""
+    words = [word.strip('"*()').lower() for word in query.split()
+             if word not in ('AND', 'OR', 'NOT') and not word.startswith('NEAR')]
+    return [word for word in words if word]
+
+def score(query, text, note):
+    """How well an annotation with highlighted text and note matches
+    query: the number of times the words of query appear in them.
+    
+    """
+    haystack = ((text or '') + ' ' + (note or '')).lower()
+    return sum(haystack.count(word) for word in _query_words(query))
+
+def rank_key(result):
+    """The key to sort results from SearchIndex.search() by: best score
+    first, and then by title and page.  Results from several indices are
+    merged by sorting them with this.
+    
+    """
+    return (-result['score'], result['title'], result['page'])
+
+def index_filename(config_file):
+    """The index that goes with the library in config_file."""
+    return os.path.splitext(config_file)[0] + INDEX_EXT
+
+def index_files(config_dir):
+    """All the indices in config_dir."""
+    return glob.glob(os.path.join(config_dir, '*' + INDEX_EXT))
@@ -0,0 +1,164 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import time
+from contextlib import contextmanager
+
+COUNTERS = ('pages', 'annotations', 'bytes_read', 'bytes_written')
+
+class Stats(object):
+    """Records where the time goes while working on files.
+    
+    Work is divided up by file and by stage.  For each combination, the
+    wall time is recorded, along with the counters in COUNTERS.  Stages
+    may be nested; the time of the inner stage is not counted in the
+    outer one.
+    
+    Use as:
+        with stats.file(filename):
+            with stats.stage('layout'):
+                ...
+                stats.count('pages', 10)
+    
+    """
+    
+    def __init__(self):
+        self.records = {}
+        # Settings that change how the work is done, such as the
+        # prefetch window
+        self.settings = {}
+        self.files = []    # In the order they were first seen
+        self.stages = []   # Likewise
+        self._file = None
+        self._stack = []   # [stage name, start time] for each open stage
+    
+    def _record(self, filename, stage):
+        if filename not in self.files:
+            self.files.append(filename)
+        if stage not in self.stages:
+            self.stages.append(stage)
+        key = (filename, stage)
+        if key not in self.records:
+            self.records[key] = dict.fromkeys(COUNTERS, 0)
+            self.records[key]['time'] = 0.
+        return self.records[key]
+    
+    def _stop_clock(self, now):
+        if self._stack:
+            stage, start = self._stack[-1]
+            self._record(self._file, stage)['time'] += now - start
+    
+    def _start_clock(self, now):
+        if self._stack:
+            self._stack[-1][1] = now
+    
+    @contextmanager
+    def file(self, filename):
+        """Attribute work in the with block to filename."""
+        outer = self._file
+        now = time.time()
+        self._stop_clock(now)
+        self._file = filename
+        self._start_clock(now)
+        try:
+            yield
+        finally:
+            now = time.time()
+            self._stop_clock(now)
+            self._file = outer
+            self._start_clock(now)
+    
+    @contextmanager
+    def stage(self, name):
+        """Attribute work in the with block to the stage name."""
+        now = time.time()
+        self._stop_clock(now)
+        self._stack.append([name, now])
+        self._record(self._file, name)
+        try:
+            yield
+        finally:
+            self._stop_clock(time.time())
+            self._stack.pop()
+            self._start_clock(time.time())
+    
+    def count(self, counter, n=1):
+        """Add n to counter for the current file and stage."""
+        stage = self._stack and self._stack[-1][0] or None
+        self._record(self._file, stage)[counter] += n
+    
+    def setting(self, name, value):
+        """Note that the setting name had value for this work."""
+        self.settings[name] = value
+    
+    def totals(self):
+        """A dictionary mapping each stage to its record, summed over files."""
+        totals = {}
+        for (filename, stage), record in self.records.items():
+            total = totals.setdefault(stage, dict.fromkeys(record, 0))
+            for k, v in record.items():
+                total[k] += v
+        return totals
+    
+    def as_dict(self):
+        """The statistics as a dictionary, suitable for JSON output."""
+        def entries(records):
+            return [dict(records[stage], stage=stage) for stage in self.stages
+                    if stage in records]
+        
+        files = []
+        for filename in self.files:
+            records = dict((stage, record) for (f, stage), record in self.records.items()
+                           if f == filename)
+            files.append({'file': filename, 'stages': entries(records)})
+        return {'files': files, 'totals': entries(self.totals()), 'settings': self.settings}
+    
+    def format_table(self):
+        """The statistics as a human-readable table."""
+        lines = []
+        header = '%-12s %9s %6s %6s %11s %11s' % ('stage', 'time (s)', 'pages',
+                                                  'annots', 'read', 'written')
+        def add(records):
+            for stage in self.stages:
+                if stage in records:
+                    r = records[stage]
+                    lines.append('%-12s %9.3f %6i %6i %11i %11i' % (
+                        stage or '-', r['time'], r['pages'], r['annotations'],
+                        r['bytes_read'], r['bytes_written']))
+        
+        for filename in self.files:
+            lines.append(filename or '(no file)')
+            lines.append(header)
+            add(dict((stage, record) for (f, stage), record in self.records.items()
+                     if f == filename))
+            lines.append('')
+        lines.append('Total')
+        lines.append(header)
+        add(self.totals())
+        if self.settings:
+            lines.append('')
+            lines.append('Settings: ' + ', '.join('%s=%s' % item
+                                                  for item in sorted(self.settings.items())))
+        return '\n'.join(lines)
+
+
+class NullStats(object):
+    """A Stats object that records nothing."""
+    
+    @contextmanager
+    def file(self, filename):
+        yield
+    
+    @contextmanager
+    def stage(self, name):
+        yield
+    
+    def count(self, counter, n=1):
+        pass
+    
+    def setting(self, name, value):
+        pass
+
+NULL_STATS = NullStats()
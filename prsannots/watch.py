@@ -0,0 +1,211 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import os
+import time
+import sqlite3
+
+from manager import Manager
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# How often to look for the reader or, without inotify, for changes (s)
+POLL_INTERVAL = 2.
+# How long the reader must be quiet after a change before we sync (s)
+DEBOUNCE = 3.
+
+class PollingMonitor(object):
+    """Notices changes to a set of files and directories by polling
+    their modification times and sizes.
+    
+    """
+    
+    def __init__(self, paths, interval=POLL_INTERVAL):
+        self.paths = paths
+        self.interval = interval
+        self._state = self._snapshot()
+    
+    def _snapshot(self):
+        state = {}
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                state[path] = None
+            else:
+                state[path] = (st.st_mtime, st.st_size)
+        return state
+    
+    def wait(self, timeout):
+        """Return True if something changes within timeout seconds,
+        False otherwise.
+        
+        """
+        deadline = time.time() + timeout
+        while True:
+            state = self._snapshot()
+            if state != self._state:
+                self._state = state
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.interval, remaining))
+    
+    def close(self):
+        pass
+
+
+class InotifyMonitor(object):
+    """Notices changes to a set of files and directories with inotify.
+    Files are watched through the directories that contain them.
+    
+    """
+    
+    mask = (getattr(pyinotify, 'IN_MODIFY', 0) | getattr(pyinotify, 'IN_CLOSE_WRITE', 0) |
+            getattr(pyinotify, 'IN_CREATE', 0) | getattr(pyinotify, 'IN_DELETE', 0) |
+            getattr(pyinotify, 'IN_MOVED_TO', 0) | getattr(pyinotify, 'IN_UNMOUNT', 0))
+    
+    def __init__(self, paths):
+        self.watch_manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.watch_manager, lambda event: None)
+        dirs = set(os.path.isdir(p) and p or os.path.dirname(p) for p in paths)
+        for d in dirs:
+            if os.path.isdir(d):
+                self.watch_manager.add_watch(d, self.mask)
+    
+    def wait(self, timeout):
+        """Return True if something changes within timeout seconds,
+        False otherwise.
+        
+        """
+        if self.notifier.check_events(int(timeout * 1000)):
+            self.notifier.read_events()
+            self.notifier.process_events()
+            return True
+        return False
+    
+    def close(self):
+        self.notifier.stop()
+
+
+class Watcher(object):
+    """Waits for a reader to be mounted, and then syncs the books whose
+    annotations change until it is unmounted.
+    
+    The same Manager, and so the same Book objects, are used for as long
+    as the reader is mounted.  This keeps the layouts of the PDF files
+    from being recomputed each time.
+    
+    """
+    
+    def __init__(self, interval=POLL_INTERVAL, debounce=DEBOUNCE, log=None, progress=None):
+        """Inputs: interval    How often to check for the reader, and for
+                                changes if inotify is not available.
+                    
+                    debounce    How long the reader must be quiet after a
+                                change before syncing.
+                    
+                    log         A function to call with messages.
+                    
+                    progress    A progress.Progress object for the Manager.
+        
+        """
+        self.interval = interval
+        self.debounce = debounce
+        self.log = log or (lambda message: None)
+        self.progress = progress
+    
+    def wait_for_reader(self):
+        """Return a Manager, once a known reader is mounted."""
+        while True:
+            m = Manager()
+            if m.load_mounted_reader():
+                if self.progress is not None:
+                    m.progress = self.progress
+                return m
+            time.sleep(self.interval)
+    
+    def mounted(self, m):
+        return os.path.exists(m.reader.database_path)
+    
+    def monitor(self, m):
+        """A monitor for the database and the markup files of m's reader."""
+        db = m.reader.database_path
+        paths = [db, db + '-journal', db + '-wal', os.path.dirname(db)]
+        for d in m.reader.markup_dirs():
+            paths.append(os.path.join(m.mount, *d.split('/')))
+        if pyinotify is not None:
+            return InotifyMonitor(paths)
+        return PollingMonitor(paths, self.interval)
+    
+    def sync(self, m, changed=None):
+        """Sync the books in changed (a set of file names, as stored in the
+        reader's database), or all of them if None.  Returns the number
+        of annotated files written.
+        
+        """
+        m.reload()
+        m.reader.refresh(changed)
+        m.skipped_writes = []
+        m.layout_failures = {}
+        count = 0
+        files = [f for f in m.library
+                 if changed is None or f.replace(os.path.sep, '/') in changed]
+        with m.syncing([f for f in files if m.needs_sync(f)]):
+            for filepath in files:
+                try:
+                    if m.sync_pdf(filepath):
+                        count += 1
+                        self.log("Synced %s" % m.library[filepath]['filename'])
+                except Exception, e:
+                    self.log("Error syncing %s: %s" % (filepath, e))
+        for message in m.layout_failure_messages():
+            self.log(message)
+        count -= len(m.skipped_writes)
+        m.save()
+        return count
+    
+    def watch_reader(self, m):
+        """Sync m's reader as it changes, returning once it is unmounted."""
+        state = m.reader.markup_state()
+        self.sync(m)
+        monitor = self.monitor(m)
+        try:
+            while self.mounted(m):
+                if not monitor.wait(self.interval):
+                    continue
+                # Wait for the reader to finish writing.
+                while monitor.wait(self.debounce):
+                    pass
+                if not self.mounted(m):
+                    break
+                try:
+                    new_state = m.reader.markup_state()
+                except sqlite3.Error, e:
+                    # Perhaps the database is locked; try again after the next change.
+                    self.log("Could not read database: %s" % e)
+                    continue
+                changed = set(f for f in set(state) | set(new_state)
+                              if state.get(f) != new_state.get(f))
+                state = new_state
+                if changed:
+                    self.sync(m, changed)
+        finally:
+            monitor.close()
+    
+    def run(self):
+        """Watch for readers forever."""
+        while True:
+            m = self.wait_for_reader()
+            self.log("Found reader at %s" % m.mount)
+            try:
+                self.watch_reader(m)
+            finally:
+                m.reader.db.close()
+            self.log("Reader at %s removed" % m.mount)
@@ -0,0 +1,11 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+"""Tests for prsannots, run against the fake reader of benchmarks.fixture.
+
+Run from the top of the source tree:
+  
+  python -m unittest discover tests
+"""
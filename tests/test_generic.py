@@ -0,0 +1,43 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import cPickle
+import pickle
+import unittest
+
+from prsannots.generic import DiceMap
+
+GRID = (0, 0, 100, 150, 90, 140)
+
+class DiceMapTest(unittest.TestCase):
+    
+    def check_pickle(self, dice_map):
+        for module in (pickle, cPickle):
+            for protocol in range(cPickle.HIGHEST_PROTOCOL + 1):
+                copy = module.loads(module.dumps(dice_map, protocol))
+                self.assertEqual(len(copy), len(dice_map))
+                self.assertEqual(list(copy), list(dice_map))
+    
+    def test_pickle_empty(self):
+        self.check_pickle(DiceMap())
+    
+    def test_pickle(self):
+        dice_map = DiceMap()
+        dice_map.append(0, 1, 2, GRID)
+        dice_map.append(1, 1, 2, GRID)
+        dice_map.append(2, 2, 1, GRID)
+        self.check_pickle(dice_map)
+    
+    def test_old_pickle(self):
+        """Maps pickled as the bare list of runs still load."""
+        dice_map = DiceMap()
+        dice_map.append(0, 1, 2, GRID)
+        copy = DiceMap.__new__(DiceMap)
+        copy.__setstate__(list(dice_map._runs))
+        self.assertEqual(list(copy), list(dice_map))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import unittest
+
+from prsannots import layoutworker, pagetext
+
+class FakeConnection(object):
+    
+    def __init__(self):
+        self.sent = []
+    
+    def send(self, message):
+        self.sent.append(message)
+    
+    def close(self):
+        pass
+
+def out_of_memory(fd, pages, laparams=None):
+    raise MemoryError
+
+class WorkTest(unittest.TestCase):
+    
+    def test_memory_error_without_limit(self):
+        """A worker with no memory limit that runs out of memory says so."""
+        conn = FakeConnection()
+        iter_layouts = pagetext.iter_layouts
+        pagetext.iter_layouts = out_of_memory
+        try:
+            layoutworker._work(conn, None, '', [0], None)
+        finally:
+            pagetext.iter_layouts = iter_layouts
+        self.assertEqual(conn.sent, [('failed', "it ran out of memory")])
+
+
+if __name__ == '__main__':
+    unittest.main()
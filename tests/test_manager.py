@@ -0,0 +1,156 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+from benchmarks import fixture
+from prsannots import manager, prst1, fileops, prefetch
+
+class ManagerTestCase(unittest.TestCase):
+    """A Manager for a fake reader with one annotated book, whose
+    configuration is kept in a temporary directory.
+    
+    """
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.mount = os.path.join(self.root, 'mount')
+        self.comp = os.path.join(self.root, 'comp')
+        os.makedirs(self.mount)
+        os.makedirs(self.comp)
+        fixture.make_reader(self.mount, nbooks=1, npages=3, nhighlights=2, nnotes=1, nfreehand=1)
+        self.config_dir = manager.CONFIG_DIR
+        manager.CONFIG_DIR = os.path.join(self.root, 'config')
+        self.manager = manager.Manager()
+        self.manager.settings = {'mount': self.mount, 'id': 'test'}
+        self.manager._ensure_base_settings()
+        self.manager.settings['gs'] = False
+        self.manager.reader = prst1.Reader(self.mount)
+    
+    def tearDown(self):
+        self.manager.reader.db.close()
+        manager.CONFIG_DIR = self.config_dir
+        shutil.rmtree(self.root)
+
+
+class ThreadTest(ManagerTestCase):
+    
+    def test_import_in_worker(self):
+        """prsam-tk imports in a worker thread, with the reader opened in
+        the GUI's thread.
+        
+        """
+        errors = []
+        def worker():
+            try:
+                self.manager.import_pdf('Sony_Reader/media/books/book000.pdf', self.comp, copy=True)
+            except Exception, e:
+                errors.append(e)
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(os.path.exists(os.path.join(self.comp, 'book000.annot.pdf')))
+
+
+
+class AddTest(ManagerTestCase):
+    
+    def test_file_already_on_reader(self):
+        """A file already on the reader is read only once, to see that
+        it is the same.
+        
+        """
+        filename = os.path.join(self.comp, 'new.pdf')
+        fixture.write_text_pdf(filename, fixture.page_lines(random.Random(0), 2))
+        readerfn = os.path.join(self.mount, self.manager.settings['reader_dir'], 'new.pdf')
+        shutil.copy(filename, readerfn)
+        digested = []
+        file_digest = fileops.file_digest
+        def counting_digest(filename):
+            digested.append(filename)
+            return file_digest(filename)
+        fileops.file_digest = counting_digest
+        try:
+            relfn = self.manager.add_pdf(filename)
+        finally:
+            fileops.file_digest = file_digest
+        self.assertEqual(os.path.join(self.mount, relfn), readerfn)
+        self.assertEqual(digested.count(readerfn), 1)
+
+
+
+class PrefetchTest(ManagerTestCase):
+    
+    def test_needing_sync_cached(self):
+        """needing_sync reads nothing ahead once the hashes are known."""
+        self.manager.import_all(self.comp)
+        started = []
+        Prefetcher = prefetch.Prefetcher
+        class CountingPrefetcher(Prefetcher):
+            def __init__(self, *args, **kw):
+                started.append(self)
+                Prefetcher.__init__(self, *args, **kw)
+        prefetch.Prefetcher = CountingPrefetcher
+        try:
+            self.assertEqual(self.manager.needing_sync, [])
+        finally:
+            prefetch.Prefetcher = Prefetcher
+        self.assertEqual(started, [])
+
+
+
+class DeleteTest(ManagerTestCase):
+    
+    def test_delete_without_index(self):
+        """Removing a file doesn't create the search index."""
+        filepath = 'Sony_Reader/media/books/book000.pdf'
+        self.manager.library[filepath] = {'filename': os.path.join(self.comp, 'book000.pdf'),
+                                          'infix': 'annot', 'annhash': 0, 'dice_map': None}
+        self.assertTrue(self.manager.delete(filepath))
+        self.assertFalse(os.path.exists(manager.CONFIG_DIR))
+
+
+class LayoutRetryTest(ManagerTestCase):
+    """Highlights not found in the text put in order without layout
+    analysis are looked for again with it.
+    
+    """
+    
+    def highlight(self):
+        from prsannots.generic import Highlight
+        from prsannots.pagetext import PageText
+        book = self.manager.reader.books[0]
+        ann = [a for a in book.annotations if isinstance(a, Highlight)][0]
+        # Text from which the fast path can't find anything
+        book._page_texts[ann.page] = PageText()
+        return book, ann
+    
+    def test_retry(self):
+        book, ann = self.highlight()
+        self.assertTrue(ann.bboxes)
+        self.assertEqual(ann.message, '')
+        self.assertTrue(ann.page in book._analyzed_texts)
+    
+    def test_retry_in_worker(self):
+        book, ann = self.highlight()
+        book.layout_timeout = 60
+        self.assertTrue(ann.bboxes)
+        self.assertEqual(ann.message, '')
+    
+    def test_not_found(self):
+        book, ann = self.highlight()
+        ann.area = u'not on the page'
+        self.assertEqual(ann.bboxes, None)
+        self.assertTrue('not found' in ann.message)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import unittest
+
+from prsannots.pagetext import PageText
+
+class FakeChar(object):
+    """Stands in for a pdfminer.layout.LTChar."""
+    
+    def __init__(self, text, x):
+        self.text = text
+        self.bbox = (x, 0, x + 5, 10)
+    
+    def get_text(self):
+        return self.text
+
+class EndLineTest(unittest.TestCase):
+    
+    def page_text(self, lines):
+        text = PageText()
+        for lnum, line in enumerate(lines):
+            for i, c in enumerate(line):
+                text.add(FakeChar(c, 5 * i), lnum)
+            text.end_line()
+        return text.text
+    
+    def test_hyphens(self):
+        for hyphen in (u"-", u"\u2010", u"\u2011"):
+            self.assertEqual(self.page_text([u"exam" + hyphen, u"ple"]), u"example")
+    
+    def test_soft_hyphen(self):
+        self.assertEqual(self.page_text([u"exam\u00ad", u"ple"]), u"example")
+    
+    def test_minus(self):
+        self.assertEqual(self.page_text([u"x \u2212", u"1"]), u"x-1")
+    
+    def test_blank_line(self):
+        """Only the hyphen is dropped, not the character before it."""
+        self.assertEqual(self.page_text([u"ab-", u"", u"c"]), u"abc")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import zlib
+import random
+import unittest
+
+from prsannots.pdfimages import drawn_sizes, zoom, Downsampler, SCREEN_SIZE, SCREEN_DPI
+
+def noise(size, seed=0):
+    """size bytes that don't compress."""
+    rand = random.Random(seed)
+    return ''.join(chr(rand.randint(0, 255)) for i in xrange(size))
+
+def gray_params(width, height, **kw):
+    params = {'/Type': '/XObject', '/Subtype': '/Image', '/Width': width, '/Height': height,
+              '/ColorSpace': '/DeviceGray', '/BitsPerComponent': 8}
+    params.update(kw)
+    return params
+
+class DrawnSizesTest(unittest.TestCase):
+    
+    def test_largest(self):
+        operations = [([], 'q'), ([200, 0, 0, 100, 10, 10], 'cm'), (['/Im1'], 'Do'), ([], 'Q'),
+                      ([50, 0, 0, 300, 0, 0], 'cm'), (['/Im1'], 'Do')]
+        self.assertEqual(drawn_sizes(operations), {'/Im1': (200, 300)})
+    
+    def test_nested(self):
+        operations = [([2, 0, 0, 2, 0, 0], 'cm'), ([], 'q'), ([50, 0, 0, 30, 5, 5], 'cm'),
+                      (['/Im2'], 'Do'), ([], 'Q')]
+        self.assertEqual(drawn_sizes(operations), {'/Im2': (100, 60)})
+    
+    def test_rotated(self):
+        operations = [([0, 40, -30, 0, 0, 0], 'cm'), (['/Im3'], 'Do')]
+        self.assertEqual(drawn_sizes(operations), {'/Im3': (40, 30)})
+
+class ZoomTest(unittest.TestCase):
+    
+    def test_portrait(self):
+        self.assertAlmostEqual(zoom([0, 0, 612, 792]),
+                               SCREEN_SIZE[0] * 72. / SCREEN_DPI / 612)
+    
+    def test_rotated(self):
+        """A page stored landscape but shown portrait zooms as portrait."""
+        for rotation in (90, 270, -90):
+            self.assertAlmostEqual(zoom([0, 0, 792, 612], rotation), zoom([0, 0, 612, 792]))
+        self.assertAlmostEqual(zoom([0, 0, 792, 612], 180), zoom([0, 0, 792, 612]))
+    
+    def test_page_rotation(self):
+        from pyPdf.pdf import PageObject
+        from pyPdf.generic import NameObject, NumberObject
+        from prsannots.pdfbackend import get_backend
+        backend = get_backend('pypdf')
+        page = PageObject()
+        self.assertEqual(backend.rotation(page), 0)
+        page[NameObject('/Rotate')] = NumberObject(-90)
+        self.assertEqual(backend.rotation(page), 270)
+    
+    def test_empty(self):
+        self.assertEqual(zoom([0, 0, 0, 100]), 1)
+
+class ConvertTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.downsampler = Downsampler(50, None)
+    
+    def test_resample(self):
+        """An image is resampled to the resolution it has on the screen."""
+        params = gray_params(400, 200, **{'/Filter': '/FlateDecode'})
+        data = zlib.compress(noise(400 * 200))
+        # Drawn 72 by 36 pt, twice as large on the screen: 2 by 1 in at 50 dpi
+        newparams, newdata = self.downsampler.convert(params, data, (72, 36), 2)
+        self.assertEqual((newparams['/Width'], newparams['/Height']), (100, 50))
+        self.assertEqual(newparams['/ColorSpace'], '/DeviceGray')
+        self.assertEqual(newparams['/Filter'], '/FlateDecode')
+        self.assertEqual(len(zlib.decompress(newdata)), 100 * 50)
+    
+    def test_gray_at_resolution(self):
+        """Gray images that wouldn't shrink enough are kept."""
+        params = gray_params(100, 100)
+        self.assertEqual(self.downsampler.convert(params, noise(100 * 100), (144, 144)), None)
+    
+    def test_not_smaller(self):
+        """A converted image that isn't smaller than the original is kept."""
+        params = gray_params(2, 2, **{'/ColorSpace': '/DeviceRGB'})
+        data = '\x10\x20\x30' * 4
+        self.assertTrue(len(zlib.compress('\x10' * 4)) >= len(data))
+        self.assertEqual(self.downsampler.convert(params, data, (144, 144)), None)
+    
+    def test_undecodable(self):
+        params = gray_params(100, 100, **{'/SMask': 5})
+        self.assertEqual(self.downsampler.convert(params, noise(100 * 100), (1, 1)), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import os
+import re
+import random
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from pyPdf import PdfFileReader
+
+from benchmarks.fixture import page_lines, write_text_pdf
+from prsannots.pdfoptimize import OptimizedPdfWriter, read_first_page
+
+NPAGES = 12
+
+class RecordingStream(object):
+    """A file in memory that records the furthest position read."""
+    
+    def __init__(self, data):
+        self.stream = StringIO(data)
+        self.furthest = 0
+    
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.furthest = max(self.furthest, self.stream.tell())
+        return data
+    
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class OptimizeTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'book.pdf')
+        write_text_pdf(self.filename, page_lines(random.Random(0), NPAGES))
+        self.original = open(self.filename, 'rb').read()
+        output = StringIO()
+        OptimizedPdfWriter(PdfFileReader(StringIO(self.original))).write(output)
+        self.data = output.getvalue()
+    
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+    
+    def linearization(self):
+        match = re.search(r'<<\s*/Linearized\s(.*?)>>', self.data[:1024], re.S)
+        self.assertTrue(match)
+        return dict((key, int(value)) for key, value
+                    in re.findall(r'/(\w+)\s+(\d+)', match.group(1)))
+    
+    def test_pages(self):
+        original = PdfFileReader(StringIO(self.original))
+        optimized = PdfFileReader(StringIO(self.data))
+        self.assertEqual(optimized.getNumPages(), NPAGES)
+        for i in range(NPAGES):
+            self.assertEqual(optimized.getPage(i).getContents().getData(),
+                             original.getPage(i).getContents().getData())
+    
+    def test_linearized(self):
+        values = self.linearization()
+        self.assertEqual(values['L'], len(self.data))
+        self.assertEqual(values['N'], NPAGES)
+        optimized = PdfFileReader(StringIO(self.data))
+        self.assertEqual(values['O'], optimized.getPage(0).indirectRef.idnum)
+        self.assertTrue(values['E'] < len(self.data))
+    
+    def test_read_first_page(self):
+        """Only the start of a linearized file is read for the first page."""
+        stream = RecordingStream(self.data)
+        self.assertTrue(read_first_page(stream) > 0)
+        self.assertTrue(stream.furthest <= self.linearization()['E'])
+    
+    def test_read_first_page_unlinearized(self):
+        stream = RecordingStream(self.original)
+        self.assertTrue(read_first_page(stream) > 0)
+        self.assertEqual(stream.furthest, len(self.original))
+
+
+if __name__ == '__main__':
+    unittest.main()
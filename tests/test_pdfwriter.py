@@ -0,0 +1,101 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import os
+import re
+import random
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from pyPdf import PdfFileReader
+from pyPdf.generic import DictionaryObject, ArrayObject, NameObject, NumberObject, NullObject
+
+from benchmarks.fixture import page_lines, write_text_pdf
+from prsannots import pdfwriter
+from prsannots.pdfwriter import StreamingPdfWriter
+from prsannots.pdfbackend import get_backend
+from prsannots.pdfdice import dice
+
+NPAGES = 5
+
+class StreamingPdfWriterTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'book.pdf')
+        write_text_pdf(self.filename, page_lines(random.Random(0), NPAGES))
+        self.streaming_pages = pdfwriter.STREAMING_PAGES
+    
+    def tearDown(self):
+        pdfwriter.STREAMING_PAGES = self.streaming_pages
+        shutil.rmtree(self.dir)
+    
+    def reader(self):
+        return PdfFileReader(StringIO(open(self.filename, 'rb').read()))
+    
+    def diced(self, streaming_pages):
+        pdfwriter.STREAMING_PAGES = streaming_pages
+        backend = get_backend('pypdf')
+        outpdf, dice_map = dice(self.reader(), 2, 2, backend=backend)
+        stream = StringIO()
+        backend.write(outpdf, stream)
+        return stream.getvalue()
+    
+    def test_dice(self):
+        """Diced pages written a page at a time match those written at once."""
+        streamed, whole = self.diced(0), self.diced(10**6)
+        self.assertNotEqual(streamed, whole)
+        streamed, whole = PdfFileReader(StringIO(streamed)), PdfFileReader(StringIO(whole))
+        self.assertEqual(streamed.getNumPages(), 4 * NPAGES)
+        self.assertEqual(streamed.getNumPages(), whole.getNumPages())
+        for i in range(whole.getNumPages()):
+            spage, wpage = streamed.getPage(i), whole.getPage(i)
+            for box in ('/MediaBox', '/CropBox'):
+                self.assertEqual(list(spage[box]), list(wpage[box]))
+            self.assertEqual(spage.getContents().getData(), wpage.getContents().getData())
+            self.assertEqual(spage['/Resources']['/Font']['/F1'].getObject(),
+                             wpage['/Resources']['/Font']['/F1'].getObject())
+    
+    def test_pending_written_once(self):
+        """An added object used only by another added one is written once."""
+        writer = StreamingPdfWriter([])
+        first = writer._addObject(DictionaryObject({NameObject('/N'): NumberObject(1)}))
+        second = writer._addObject(DictionaryObject({NameObject('/Next'): first}))
+        stream = StringIO()
+        writer.write(stream)
+        data = stream.getvalue()
+        numbers = re.findall(r'^(\d+) 0 obj$', data, re.M)
+        self.assertEqual(sorted(numbers), sorted(set(numbers)))
+        pdf = PdfFileReader(StringIO(data))
+        obj = pdf.getObject(second)['/Next']
+        self.assertEqual(obj['/N'], 1)
+    
+    def link(self, page):
+        link = DictionaryObject()
+        link[NameObject('/Type')] = NameObject('/Annot')
+        link[NameObject('/Subtype')] = NameObject('/Link')
+        link[NameObject('/Rect')] = ArrayObject([NumberObject(0)] * 4)
+        link[NameObject('/Dest')] = ArrayObject([page.indirectRef, NameObject('/Fit')])
+        return link
+    
+    def test_links(self):
+        """Links to later pages are kept, and to pages not written nulled."""
+        reader = self.reader()
+        first, later, missing = [reader.getPage(i) for i in range(3)]
+        first[NameObject('/Annots')] = ArrayObject([self.link(later), self.link(missing)])
+        stream = StringIO()
+        StreamingPdfWriter([first, later]).write(stream)
+        pdf = PdfFileReader(StringIO(stream.getvalue()))
+        self.assertEqual(pdf.getNumPages(), 2)
+        annots = pdf.getPage(0)['/Annots']
+        self.assertEqual(annots[0].getObject()['/Dest'][0].idnum,
+                         pdf.getPage(1).indirectRef.idnum)
+        self.assertTrue(isinstance(annots[1].getObject()['/Dest'][0].getObject(), NullObject))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from prsannots.prefetch import Prefetcher
+
+class FailingPrefetcher(Prefetcher):
+    
+    def _read_groups(self):
+        raise MemoryError
+
+class PrefetcherTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.small = os.path.join(self.dir, 'small')
+        self.large = os.path.join(self.dir, 'large')
+        open(self.small, 'wb').write('x' * 10)
+        open(self.large, 'wb').write('x' * 1000)
+    
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+    
+    def test_read(self):
+        prefetcher = Prefetcher(max_size=100)
+        try:
+            prefetcher.add([self.small, self.large])
+            self.assertEqual(prefetcher.get(self.small), 'x' * 10)
+            # Left to be read when used
+            self.assertEqual(prefetcher.get(self.large), None)
+        finally:
+            prefetcher.close()
+    
+    def test_failed_thread(self):
+        """get() doesn't wait for a thread that has died."""
+        prefetcher = FailingPrefetcher()
+        try:
+            prefetcher.add([self.small])
+            self.assertEqual(prefetcher.get(self.small), None)
+        finally:
+            prefetcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import unittest
+
+from prsannots import profiling
+
+class FakeSnapshot(object):
+    
+    def statistics(self, key):
+        return []
+
+class FakeTracemalloc(object):
+    """Traces the memory allocated with allocate() and freed with free()."""
+    
+    def __init__(self):
+        self.current = self.peak = 0
+    
+    def allocate(self, size):
+        self.current += size
+        self.peak = max(self.peak, self.current)
+    
+    def free(self, size):
+        self.current -= size
+    
+    def get_traced_memory(self):
+        return self.current, self.peak
+    
+    def reset_peak(self):
+        self.peak = self.current
+    
+    def take_snapshot(self):
+        return FakeSnapshot()
+
+class SampleMemoryTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tracemalloc = profiling.tracemalloc
+        profiling.tracemalloc = self.fake = FakeTracemalloc()
+        profiling._memory_samples = []
+    
+    def tearDown(self):
+        profiling.tracemalloc = self.tracemalloc
+        profiling._memory_samples = None
+    
+    def test_nested(self):
+        """An inner sampled call doesn't hide the outer call's peak."""
+        @profiling.sample_memory('inner')
+        def inner():
+            self.fake.allocate(10)
+            self.fake.free(10)
+        
+        @profiling.sample_memory('outer')
+        def outer():
+            self.fake.allocate(100)
+            self.fake.free(100)
+            inner()
+            self.fake.allocate(5)
+        
+        outer()
+        peaks = dict((s['label'], s['peak']) for s in profiling._memory_samples)
+        self.assertEqual(peaks, {'inner': 10, 'outer': 100})
+
+
+if __name__ == '__main__':
+    unittest.main()
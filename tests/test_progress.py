@@ -0,0 +1,28 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import unittest
+
+from prsannots.progress import Progress, Cancelled, NULL_PROGRESS
+
+class ProgressTest(unittest.TestCase):
+    
+    def test_cancel(self):
+        progress = Progress()
+        progress.check()
+        progress.cancel()
+        self.assertRaises(Cancelled, progress.check)
+    
+    def test_null_progress_stateless(self):
+        """Cancelling the shared null object cancels nothing after."""
+        NULL_PROGRESS.cancel()
+        NULL_PROGRESS.check()
+        self.assertFalse(NULL_PROGRESS.cancelled)
+        self.assertRaises(AttributeError, setattr, NULL_PROGRESS, 'cancelled', True)
+        NULL_PROGRESS.check()
+
+
+if __name__ == '__main__':
+    unittest.main()
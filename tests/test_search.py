@@ -0,0 +1,46 @@
+# Copyright 2013 Robert Schroll
+#
+# This file is part of prsannots and is distributed under the terms of
+# the LGPL license.  See the file COPYING for full details.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from prsannots.search import SearchIndex, rank_key
+
+class SearchTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+    
+    def index(self, name, title, texts):
+        index = SearchIndex(os.path.join(self.dir, name))
+        index.db.execute('insert into books values (?, ?, ?, ?)',
+                         (name, title, name + '.pdf', None))
+        for page, text in enumerate(texts):
+            index.db.execute('insert into annotations (text, note, file, page, type) '
+                             'values (?, ?, ?, ?, ?)', (text, None, name, page, 'highlight'))
+        index.db.commit()
+        return index
+    
+    def test_rank_across_indices(self):
+        """The best matches are kept when merging limited results."""
+        first = self.index('a', u'A', [u'energy', u'energy', u'energy'])
+        second = self.index('b', u'B', [u'energy energy energy', u'nothing'])
+        try:
+            results = first.search(u'energy', 1) + second.search(u'energy', 1)
+        finally:
+            first.close()
+            second.close()
+        results.sort(key=rank_key)
+        self.assertEqual((results[0]['title'], results[0]['score']), (u'B', 3))
+        self.assertEqual(len(results), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()